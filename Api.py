@@ -0,0 +1,129 @@
+import builtins
+import ctypes
+
+import llvmlite.binding as llvm
+
+import Driver
+from Context import Context
+from Node import FunDefNode, Node, StatementsNode
+
+"""
+Python API, compile Heiabubu source in this process and call its functions like python functions:
+
+    program = compile_source(source)
+    program.scale(numpy_array, len(numpy_array), 0.5)
+
+Lists are passed zero copy from anything with the buffer protocol, like numpy arrays, array.array or bytearray
+"""
+
+
+def compile_source(text: str, name: str = 'api') -> 'Program':
+    """
+    Compile Heiabubu source to machine code for this cpu and run its top level code.
+    Every top level function becomes a callable of the returned Program, a Heiabubu Error is raised if compiling fails
+    """
+    ctx = Context(None, f'load_{name}', name, text)
+    builder = Driver.build(ctx, jit=True, prepare=export_all)
+    module_ref = Driver.opt(builder.module, jit=True)
+    if module_ref is None:
+        raise builtins.RuntimeError('llvm could not parse the generated module')
+    engine = llvm.create_mcjit_compiler(module_ref, Driver.target_machine(jit=True))
+    engine.finalize_object()
+    engine.run_static_constructors()
+
+    program = Program(engine)
+    for node in builder.exports:
+        address = engine.get_function_address(node.identifier.value)
+        program.functions[node.identifier.value] = Function(node, address)
+    ctypes.CFUNCTYPE(ctypes.c_int32)(engine.get_function_address(f'load_{name}'))()
+    return program
+
+
+def export_all(ast: Node):
+    """Export every top level function that python can call, generics and vec or array parameters can not be called"""
+    if isinstance(ast, StatementsNode):
+        for node in ast.expressions:
+            if isinstance(node, FunDefNode) and not node.type_params and not any(
+                    'vec:' in typ.value or 'array:' in typ.value for typ in [*node.arg_types, node.return_type]):
+                node.export = node.identifier  # keeps its name and the C calling convention, see IrBuilder
+
+
+class Program:
+    """A compiled Heiabubu source, its functions are attributes. Keeps the machine code alive"""
+    def __init__(self, engine: llvm.ExecutionEngine):
+        self.engine = engine
+        self.functions: dict[str, Function] = {}
+
+    def __getattr__(self, name: str) -> 'Function':
+        try:
+            return self.__dict__['functions'][name]
+        except KeyError:
+            raise AttributeError(f'No function called {name}') from None
+
+    def __dir__(self) -> list[str]:
+        return [*super().__dir__(), *self.functions]
+
+
+class Function:
+    """
+    Callable for one Heiabubu function, its ctypes prototype is made once when compiling.
+    A list parameter takes any c contiguous, writable buffer of the right element type without copying it,
+    or a python list, which is copied in and back out after the call
+    """
+    scalars = {'int': ctypes.c_int32, 'float': ctypes.c_double, 'bool': ctypes.c_bool, 'byte': ctypes.c_uint8,
+               'str': ctypes.c_char_p}
+    buffer_formats = {'int': 'il', 'float': 'd', 'bool': '?', 'byte': 'Bbc'}  # struct formats with the same layout
+
+    def __init__(self, node: FunDefNode, address: int):
+        self.name = node.identifier.value
+        self.arg_types = [typ.value for typ in node.arg_types]
+        self.ret_type = node.return_type.value
+        restype = None if self.ret_type == 'null' else self.scalars.get(self.ret_type, ctypes.c_void_p)
+        argtypes = [self.scalars.get(typ, ctypes.c_void_p) for typ in self.arg_types]
+        self.prototype = ctypes.CFUNCTYPE(restype, *argtypes)(address)
+
+    def __call__(self, *args):
+        if len(args) != len(self.arg_types):
+            raise builtins.TypeError(f'{self.name} expected {len(self.arg_types)} arguments, got {len(args)}')
+        converted = []
+        copies: list[tuple[list, ctypes.Array]] = []
+        for i, (arg, typ) in enumerate(zip(args, self.arg_types)):
+            if typ == 'str' and isinstance(arg, str):
+                converted.append(arg.encode())
+            elif typ.startswith('list:') and typ.removeprefix('list:') in self.buffer_formats:
+                element = typ.removeprefix('list:')
+                if isinstance(arg, list):
+                    array = (self.scalars[element] * len(arg))(*arg)
+                    copies.append((arg, array))
+                    converted.append(ctypes.addressof(array))
+                else:
+                    converted.append(self.buffer_address(arg, element, i))
+            else:
+                converted.append(arg)
+        result = self.prototype(*converted)
+        for lst, array in copies:
+            lst[:] = list(array)
+        return result.decode() if self.ret_type == 'str' and result is not None else result
+
+    def buffer_address(self, arg, element: str, index: int) -> int | None:
+        """Address of the first element of a buffer, checked to hold elements of the Heiabubu type element"""
+        try:
+            view = memoryview(arg)
+        except builtins.TypeError:
+            raise builtins.TypeError(f'{self.name} expects a list or buffer of {element} for argument {index}, '
+                                     f'got {type(arg).__name__}') from None
+        fmt = view.format.lstrip('@=<')
+        if fmt not in self.buffer_formats[element] or view.itemsize != ctypes.sizeof(self.scalars[element]):
+            raise builtins.TypeError(f'{self.name} expects a buffer of {element} for argument {index}, '
+                                     f'got format {view.format} with {view.itemsize} byte items')
+        if not view.c_contiguous or view.readonly:
+            raise builtins.TypeError(f'{self.name} needs a c contiguous, writable buffer for argument {index}')
+        if view.nbytes == 0:
+            return None
+        return ctypes.addressof(ctypes.c_char.from_buffer(view))
+
+    def __repr__(self) -> str:
+        def written(typ: str) -> str:
+            return typ.replace('list:', 'list<') + '>' * typ.count('list:')
+        params = ', '.join(written(typ) for typ in self.arg_types)
+        return f'<Heiabubu function {self.name}({params}) -> {written(self.ret_type)}>'
@@ -1,8 +1,12 @@
 import builtins
+import ctypes.util
 import os
 import platform
+import re
 import subprocess
+import sys
 from argparse import Namespace, ArgumentParser
+from collections.abc import Callable
 from ctypes import CFUNCTYPE, c_int
 
 import llvmlite.binding as llvm
@@ -11,11 +15,15 @@ from termcolor import colored
 
 from Context import Context
 from Error import Error, RuntimeError
-from IrBuilder import IrBuilder
+from Evaluator import Evaluator
+from Folder import Folder
+from IrBuilder import IrBuilder, Struct
 from Lexer import Lexer
+from Node import FunDefNode, Node
 from Methods import fail
 from Parser import Parser
 from Semantic import Analyser
+from Token import Position
 
 """The compiler Driver gluing all components together"""
 
@@ -27,14 +35,30 @@ def start() -> int:
         globals()[arg.upper() + '_DEBUG'] = True
     if args.run:
         globals()['RUN'] = True
+    if args.auto_memo:
+        globals()['AUTO_MEMO'] = True
+    if args.multiversion:
+        globals()['MULTIVERSION'] = True
+    if args.const_steps is not None:
+        globals()['CONST_STEPS'] = args.const_steps
+    globals()['MCPU'] = args.mcpu
+    globals()['MATTR'] = args.mattr
+    vector_math(cpu_features()[1])  # before the Evaluator optimises its module for this cpu
     try:
         with open(args.file_path) as f:
             text = f.read()
     except FileNotFoundError:
         print(colored(f'File {args.file_path} not found!', 'red'))
         return 1
+    if args.shared:
+        if args.run:
+            print(colored('-shared and -run can not be used together', 'red'))
+            return 1
+        globals()['SHARED'] = True
     if args.o:
         globals()['OUTPUT'] = args.o
+    elif SHARED:
+        globals()['OUTPUT'] = args.file_path.replace('.hb', '.dll' if platform.system() == 'Windows' else '.so')
     else:
         globals()['OUTPUT'] = args.file_path.replace('.hb', '.exe' if platform.system() == 'Windows' else '')
     global OPT
@@ -48,10 +72,23 @@ def parse_args() -> Namespace:
                                 epilog='Exit Status:\n\tReturns 0 unless an error occurs')
 
     arg_parser.add_argument('file_path', help='Path to your entry point Heiabubu file. (e.g. main.hb)')
-    arg_parser.add_argument('-d', type=str, action='append', choices=['tokens', 'ast', 'ir', 'asm'],
+    arg_parser.add_argument('-d', type=str, action='append',
+                            choices=['tokens', 'ast', 'ir', 'asm', 'loops', 'layout', 'fold'],
                             help='Dump for debug info', default=[])
     arg_parser.add_argument('-o', type=str, help='The emitted output file. (e.g. main.exe)')
     arg_parser.add_argument('-no_opt', action='store_false', help='Turn off all optimisations')
+    arg_parser.add_argument('-auto_memo', action='store_true',
+                            help='Memo every recursive function that has no side effects and only int, float, bool or byte parameters')
+    arg_parser.add_argument('-mcpu', type=str,
+                            help='The cpu to compile for (e.g. skylake), native is the host cpu. Default is the host cpu with -run, else generic x86-64')
+    arg_parser.add_argument('-mattr', type=str,
+                            help='Cpu features to add or remove (e.g. +avx2,-fma). Default is every host feature with -run, else none')
+    arg_parser.add_argument('-multiversion', action='store_true',
+                            help='Compile functions with loops for x86-64-v3 (avx2) and v4 (avx512) too, the best version for the cpu is picked at startup')
+    arg_parser.add_argument('-const_steps', type=int,
+                            help='Steps all const function calls together may take while compiling, calls and loop iterations count as one step. Calls that run out are left for runtime. Default is 100000000')
+    arg_parser.add_argument('-shared', action='store_true',
+                            help='Create a shared library of the exported functions and a C header declaring them')
     arg_parser.add_argument('-run', action='store_true',
                             help='Run the given file via JIT compilation, dont create an executable')
     return arg_parser.parse_args()
@@ -62,9 +99,20 @@ TOKENS_DEBUG = False  # emit OUTPUT.tokens
 AST_DEBUG = False  # emit OUTPUT.json
 IR_DEBUG = False  # emit OUTPUT.ll
 ASM_DEBUG = False  # emit OUTPUT.s
+LOOPS_DEBUG = False  # emit OUTPUT.loops, telling for every loop with hints if it got vectorized
+LAYOUT_DEBUG = False  # emit OUTPUT.layout, showing size, field offsets and padding of every class
+FOLD_DEBUG = False  # emit OUTPUT.fold, telling how many ast nodes the Folder removed
 RUN = False  # Run the code with JIT compilation, else create an executable
+SHARED = False  # Create a shared library and a C header for the exported functions instead of an executable
+AUTO_MEMO = False  # Memo all recursive functions the Analyser finds to be pure
+MULTIVERSION = False  # Compile functions with loops for several cpu levels and pick one at startup, not with RUN
+CONST_STEPS = 100_000_000  # Budget for running const functions while compiling, see Evaluator
+MCPU: str | None = None  # The cpu to compile for, None is the host cpu with RUN and generic x86-64 else
+MATTR: str | None = None  # The cpu features to add or remove, None is all host features with RUN and none else
+VECTOR_MATH: bool | None = None  # Vectorize sin, exp and the like with libmvec, None is not decided yet, see vector_math
 OPT = True  # Optimise the code with llvm -03 level
 OUTPUT: str | None = None  # The name of the output files, specified with -o, default is file_path.exe on Windows, else file_path
+# or file_path.so / file_path.dll with SHARED
 
 
 def run(text: str, file: str) -> int:
@@ -73,50 +121,39 @@ def run(text: str, file: str) -> int:
         1. Lexer(text)      -> token[]
         2. Parser(token[])  -> ast
         3. Analyser(ast)    -> None
-        4. IrBuilder(ast)   -> ir_module
-        5. LLVM(ir_module)  -> object_file
-        6. gcc(object_file) -> executable
+        4. Folder(ast)      -> ast
+        5. Evaluator(ast)   -> ast
+        6. IrBuilder(ast)   -> ir_module
+        7. LLVM(ir_module)  -> object_file
+        8. gcc(object_file) -> executable or shared library
     """
     file = file.split(os.sep)[-1]
     file, _ = os.path.splitext(file)
     ctx = Context(None, f'load_{file}', file, text)
-    lexer = Lexer(ctx)
-    tokens = lexer.make_tokens()
-    if isinstance(tokens, Error):
-        fail(tokens)
-        return 1
-    if TOKENS_DEBUG:
-        with open(OUTPUT + '.tokens', 'w') as f:
-            f.write(f'{file}:\n' + ' ' + ' '.join(map(str, tokens)))
-    parser = Parser(tokens, ctx)
-    ast = parser.parse()
-    if isinstance(ast, Error):
-        fail(ast)
-        return 1
-    if AST_DEBUG:
-        with open(OUTPUT + '.json', 'w') as f:
-            f.write(ast.__str__())
-    analyser = Analyser(ctx)
-    try:
-        analyser.check(ast)
-    except Error as e:
-        fail(e)
-        return 1
-    builder = IrBuilder(ctx)
     try:
-        builder.build(ast)
+        builder = build(ctx)
     except Error as e:
         fail(e)
         return 1
     module = builder.module
-    module.triple = llvm.get_default_triple()
     if IR_DEBUG:
         with open(OUTPUT + '.ll', 'w') as f:
-            if OPT:
-                module = opt(module)
-                if module is None:
-                    return 1
-            f.write(module.__str__())
+            optimised = opt(module) if OPT else module  # the module itself is optimised again when compiling
+            if optimised is None:
+                return 1
+            f.write(optimised.__str__())
+    if LOOPS_DEBUG:
+        module_ref = opt(module)
+        if module_ref is None:
+            return 1
+        with open(OUTPUT + '.loops', 'w') as f:
+            f.write(loop_report(module_ref, builder.annotated_loops))
+    if LAYOUT_DEBUG:
+        with open(OUTPUT + '.layout', 'w') as f:
+            f.write(layout_report(builder.structs))
+    if SHARED:
+        with open(os.path.splitext(OUTPUT)[0] + '.h', 'w') as f:
+            f.write(c_header(file, builder.exports))
     if RUN:
         run_jit(module, file)
     else:
@@ -124,10 +161,54 @@ def run(text: str, file: str) -> int:
     return 0
 
 
-def opt(module: llvmlite.ir.Module) -> llvm.ModuleRef | None:
-    """Optimise the llvmlite module if OPT, return llvm module"""
+def build(ctx: Context, jit: bool | None = None, prepare: Callable[[Node], None] | None = None) -> IrBuilder:
+    """
+    Run steps 1. to 6. of run on the text of ctx and return the IrBuilder holding the module, a Heiabubu Error is raised
+    if one of them fails. prepare may change the ast before it is analysed.
+    jit tells if the code runs in this process, None means as set by RUN
+    """
+    file = ctx.file
+    tokens = Lexer(ctx).make_tokens()
+    if isinstance(tokens, Error):
+        raise tokens
+    if TOKENS_DEBUG:
+        with open(OUTPUT + '.tokens', 'w') as f:
+            f.write(f'{file}:\n' + ' ' + ' '.join(map(str, tokens)))
+    ast = Parser(tokens, ctx).parse()
+    if isinstance(ast, Error):
+        raise ast
+    if AST_DEBUG:
+        with open(OUTPUT + '.json', 'w') as f:
+            f.write(ast.__str__())
+    if prepare is not None:
+        prepare(ast)
+    analyser = Analyser(ctx, AUTO_MEMO)
+    analyser.check(ast)
+    analyser.mark_used()
+    folder = Folder()
+    ast = folder.fold_tree(ast)
+    evaluator = Evaluator(ctx, analyser, CONST_STEPS)
+    ast = evaluator.evaluate_tree(ast, folder)
+    if FOLD_DEBUG:
+        with open(OUTPUT + '.fold', 'w') as f:
+            f.write(f'{file}: removed {folder.removed} of {folder.nodes_before} nodes\n')
+            f.write(f'{file}: ran {evaluator.evaluated} const calls while compiling, '
+                    f'{len(evaluator.deferred)} could not finish and are left for runtime\n')
+    multiversion = MULTIVERSION and not (RUN if jit is None else jit) and llvm.get_default_triple().startswith('x86_64')
+    builder = IrBuilder(ctx, analyser.fun_helpers, analyser.allocations, multiversion)
+    builder.build(ast)
+    builder.module.triple = llvm.get_default_triple()
+    return builder
+
+
+def opt(module: llvmlite.ir.Module, jit: bool | None = None) -> llvm.ModuleRef | None:
+    """
+    Link the runtime library into the llvmlite module and optimise it if OPT, return llvm module.
+    jit tells if the code runs in this process, None means as set by RUN
+    """
     try:
         module_ref = llvm.parse_assembly(module.__str__())
+        link_runtime(module_ref)
     except builtins.RuntimeError as e:
         print(colored('Caught llvm runtime error:', 'red'))
         print(colored(str(e), 'red'))
@@ -136,23 +217,174 @@ def opt(module: llvmlite.ir.Module) -> llvm.ModuleRef | None:
     if OPT:
         pmb = llvm.PassManagerBuilder()
         pmb.opt_level = 3
+        pmb.inlining_threshold = 275  # what clang uses for -O3, without it nothing gets inlined
         pm = llvm.ModulePassManager()
+        target = target_machine(jit)  # has to outlive the pass manager run
+        target.add_analysis_passes(pm)
+        vector_math(cpu_features(jit)[1])
         pmb.populate(pm)
+        pm.add_merge_functions_pass()  # instances of generics often compile to the same code, keep one of them
         pm.run(module_ref)
     return module_ref
 
 
-def cmp(module: llvmlite.ir.Module):
+def link_runtime(module_ref: llvm.ModuleRef):
     """
-    Compile the llvm module to an executable file in the following steps:
-        1. LLVM(module)     -> temp.o
-        2. gcc(temp.o)      -> executable
-        3. remove temp.o
+    Link runtime.ll into the module. Its functions become internal afterward, so like with link time optimisation
+    the optimiser can inline them into their callers and remove the unused ones. So does hb_foreign, which lets the
+    optimiser drop the ownership checks of a module without exports
+    """
+    directory = getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))  # bundled by pyinstaller
+    with open(os.path.join(directory, 'runtime.ll')) as f:
+        runtime = llvm.parse_assembly(f.read())
+    module_ref.link_in(runtime)
+    for function in module_ref.functions:
+        if function.name.startswith('hb_') and not function.is_declaration:
+            function.linkage = llvm.Linkage.internal
+    module_ref.get_global_variable('hb_foreign').linkage = llvm.Linkage.internal
+
+
+def target_machine(jit: bool | None = None) -> llvm.TargetMachine:
+    """
+    Create the llvm target machine for the cpu set by -mcpu and -mattr, its analysis passes let the optimiser know the
+    vector width. JIT code only runs on this machine, so it uses the host cpu with all of its features by default.
+    An executable may run elsewhere, so it is compiled for generic x86-64 unless a cpu is given.
+    jit tells if the code runs in this process, None means as set by RUN
     """
     llvm.initialize()
     llvm.initialize_native_target()
     llvm.initialize_native_asmprinter()
+    cpu, features = cpu_features(jit)
+    return llvm.Target.from_default_triple().create_target_machine(cpu=cpu, features=features,
+                                                                   reloc='pic' if SHARED else 'default')
+
+
+def cpu_features(jit: bool | None = None) -> tuple[str, str]:
+    """The cpu name and feature string target_machine compiles for"""
+    host = (RUN if jit is None else jit) or MCPU == 'native'
+    cpu = MCPU if MCPU and MCPU != 'native' else llvm.get_host_cpu_name() if host else ''
+    features = MATTR if MATTR is not None else llvm.get_host_cpu_features().flatten() if host else ''
+    return cpu, features
+
+
+def vector_math(features: str) -> bool:
+    """
+    Let the vectorizer turn loops calling sin, exp, log and the like into calls of their vector versions in glibc's
+    libmvec. It is an llvm option for the whole process, so the first target decides, which is the one of the
+    executable when started from the command line. llvm calls the avx2 versions for 4 lanes, so it needs avx2 on the
+    target and on this cpu, as const functions run here. The JIT needs libmvec loaded, gcc links it with libm
+    """
+    global VECTOR_MATH
+    if VECTOR_MATH is None:
+        triple = llvm.get_default_triple()
+        library = ctypes.util.find_library('mvec')
+        VECTOR_MATH = triple.startswith('x86_64') and 'linux' in triple and library is not None and \
+            '+avx2' in features.split(',') and llvm.get_host_cpu_features().get('avx2', False)
+        if VECTOR_MATH:
+            llvm.set_option('', '--vector-library=LIBMVEC-X86')
+            llvm.load_library_permanently(library)
+    return VECTOR_MATH
+
+
+def loop_report(module_ref: llvm.ModuleRef, loops: list[tuple[str, Position, Context]]) -> str:
+    """
+    Tell for every loop with hints if it got vectorized, by looking for its heiabubu.loop tag in the optimised module.
+    The vectorizer keeps the tag and adds llvm.loop.isvectorized to the loops it created
+    """
+    metadata: dict[str, list[str]] = {}
+    for line in str(module_ref).splitlines():
+        definition = re.match(r'^(![0-9]+) = (?:distinct )?!{(.*)}$', line)
+        if definition:
+            metadata[definition.group(1)] = [operand.strip() for operand in definition.group(2).split(',')]
+
+    names = dict((operands[0], ref) for ref, operands in metadata.items() if len(operands) == 1)
+    vectorized_ref: str | None = None
+    for ref, operands in metadata.items():
+        if operands[0].startswith('!"llvm.loop.isvectorized"'):
+            vectorized_ref = ref
+
+    report = ''
+    for tag, pos, context in loops:
+        tag_ref = names.get(f'!"{tag}"')
+        loop_ids = [operands for operands in metadata.values() if tag_ref in operands[1:]]
+        if not loop_ids:
+            result = 'removed, the loop was unrolled completely or is unused'
+        elif any(vectorized_ref in operands for operands in loop_ids):
+            result = 'vectorized'
+        else:
+            result = 'not vectorized'
+        report += f'{context.file}, line {pos.line + 1}, fun {context.name}: {result}\n'
+    return report
+
+
+def layout_report(structs: dict[str, Struct]) -> str:
+    """Show the memory layout of every class, with the padding the alignment of its fields needs"""
+    report = ''
+    for struct in structs.values():
+        padding = struct.size - sum(size for _, _, _, size in struct.layout)
+        order = 'declared order' if struct.ordered else f'reordered, {struct.declared_size} bytes in declared order'
+        kind = 'soa class' if struct.soa else 'class'
+        report += f'{kind} {struct.name}: {struct.size} bytes, {padding} bytes padding ({order})\n'
+        end = 0
+        for name, typ, offset, size in struct.layout:
+            if offset > end:
+                report += f'    {end:>4}  padding {offset - end}\n'
+            report += f'    {offset:>4}  {name}: {typ} ({size})\n'
+            end = offset + size
+        if struct.size > end:
+            report += f'    {end:>4}  padding {struct.size - end}\n'
+    return report
 
+
+def c_header(file: str, exports: list[FunDefNode]) -> str:
+    """The C header of a shared library, declaring the exported functions with matching C types"""
+    c_types = {'int': 'int32_t', 'float': 'double', 'bool': 'bool', 'byte': 'uint8_t', 'str': 'char *', 'null': 'void'}
+    classes: list[str] = []
+
+    def c_type(typ: str) -> str:
+        if typ.startswith('list:'):
+            element = c_type(typ.removeprefix('list:'))
+            return element + '*' if element.endswith('*') else element + ' *'
+        if typ.startswith('map:'):
+            typ = 'hb_map'  # every map is the same runtime struct
+        typ = re.sub(r'\W+', '_', typ).strip('_')  # instances of generic classes, like Box<int> -> Box_int
+        if typ not in c_types:
+            if typ not in classes:
+                classes.append(typ)
+            return typ + ' *'
+        return c_types[typ]
+
+    def declaration(name: str, params: list[str], ret_type: str) -> str:
+        ret = c_type(ret_type)
+        return f'{ret}{"" if ret.endswith("*") else " "}{name}({", ".join(params) if params else "void"});\n'
+
+    functions = ''
+    for fun in exports:
+        params = [c_type(typ.value) for typ in fun.arg_types]
+        params = [f'{typ}{"" if typ.endswith("*") else " "}{arg.value}' for typ, arg in zip(params, fun.args)]
+        functions += declaration(fun.identifier.value, params, fun.return_type.value)
+
+    guard = re.sub(r'\W', '_', file).upper() + '_H'
+    header = f'/* Generated by the Heiabubu compiler from {file}.hb */\n'
+    header += f'#ifndef {guard}\n#define {guard}\n\n#include <stdbool.h>\n#include <stdint.h>\n\n'
+    header += '#ifdef __cplusplus\nextern "C" {\n#endif\n\n'
+    for name in classes:
+        header += f'typedef struct {name} {name};  /* only ever used through a pointer */\n'
+    header += '\n' if classes else ''
+    header += f'/* runs the top level code of {file}.hb, call it before anything else */\n'
+    header += declaration(f'load_{file}', [], 'int')
+    header += functions
+    header += '\n#ifdef __cplusplus\n}\n#endif\n\n#endif\n'
+    return header
+
+
+def cmp(module: llvmlite.ir.Module):
+    """
+    Compile the llvm module to an executable file or with SHARED to a shared library in the following steps:
+        1. LLVM(module)     -> temp.o
+        2. gcc(temp.o)      -> executable or shared library
+        3. remove temp.o
+    """
     try:
         llvm_module = opt(module)
         if llvm_module is None:
@@ -162,7 +394,7 @@ def cmp(module: llvmlite.ir.Module):
         print(e)
         raise
 
-    target = llvm.Target.from_default_triple().create_target_machine()
+    target = target_machine()
 
     try:
         with open(OUTPUT + '_temp.o', "xb") as f:
@@ -173,7 +405,8 @@ def cmp(module: llvmlite.ir.Module):
                 assembly = target.emit_assembly(llvm_module)
                 f.write(assembly)
 
-        subprocess.run(['gcc', OUTPUT + '_temp.o', '-o', OUTPUT], capture_output=True, text=True)
+        subprocess.run(['gcc', *(['-shared'] if SHARED else []), OUTPUT + '_temp.o', '-o', OUTPUT, '-lm'],
+                       capture_output=True, text=True)
     except Exception as e:
         print(colored(str(e), 'red'))
     finally:
@@ -182,10 +415,6 @@ def cmp(module: llvmlite.ir.Module):
 
 def run_jit(module: llvmlite.ir.Module, file: str):
     """Run the llvm module via just in time compilation"""
-    llvm.initialize()
-    llvm.initialize_native_target()
-    llvm.initialize_native_asmprinter()
-
     try:
         llvm_module = opt(module)
         if llvm_module is None:
@@ -195,9 +424,10 @@ def run_jit(module: llvmlite.ir.Module, file: str):
         print(e)
         raise
 
-    target = llvm.Target.from_default_triple().create_target_machine()
+    target = target_machine()
     engine = llvm.create_mcjit_compiler(llvm_module, target)
     engine.finalize_object()
+    engine.run_static_constructors()  # the cpu dispatch and consts computed at startup, see IrBuilder.add_constructors
 
     if ASM_DEBUG:
         with open(OUTPUT + '.s') as f:
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import ctypes
+import threading
+from copy import copy
+
+import llvmlite.binding as llvm
+from llvmlite import ir
+
+import Driver
+from Context import Context
+from Folder import Folder, constant_value, make_constant
+from IrBuilder import IrBuilder
+from Node import *
+from Semantic import Analyser, Fun
+
+
+class Evaluator:
+    """
+    Compile time function evaluation, runs between Folder and IrBuilder:
+        1. reads of const variables with a constant value are replaced by that value, a list by a copy of its literal
+        2. calls of const functions with constant arguments are run and replaced by their result
+        3. the Folder folds what became constant, which can open up more of 1. and 2.
+    The const functions and everything they call are built into a module of their own and run by the JIT, recursive
+    ones get memoized there. All calls share a budget of steps, see IrBuilder.count_steps, a call that runs out of
+    steps or stack is left to run at runtime, just like it would without const
+    """
+    def __init__(self, ctx: Context, analyser: Analyser, steps: int = 100_000_000):
+        self.context = ctx
+        self.analyser = analyser
+        self.steps = steps  # steps left for all calls together
+        self.stack_size = 64 * 2 ** 20  # stack of the thread running the calls, half of it may be used
+        self.results: dict[tuple[str, tuple], tuple[str, int | float | bool] | None] = {}
+        self.root: Node | None = None
+        self.engine: llvm.ExecutionEngine | None = None
+        self.entries: dict[Fun, ctypes.CFUNCTYPE] = {}
+        self.give_up_offset = 0  # see IrBuilder.give_up
+        self.evaluated = 0  # calls replaced by their result
+        self.deferred: list[FunCallNode] = []  # calls left for runtime, they ran out of steps or stack or would trap
+
+    def evaluate_tree(self, root: Node, folder: Folder) -> Node:
+        """Replace consts and const calls in the folded ast, until nothing new becomes constant"""
+        if not self.analyser.const_reads and not self.analyser.const_calls:
+            return root
+        self.root = root
+        while self.substitute(root):
+            root = folder.refold(root)
+        return root
+
+    def substitute(self, node: Node) -> bool:
+        """Replace the consts and const calls below node that are known by now, returns if anything was replaced"""
+        changed = False
+        for name, value in vars(node).items():
+            if isinstance(value, Node):
+                changed |= self.substitute(value)
+                new = self.replacement(value)
+                if new:
+                    setattr(node, name, new)
+                    changed = True
+            elif isinstance(value, list):
+                for i, v in enumerate(value):
+                    if not isinstance(v, Node):
+                        continue
+                    changed |= self.substitute(v)
+                    new = self.replacement(v)
+                    if new:
+                        value[i] = new
+                        changed = True
+        return changed
+
+    def replacement(self, node: Node) -> Node | None:
+        """The constant a const read or const call evaluates to, None if it is not known while compiling"""
+        if isinstance(node, VarAccessNode) and node in self.analyser.const_reads:
+            value = self.analyser.const_reads[node].value
+            if isinstance(value, ListNode) and all(constant_value(element) for element in value.content):
+                return ListNode([make_constant(constant_value(element), element.pos) for element in value.content])
+            return make_constant(constant_value(value), node.pos) if constant_value(value) else None
+        if isinstance(node, FunCallNode) and node in self.analyser.const_calls:
+            args = [constant_value(arg) for arg in node.args]
+            if any(arg is None for arg in args):
+                return None
+            value = self.call(self.analyser.const_calls[node], node, [arg[1] for arg in args])
+            if value is None:
+                return None
+            self.evaluated += 1
+            return make_constant(value, node.pos)
+        return None
+
+    def call(self, fun: Fun, node: FunCallNode, args: list) -> tuple[str, int | float | bool] | None:
+        """Run fun with the arguments and return its result, or None if it ran out of steps or stack"""
+        key = (fun.name, tuple(args))
+        if key not in self.results:
+            self.results[key] = None
+            if self.steps > 0:
+                self.results[key] = self.run(fun, args)
+            if self.results[key] is None:
+                self.deferred.append(node)
+        return self.results[key]
+
+    def run(self, fun: Fun, args: list) -> tuple[str, int | float | bool] | None:
+        """Call the entry of fun on a thread with a big stack, None if it ran out of steps or stack"""
+        if self.engine is None:
+            self.compile()
+        steps = ctypes.c_int64.from_address(self.engine.get_global_value_address('hb_steps'))
+        steps.value = self.steps
+        result = []
+        prev_size = threading.stack_size(self.stack_size)
+        try:
+            thread = threading.Thread(target=lambda: result.append(self.entries[fun](*args)))
+            thread.start()
+            thread.join()
+        finally:
+            threading.stack_size(prev_size)
+        if steps.value < 0:
+            given_up = steps.value + self.give_up_offset
+            self.steps = given_up if given_up > 0 and steps.value < -self.give_up_offset // 2 else 0
+            return None
+        self.steps = steps.value
+        return fun.ret_type, bool(result[0]) if fun.ret_type == 'bool' else result[0]
+
+    def compile(self):
+        """
+        Build the const functions and everything they call into a module of their own, with a C callable entry for
+        every const function taking and returning its numbers as i32 or double. The entry sets the stack limit
+        """
+        targets = set(self.analyser.const_calls.values())
+        needed = set(targets).union(*(fun.reachable() for fun in targets))
+        copies = {fun: copy(fun) for fun in needed}  # with their own calls, so they only reach each other
+        for fun, helper in copies.items():
+            helper.calls = {copies[callee] for callee in fun.calls}
+            helper.effects = set(fun.effects)
+            helper.used = True  # maybe only called by consts, which are gone by now
+        for helper in copies.values():
+            if helper.memo_size is None and helper.is_recursive() and self.analyser.memo_problem(helper) is None:
+                helper.memo_size = self.analyser.default_memo_size  # pure, the cache only changes the time
+                helper.effects.add('cache')
+        helpers = {node: copies.get(helper, helper) for node, helper in self.analyser.fun_helpers.items()}
+        needed_nodes = {node for node, helper in self.analyser.fun_helpers.items() if helper in needed}
+
+        def definitions(node: Node) -> list[Node]:
+            """The classes and needed functions, in the order they are defined"""
+            if isinstance(node, StructDefNode) or node in needed_nodes:
+                return [node]
+            return [definition for child in node.children() for definition in definitions(child)]
+
+        builder = IrBuilder(Context(None, f'const_{self.context.file}', self.context.file, self.context.file_text),
+                            helpers, self.analyser.allocations)
+        builder.count_steps()
+        self.give_up_offset = builder.give_up_offset
+        builder.build(StatementsNode(definitions(self.root)))
+
+        long_type = ir.IntType(64)
+        stack_save = builder.module.get_global('llvm.stacksave')
+        names: dict[Fun, str] = {}
+        exported = {helper for node, helper in self.analyser.fun_helpers.items() if node.export}
+        for fun in targets:
+            func = builder.module.get_global(fun.name if fun in exported else fun.name + ''.join(
+                f'.{builder.get_type(typ, None)}' for typ in fun.arg_types))
+            param_types = [builder.float_type if typ == 'float' else builder.int_type for typ in fun.arg_types]
+            ret_type = builder.float_type if fun.ret_type == 'float' else builder.int_type
+            names[fun] = f'const.{func.name}'
+            entry = ir.Function(builder.module, ir.FunctionType(ret_type, param_types), names[fun])
+            entry_builder = ir.IRBuilder(entry.append_basic_block('entry'))
+            stack = entry_builder.ptrtoint(entry_builder.call(stack_save, [], name='stack'), long_type,
+                                           name='stack_address')
+            entry_builder.store(entry_builder.sub(stack, long_type(self.stack_size // 2), name='limit'),
+                                builder.stack_limit)
+            args = [entry_builder.trunc(arg, param.type, name='arg') if arg.type != param.type else arg
+                    for arg, param in zip(entry.args, func.args)]
+            result = entry_builder.call(func, args, name='result', cconv=func.calling_convention)
+            entry_builder.ret(entry_builder.zext(result, ret_type, name='ret') if result.type != ret_type else result)
+
+        builder.module.triple = llvm.get_default_triple()
+        self.engine = llvm.create_mcjit_compiler(Driver.opt(builder.module, jit=True), Driver.target_machine(jit=True))
+        self.engine.finalize_object()
+        for fun in targets:
+            c_types = {'float': ctypes.c_double}
+            prototype = ctypes.CFUNCTYPE(c_types.get(fun.ret_type, ctypes.c_int32),
+                                         *[c_types.get(typ, ctypes.c_int32) for typ in fun.arg_types])
+            self.entries[fun] = prototype(self.engine.get_function_address(names[fun]))
@@ -0,0 +1,315 @@
+from __future__ import annotations
+
+import math
+from collections import Counter
+
+from Node import *
+
+
+class Folder:
+    """
+    Simplifies the ast between Analyser and IrBuilder, so less ir has to be built and optimised:
+        1. constant expressions like 60 * 60 or 1 = 1 are evaluated
+        2. if, match and while with a constant condition are replaced by the body they take
+        3. statements after return, break and continue are dropped
+        4. variables only assigned a constant once are replaced by that constant
+    Only types checked by the Analyser may be folded, so this runs after the semantic analysis
+    """
+    def __init__(self):
+        self.nodes_before = 0
+        self.nodes_after = 0
+
+    @property
+    def removed(self) -> int:
+        return self.nodes_before - self.nodes_after
+
+    def fold_tree(self, root: Node) -> Node:
+        """Fold the whole ast of a file until propagating variables does not open up anything new"""
+        self.nodes_before += count_nodes(root)
+        root = self.refold(root)
+        self.nodes_after += count_nodes(root)
+        return root
+
+    def refold(self, root: Node) -> Node:
+        """Fold again after something else made parts of the ast constant, like the Evaluator"""
+        root = self.fold(root)
+        while self.propagate(root):
+            root = self.fold(root)
+        return root
+
+    def fold(self, node: Node) -> Node:
+        """Dynamic fold method, returns the node that replaces the given one"""
+        method = getattr(self, 'fold' + node.__class__.__name__, self.fold_children)
+        return method(node)
+
+    def fold_children(self, node: Node) -> Node:
+        for name, value in vars(node).items():
+            if isinstance(value, Node):
+                setattr(node, name, self.fold(value))
+            elif isinstance(value, list):
+                setattr(node, name, [self.fold(v) if isinstance(v, Node) else v for v in value])
+        return node
+
+    def foldFunDefNode(self, node: FunDefNode) -> Node:
+        return node if node.type_params else self.fold_children(node)
+
+    def foldStructDefNode(self, node: StructDefNode) -> Node:
+        return node if node.type_params else self.fold_children(node)
+
+    def foldBinOpNode(self, node: BinOpNode) -> Node:
+        self.fold_children(node)
+        left = constant_value(node.left)
+        right = constant_value(node.right)
+        operator = node.operator.type
+
+        if left and left[0] == 'bool' and operator in [TT.AND, TT.OR]:
+            # the right side is only evaluated if the left one does not decide already, just like short circuiting
+            if left[1] == (operator == TT.OR):
+                return node.left
+            return node.right
+        if right and right[0] == 'bool' and operator in [TT.AND, TT.OR] and right[1] == (operator == TT.AND):
+            return node.left
+        if left is None or right is None:
+            return node
+
+        value = evaluate(left, operator, right)
+        return node if value is None else make_constant(value, node.pos)
+
+    def foldUnaryOpNode(self, node: UnaryOpNode) -> Node:
+        self.fold_children(node)
+        value = constant_value(node.value)
+        if value is None:
+            return node
+        typ, number = value
+        match node.operator.type:
+            case TT.PLUS:
+                return node.value
+            case TT.MINUS if typ != 'bool':
+                return make_constant((typ, wrap(-number) if typ == 'int' else -number), node.pos)
+            case TT.NOT | TT.XOR if typ == 'bool':
+                return make_constant(('bool', not number), node.pos)
+            case TT.NOT | TT.XOR if typ == 'int':
+                return make_constant(('int', ~number), node.pos)
+        return node
+
+    def foldIfNode(self, node: IfNode) -> Node:
+        self.fold_children(node)
+        condition = constant_value(node.bool)
+        if condition is None:
+            return node
+        taken = node.expr if condition[1] else node.else_expr
+        if node.is_expr:
+            return taken
+        return ScopeNode(taken) if taken else PassNode(node.pos)
+
+    def foldMatchNode(self, node: MatchNode) -> Node:
+        self.fold_children(node)
+        value = constant_value(node.value)
+        if value is None:
+            return node
+        for case in node.cases:
+            if any(start.value <= value[1] < (end.value if end else start.value + 1) for start, end in case.patterns):
+                return ScopeNode(case.body)
+        return ScopeNode(node.default) if node.default else PassNode(node.pos)
+
+    def foldWhileNode(self, node: WhileNode) -> Node:
+        self.fold_children(node)
+        condition = constant_value(node.bool)
+        if condition is not None and not condition[1]:
+            return PassNode(node.pos)
+        return node
+
+    def foldStatementsNode(self, node: StatementsNode) -> Node:
+        statements: list[Node] = []
+        unreachable = False
+        for statement in node.expressions:
+            if unreachable and not isinstance(statement, (FunDefNode, StructDefNode, ImportNode)):
+                continue  # can never run, but functions, classes and imports declared after are still there
+            statement = self.fold(statement)
+            if not isinstance(statement, PassNode):
+                statements.append(statement)
+            unreachable |= terminates(statement)
+        node.expressions = statements if statements else [PassNode(node.expressions[0].pos)]
+        return node
+
+    def propagate(self, root: Node) -> bool:
+        """
+        Replace variables that are assigned a constant exactly once, right in the body of their function, by the
+        constant. Names assigned in top level code are left alone in functions, since those could refer to them.
+        Returns if anything was replaced
+        """
+        top_level = assignments(root, into_functions=False)
+        changed = self.propagate_unit(root, assignments(root, into_functions=True), [])
+        for fun in find_functions(root):
+            counts = assignments(fun.body, into_functions=True)
+            for name in top_level:
+                counts[name] += 2
+            changed |= self.propagate_unit(fun.body, counts, [arg.value for arg in fun.args])
+        return changed
+
+    def propagate_unit(self, body: Node, counts: Counter, params: list[str]) -> bool:
+        if not isinstance(body, StatementsNode):
+            return False
+        constants: dict[str, Node] = {}
+        for statement in body.expressions:
+            if isinstance(statement, VarAssignNode) and counts[statement.name.value] == 1 and \
+                    statement.name.value not in params and constant_value(statement.value) is not None:
+                constants[statement.name.value] = statement.value
+        if not constants:
+            return False
+
+        replaced = 0
+
+        def substitute(node: Node) -> Node:
+            nonlocal replaced
+            if isinstance(node, VarAccessNode) and node.name.value in constants:
+                replaced += 1
+                return make_constant(constant_value(constants[node.name.value]), node.pos)
+            if isinstance(node, (FunDefNode, StructDefNode)):
+                return node
+            for name, value in vars(node).items():
+                if isinstance(value, Node):
+                    setattr(node, name, substitute(value))
+                elif isinstance(value, list):
+                    setattr(node, name, [substitute(v) if isinstance(v, Node) else v for v in value])
+            return node
+
+        substitute(body)
+        used = accessed_names(body)
+        statements = [statement for statement in body.expressions if not (
+                isinstance(statement, VarAssignNode) and statement.name.value in constants and
+                statement.name.value not in used)]
+        removed = len(body.expressions) - len(statements)
+        body.expressions = statements if statements else [PassNode(body.expressions[0].pos)]
+        return replaced > 0 or removed > 0
+
+
+def constant_value(node: Node) -> tuple[str, int | float | bool] | None:
+    """The type and value of a literal, None if the node is not constant"""
+    if isinstance(node, NumberNode):
+        return ('int', node.token.value) if node.token.type == TT.INT else ('float', node.token.value)
+    if isinstance(node, VarAccessNode) and node.name.value in ['true', 'false']:
+        return 'bool', node.name.value == 'true'
+    return None
+
+
+def make_constant(value: tuple[str, int | float | bool], pos: Position) -> Node:
+    typ, number = value
+    if typ == 'bool':
+        return VarAccessNode(Token(TT.IDENTIFIER, 'true' if number else 'false', pos))
+    return NumberNode(Token(TT.INT if typ == 'int' else TT.FLOAT, number, pos))
+
+
+def wrap(number: int) -> int:
+    """Overflow like a 32 bit int"""
+    return (number + 2 ** 31) % 2 ** 32 - 2 ** 31
+
+
+def evaluate(left: tuple[str, int | float | bool], operator: TT, right: tuple[str, int | float | bool]) \
+        -> tuple[str, int | float | bool] | None:
+    """
+    Compute a binary operation on two constants the same way the IrBuilder would at runtime.
+    Returns None for everything that is undefined or only known at runtime, like a division by zero
+    """
+    (left_type, a), (right_type, b) = left, right
+    comparisons = {TT.LESS: a < b, TT.LESSEQUAL: a <= b, TT.GREATER: a > b, TT.GREATEREQUAL: a >= b,
+                   TT.EQUALS: a == b, TT.UNEQUALS: a != b}
+    if operator in comparisons:
+        return 'bool', comparisons[operator]
+
+    if left_type == right_type == 'bool':
+        match operator:
+            case TT.XOR:
+                return 'bool', a != b
+        return None
+
+    if left_type == right_type == 'int':
+        match operator:
+            case TT.PLUS:
+                return 'int', wrap(a + b)
+            case TT.MINUS:
+                return 'int', wrap(a - b)
+            case TT.MUL:
+                return 'int', wrap(a * b)
+            case TT.DIV | TT.MOD if b != 0 and not (a == -2 ** 31 and b == -1):
+                quotient = abs(a) // abs(b) * (1 if (a < 0) == (b < 0) else -1)  # rounds towards zero like sdiv
+                return 'int', quotient if operator == TT.DIV else a - b * quotient
+            case TT.AND:
+                return 'int', a & b
+            case TT.OR:
+                return 'int', a | b
+            case TT.XOR:
+                return 'int', a ^ b
+            case TT.LSHIFT if 0 <= b < 32:
+                return 'int', wrap(a << b)
+            case TT.RSHIFT if 0 <= b < 32:
+                return 'int', a >> b
+            case TT.URSHIFT if 0 <= b < 32:
+                return 'int', wrap((a % 2 ** 32) >> b)
+        return None
+
+    a, b = float(a), float(b)
+    match operator:
+        case TT.PLUS:
+            return 'float', a + b
+        case TT.MINUS:
+            return 'float', a - b
+        case TT.MUL:
+            return 'float', a * b
+        case TT.DIV if b != 0:
+            return 'float', a / b
+        case TT.MOD if b != 0:
+            return 'float', math.fmod(a, b)
+    return None
+
+
+def terminates(node: Node) -> bool:
+    """Return if control flow never gets past this statement"""
+    if isinstance(node, (ReturnNode, BreakNode, ContinueNode)):
+        return True
+    if isinstance(node, ScopeNode):
+        return terminates(node.body)
+    if isinstance(node, StatementsNode):
+        return any(terminates(statement) for statement in node.expressions)
+    return False
+
+
+def count_nodes(node: Node) -> int:
+    return 1 + sum(count_nodes(child) for child in node.children())
+
+
+def find_functions(node: Node) -> list[FunDefNode]:
+    if isinstance(node, (FunDefNode, StructDefNode)) and node.type_params:
+        return []  # generic, only its instances are built
+    functions = [node] if isinstance(node, FunDefNode) else []
+    for child in node.children():
+        functions += find_functions(child)
+    return functions
+
+
+def assignments(node: Node, into_functions: bool) -> Counter:
+    """How often every name gets a value, parameters and for loop variables count as never constant"""
+    counts: Counter = Counter()
+    if isinstance(node, VarAssignNode):
+        counts[node.name.value] += 1
+    elif isinstance(node, ForNode):
+        counts[node.identifier.value] += 2
+    elif isinstance(node, ForEachNode):
+        counts[node.key.value] += 2
+        if node.value:
+            counts[node.value.value] += 2
+    elif isinstance(node, FunDefNode):
+        if not into_functions:
+            return counts
+        for arg in node.args:
+            counts[arg.value] += 2
+    for child in node.children():
+        counts += assignments(child, into_functions)
+    return counts
+
+
+def accessed_names(node: Node) -> set[str]:
+    names = {node.name.value} if isinstance(node, VarAccessNode) else set()
+    for child in node.children():
+        names |= accessed_names(child)
+    return names
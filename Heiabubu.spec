@@ -8,7 +8,7 @@ a = Analysis(
     ['main.py'],
     pathex=[],
     binaries=[],
-    datas=[],
+    datas=[('runtime.ll', '.')],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
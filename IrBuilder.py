@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import os.path
 from typing import NoReturn
 
 from llvmlite import ir
@@ -10,18 +9,20 @@ from termcolor import colored
 
 from Env import Environment
 from Error import *
-from Lexer import Lexer
+from Folder import find_functions
 from Node import *
-from Parser import Parser
-from Semantic import Analyser
+from Semantic import Fun
 from Token import TT
 
 
 class IrBuilder:
     """The most important class, the code generator. Creates the llvm ir from an abstract syntax tree"""
 
-    def __init__(self, context: Context):
+    def __init__(self, context: Context, fun_helpers: dict[FunDefNode, Fun] | None = None,
+                 allocations: set[Node] | None = None, multiversion: bool = False):
         self.context = context
+        self.fun_helpers = fun_helpers if fun_helpers else {}  # effects of every function, found by the Analyser
+        self.allocations = allocations if allocations else set()  # nodes creating a list, str or object
 
         self.int_type = ir.IntType(32)
         self.float_type = ir.DoubleType()
@@ -29,22 +30,66 @@ class IrBuilder:
         self.byte_type = ir.IntType(8)
         self.str_type = self.byte_type.as_pointer()
         self.null_type = ir.VoidType()
+        self.drop_type = ir.FunctionType(self.null_type, [self.str_type])  # releases what an object refers to
 
         self.counter = -1
 
         self.breaks: list[ir.Block] = []
         self.continues: list[ir.Block] = []
+        self.loop_temporaries: list[int] = []  # number of temporaries when each loop started, break releases the rest
 
         self.global_imports = {}
 
         self.module = ir.Module(f'{self.context.file}_main')
+        self.map_type = self.module.context.get_identified_type('hb_map')  # the map of runtime.ll, keys and values as i64
+        if self.map_type.is_opaque:
+            self.map_type.set_body(ir.IntType(64).as_pointer(), ir.IntType(64).as_pointer(), self.int_type.as_pointer(),
+                                   self.int_type, self.int_type, self.bool_type)
+        self.rc_type = self.module.context.get_identified_type('hb_rc')  # the header of runtime.ll in front of a value
+        if self.rc_type.is_opaque:
+            self.rc_type.set_body(self.int_type, self.drop_type.as_pointer())
+        self.foreign = ir.GlobalVariable(self.module, self.bool_type, 'hb_foreign')  # see runtime.ll
+        self.foreign.global_constant = True
+        self.foreign.initializer = self.bool_type(0)  # exported functions can be handed memory without a header
 
         self.builder = ir.IRBuilder()
         self.allocator = Allocator()
 
         self.structs: dict[str, Struct] = {}
+        self.exports: list[FunDefNode] = []  # functions callable from C, for the header of a shared library
 
         self.pow = self.module.declare_intrinsic('llvm.pow', [self.float_type])
+        self.memcpy = self.module.declare_intrinsic('llvm.memcpy', [self.str_type, self.str_type, self.int_type])
+
+        self.read_only_lists: set[ListNode] = set()
+        self.escaping: set[Node] = set()  # allocations that outlive their function and so go to the heap
+        self.max_stack_size = 16384  # bigger allocations go to the heap even if they do not escape
+        self.max_register_return = 16  # bigger values are returned through memory of the caller, see is_sret
+        self.result: ir.Argument | None = None  # memory of the caller the current function returns its value in
+        self.steps: ir.GlobalVariable | None = None  # steps left while running at compile time, see count_steps
+        self.stack_limit: ir.GlobalVariable | None = None  # lowest stack address functions may use then
+        self.give_up_offset = 1 << 62  # taken from steps by give_up
+        self.heap_slots: list[ir.AllocaInstr] = []  # heap memory of the current function, freed when it returns
+
+        self.temporaries: list[ir.Value] = []  # new references nothing holds yet, released after their statement
+        self.owned_slots: list[ir.AllocaInstr] = []  # variables of the current function holding a reference
+        self.borrowed: set[str] = set()  # variables of the current function that never hold a reference, see fun_body
+        self.stack_objects: list[ir.Value] = []  # objects on the stack of the current function, see allocate
+        self.static_values: set[ir.Value] = set()  # stack memory, counting references to it is pointless
+
+        self.max_case_range = 128  # match ranges up to this size become switch cases, bigger ones get compared
+
+        self.annotated_loops: list[tuple[str, Position, Context]] = []  # loop tag, position and context for reports
+
+        self.multiversion = multiversion  # build functions with loops for every cpu level, picked at startup
+        self.cpu_levels = {  # x86-64 levels and the bits of __cpu_model.features they need, in ascending order
+            'x86-64-v3': 1 << 10 | 1 << 14 | 1 << 16 | 1 << 17,  # avx2, fma, bmi, bmi2
+            'x86-64-v4': 1 << 10 | 1 << 14 | 1 << 16 | 1 << 17 | 1 << 15 | 1 << 20 | 1 << 21 | 1 << 22 | 1 << 23,
+        }  # v4 adds avx512f, avx512vl, avx512bw, avx512dq, avx512cd
+        self.cpu_dispatch: ir.IRBuilder | None = None  # builds the startup function filling the dispatch pointers
+        self.cpu_supports: dict[str, ir.Value] = {}
+        self.const_init: ir.IRBuilder | None = None  # builds the startup function computing the top level consts
+        self.load_fun: ir.Function | None = None  # the function running the top level code
 
         self.env = Environment()
 
@@ -52,6 +97,16 @@ class IrBuilder:
 
     def get_type(self, name: str, pos: Position) -> ir.Type:
         """Mapping from heiabubu types like int to llvm types like i32"""
+        if name.startswith('map:'):
+            return self.module.context.get_identified_type(name).as_pointer()  # opaque, tells the key and value types
+        if name.startswith('vec:'):
+            _, element_type, size = name.split(':')
+            return ir.VectorType(self.get_type(element_type, pos), int(size))
+        if name.startswith('array:'):
+            _, element_type, size = name.split(':')  # wrapped in a struct to tell it apart from a list literal
+            if element_type in self.structs and self.structs[element_type].soa:
+                return self.soa_type(element_type, int(size))
+            return ir.LiteralStructType([ir.ArrayType(self.get_type(element_type, pos), int(size))])
         if name.startswith('list'):
             list_type = name.removeprefix('list:')
             list_type = self.get_type(list_type, pos)
@@ -78,10 +133,12 @@ class IrBuilder:
             true_var = ir.GlobalVariable(self.module, self.bool_type, 'true')
             true_var.initializer = self.bool_type(1)
             true_var.global_constant = True
+            true_var.linkage = 'private'  # not exported from shared libraries, other code may have a true of its own
 
             false_var = ir.GlobalVariable(self.module, self.bool_type, 'false')
             false_var.initializer = self.bool_type(0)
             false_var.global_constant = True
+            false_var.linkage = 'private'
 
             return true_var, false_var
 
@@ -96,17 +153,42 @@ class IrBuilder:
             malloc_ty = ir.FunctionType(self.str_type, [self.int_type], var_arg=False)
             malloc_func = ir.Function(self.module, malloc_ty, name="malloc")
 
-            strcpy_ty = ir.FunctionType(self.str_type, [self.str_type, self.str_type], var_arg=False)
-            strcpy_func = ir.Function(self.module, strcpy_ty, name="strcpy")
-
             strcmp_ty = ir.FunctionType(self.int_type, [self.str_type, self.str_type], var_arg=False)
             strcmp = ir.Function(self.module, strcmp_ty, name='strcmp')
 
             getchar_ty = ir.FunctionType(self.int_type, [], var_arg=False)
             getchar = ir.Function(self.module, getchar_ty, name='getchar')
 
+            free_ty = ir.FunctionType(self.null_type, [self.str_type], var_arg=False)
+            free = ir.Function(self.module, free_ty, name='free')
+
             self.env.define('len', strlen_func, self.int_type)
 
+        def init_runtime() -> None:
+            """Declare the helpers of runtime.ll, the Driver links their definitions in before optimising"""
+            ir.Function(self.module, ir.FunctionType(self.str_type, [self.str_type, self.str_type]), 'hb_str_concat')
+            ir.Function(self.module, ir.FunctionType(self.bool_type, [self.str_type, self.str_type]), 'hb_str_eq')
+            ir.Function(self.module, ir.FunctionType(self.str_type, [self.str_type, self.byte_type]), 'hb_char_str')
+            ir.Function(self.module, ir.FunctionType(self.str_type, [self.str_type]), 'hb_getchar_str')
+            ir.Function(self.module, ir.FunctionType(self.str_type, [self.str_type, self.str_type]), 'hb_str_append')
+
+            ir.Function(self.module, ir.FunctionType(self.str_type, [self.int_type, self.drop_type.as_pointer()]),
+                        'hb_alloc')
+            ir.Function(self.module, ir.FunctionType(self.null_type, [self.str_type]), 'hb_retain')
+            ir.Function(self.module, ir.FunctionType(self.null_type, [self.str_type]), 'hb_release')
+
+            map_ptr, slot = self.map_type.as_pointer(), ir.IntType(64)
+            ir.Function(self.module, ir.FunctionType(map_ptr, [self.bool_type]), 'hb_map_new')
+            ir.Function(self.module, ir.FunctionType(slot, [map_ptr, slot]), 'hb_map_get')
+            ir.Function(self.module, ir.FunctionType(self.null_type, [map_ptr, slot, slot]), 'hb_map_set')
+            ir.Function(self.module, ir.FunctionType(self.bool_type, [map_ptr, slot]), 'hb_map_has')
+            ir.Function(self.module, ir.FunctionType(self.bool_type, [map_ptr, slot]), 'hb_map_remove')
+            ir.Function(self.module, ir.FunctionType(self.null_type, [map_ptr, self.int_type]), 'hb_map_reserve')
+            ir.Function(self.module, ir.FunctionType(self.int_type, [map_ptr]), 'hb_map_len')
+            ir.Function(self.module, ir.FunctionType(self.int_type, [map_ptr, self.int_type]), 'hb_map_next')
+            ir.Function(self.module, ir.FunctionType(slot, [map_ptr, self.int_type]), 'hb_map_key_at')
+            ir.Function(self.module, ir.FunctionType(slot, [map_ptr, self.int_type]), 'hb_map_value_at')
+
         self.env.define('printf', init_print(), self.int_type)
 
         true, false = init_bool()
@@ -114,6 +196,7 @@ class IrBuilder:
         self.env.define('false', false, self.bool_type)
 
         init_c_std_library()
+        init_runtime()
 
     def build(self, node: Node):
         """Start building the llvm ir for a file, by adding a load_filename function"""
@@ -121,17 +204,167 @@ class IrBuilder:
         fun = ir.Function(self.module, fnty, f'load_{self.context.file}')
         block = fun.append_basic_block(f'load_{self.context.file}_entry')
         self.env.define(f'load_{self.context.file}', fun, self.int_type)
+        self.load_fun = fun
+
+        self.read_only_lists |= self.find_read_only_lists(node)
+        self.escaping |= self.find_escaping(node)
+        prev_locals = self.enter_function()
 
         with self.allocator.set_block(block):
             self.builder.position_at_end(block)
 
-            self.visit(node)
+            self.visit_body(node)
 
             if not block.is_terminated:
                 prev_block = self.builder.block
                 self.builder.position_at_end(block)
+                self.free_heap_slots()  # top level variables live on, so they keep their references
                 self.builder.ret(self.int_type(0))
                 self.builder.position_at_end(prev_block)
+        self.drop_rc_pairs(fun)
+        self.leave_function(prev_locals)
+        self.add_constructors()
+
+    def add_constructors(self):
+        """Run the startup functions before main or the top level code, the cpu dispatch first, then the consts"""
+        inits = [builder.function for builder in [self.cpu_dispatch, self.const_init] if builder is not None]
+        if not inits:
+            return
+        if self.const_init is not None:
+            self.const_init.ret_void()
+        ctor_type = ir.LiteralStructType([self.int_type, inits[0].type, self.str_type])
+        ctors = ir.GlobalVariable(self.module, ir.ArrayType(ctor_type, len(inits)), 'llvm.global_ctors')
+        ctors.linkage = 'appending'
+        ctors.initializer = ir.Constant(ctors.type.pointee, [
+            ir.Constant(ctor_type, [self.int_type(65535), init, ir.Constant(self.str_type, None)]) for init in inits])
+
+    def find_read_only_lists(self, node: Node) -> set[ListNode]:
+        """
+        Find the constant list literals that are only ever indexed, those can point to their global constant directly.
+        A list stored in a variable counts as mutated as soon as that variable is used for anything else than reading
+        an element, names are not scoped here to stay on the safe side
+        """
+        candidates: dict[str, list[ListNode]] = {}
+        used_names: set[str] = set()
+        read_only: set[ListNode] = set()
+
+        def is_indexed(child: Node, parent: Node | None) -> bool:
+            return isinstance(parent, BinOpNode) and parent.operator.type == TT.GET and parent.left is child
+
+        def walk(child: Node, parent: Node | None):
+            if isinstance(child, ListNode) and self.is_constant_list(child):
+                if isinstance(parent, VarAssignNode):
+                    candidates.setdefault(parent.name.value, []).append(child)
+                elif is_indexed(child, parent):
+                    read_only.add(child)
+            elif isinstance(child, VarAccessNode) and not is_indexed(child, parent):
+                used_names.add(child.name.value)
+            for grandchild in child.children():
+                walk(grandchild, child)
+
+        walk(node, None)
+        for name, lists in candidates.items():
+            if name not in used_names:
+                read_only.update(lists)
+        return read_only
+
+    def find_escaping(self, node: Node) -> set[Node]:
+        """
+        Escape analysis, find the lists, strs and objects that can outlive the function creating them. A value escapes
+        if it is returned, stored into a list or object, or passed to a parameter the callee uses for more than
+        indexing. Variables are followed by name, without scopes and ignoring the order of statements,
+        so a variable holds every value ever assigned to it to stay on the safe side. A value made in a loop also
+        escapes if it is copied to another variable, directly or through an if expression, the next pass would reuse
+        its memory while that one still refers to it.
+        A function with escaping allocations gets the alloc effect, it can no longer be readnone
+        """
+        kept_params: dict[str, set[int]] = {}
+        for fun_node, fun_helper in self.fun_helpers.items():
+            kept = {i for i, arg in enumerate(fun_node.args) if arg.value in fun_helper.escaping}
+            kept_params.setdefault(fun_node.identifier.value, set()).update(kept)
+        builtins = ['print', 'len', 'getchar', 'vec', 'shuffle', 'vec_load', 'vec_store', 'reduce_add', 'reduce_mul',
+                    'reduce_min', 'reduce_max', 'has', 'remove', 'reserve', 'sqrt', 'exp', 'exp2', 'log', 'log2',
+                    'log10', 'sin', 'cos', 'fabs', 'floor', 'ceil', 'round', 'trunc', 'fma', 'min', 'max', 'popcount',
+                    'ctlz', 'cttz', 'prefetch']
+
+        escaping: set[Node] = set()
+        for fun in [None] + find_functions(node):
+            body = fun.body if fun else node
+            fun_helper = self.fun_helpers.get(fun)
+            copied_out = fun_helper is not None and (fun_helper.by_value or fun_helper.ret_type.startswith('array:'))
+            assigned: list[tuple[str, Node]] = []
+            sinks: list[Node] = []
+            in_loops: set[Node] = set()
+
+            def walk(child: Node, in_loop: bool = False):
+                if isinstance(child, (FunDefNode, StructDefNode, ImportNode)):
+                    return  # analysed on their own
+                if in_loop and child in self.allocations:
+                    in_loops.add(child)
+                if isinstance(child, VarAssignNode):
+                    assigned.append((child.name.value, child.value))
+                elif isinstance(child, ReturnNode) and child.value and not copied_out:
+                    sinks.append(child.value)  # a value returned by value is copied, its memory can stay
+                elif isinstance(child, ListAssignNode):
+                    sinks.extend([child.index, child.value])  # a map keeps its str keys
+                elif isinstance(child, StructAssignNode):
+                    sinks.append(child.value)
+                elif isinstance(child, ListNode):
+                    sinks.extend(child.content)
+                elif isinstance(child, FunCallNode) and child.identifier.value not in builtins:
+                    name, offset = child.identifier.value, 0
+                    if f'{name}:create' in kept_params:
+                        name, offset = f'{name}:create', 1  # the object itself is the first parameter
+                    kept = kept_params.get(name)
+                    sinks.extend(arg for i, arg in enumerate(child.args) if kept is None or i + offset in kept)
+                in_loop = in_loop or isinstance(child, (WhileNode, ForNode, ForEachNode))
+                for grandchild in child.children():
+                    walk(grandchild, in_loop)
+
+            walk(body)
+            if fun in self.fun_helpers and 'global' in self.fun_helpers[fun].effects:
+                sinks.extend(value for _, value in assigned)  # any of them could be a top level variable
+
+            held: dict[str, set[Node]] = {}
+
+            def sources(value: Node) -> set[Node]:
+                """The allocations an expression can evaluate to"""
+                if value in self.allocations:
+                    return {value}
+                elif isinstance(value, VarAccessNode):
+                    return held.get(value.name.value, set())
+                elif isinstance(value, IfNode) and value.is_expr:
+                    return sources(value.expr) | sources(value.else_expr)
+                return set()
+
+            def copies(value: Node) -> set[Node]:
+                """The allocations an expression can evaluate to that some variable already holds"""
+                if isinstance(value, VarAccessNode):
+                    return sources(value)
+                elif isinstance(value, IfNode) and value.is_expr:
+                    return copies(value.expr) | copies(value.else_expr)
+                return set()
+
+            changed = True
+            while changed:
+                changed = False
+                for name, value in assigned:
+                    new = sources(value) - held.get(name, set())
+                    if new:
+                        held.setdefault(name, set()).update(new)
+                        changed = True
+            escaped = set().union(*(sources(sink) for sink in sinks))
+            copied = set().union(*(copies(value) for _, value in assigned))
+            escaped |= in_loops & copied
+            if escaped and fun in self.fun_helpers:
+                self.fun_helpers[fun].effects.add('alloc')
+            escaping |= escaped
+        return escaping
+
+    @staticmethod
+    def is_constant_list(node: ListNode) -> bool:
+        """Return if a list literal only contains number literals, so it can be emitted as global constant"""
+        return len(node.content) > 0 and all(isinstance(value, NumberNode) for value in node.content)
 
     def visit(self, node: Node) -> tuple[ir.Value, ir.Type] | None:
         """Dynamic visit method, returns a tuple of value and type for expressions and None for statements"""
@@ -144,12 +377,19 @@ class IrBuilder:
 
     def visitStatementsNode(self, node: StatementsNode):
         for expr in node.expressions:
-            self.visit(expr)
+            self.visit_body(expr)
+
+    def visit_body(self, node: Node):
+        """Visit a statement or the body of an if, loop or function, the new references made in it are released after it"""
+        mark = len(self.temporaries)
+        self.visit(node)
+        self.release_temporaries(mark)
 
     def visitFunDefNode(self, node: FunDefNode):
+        if node.type_params or node in self.fun_helpers and not self.fun_helpers[node].used:
+            return  # generic, only its instances are built, or nothing calls it
         name: str = node.identifier.value
         body = node.body
-        param_names: list[str] = [p.value for p in node.args]
         param_types: list[ir.Type] = []
         for t in node.arg_types:
             Type = self.get_type(t.value, t.pos)
@@ -158,16 +398,66 @@ class IrBuilder:
             param_types.append(Type)
             name += f'.{Type}'.replace('"', '').replace('%', '')
         return_type = self.get_type(node.return_type.value, node.return_type.pos)
-        if return_type.__class__ in [ir.IdentifiedStructType, ir.LiteralStructType]:
-            return_type = return_type.as_pointer()
+        fun_helper = self.fun_helpers.get(node)
+        if isinstance(return_type, ir.BaseStructType) and not self.is_array(return_type.as_pointer()) and not (
+                fun_helper and fun_helper.by_value):
+            return_type = return_type.as_pointer()  # arrays and small objects are returned by value
 
-        fun_type = ir.FunctionType(return_type, param_types)
+        if self.is_sret(return_type):  # the caller passes the memory for the result
+            fun_type = ir.FunctionType(self.null_type, [return_type.as_pointer(), *param_types])
+        else:
+            fun_type = ir.FunctionType(return_type, param_types)
 
         try:
-            func = ir.Function(self.module, fun_type, name)
+            func = ir.Function(self.module, fun_type, node.identifier.value if node.export else name)
         except DuplicatedNameError as e:
             self.err(DuplicateNameError, f'the name {name} is defined multiple times!', node.identifier.pos)
-        block = func.append_basic_block(f'{name}_entry')
+        if node.export:
+            self.exports.append(node)
+            self.foreign.initializer = self.bool_type(1)
+            small_ints = [self.bool_type, self.byte_type]  # C expects them zero extended to a full register
+            for arg in func.args:
+                if arg.type in small_ints:
+                    arg.add_attribute('zeroext')
+            if return_type in small_ints:
+                func.return_value.add_attribute('zeroext')
+        elif name != 'main':
+            func.linkage = 'internal'
+            func.calling_convention = 'fastcc'
+        self.add_fun_attributes(func, node)
+
+        body_func = func
+        recursion_target = func  # what the function calls when it calls itself
+        if fun_helper and fun_helper.memo_size:
+            body_func = ir.Function(self.module, fun_type, f'{name}.memo')
+            body_func.linkage = 'internal'
+            body_func.calling_convention = 'fastcc'
+            self.add_fun_attributes(body_func, node)
+            self.memo_wrapper(func, body_func, fun_helper.memo_size)
+        elif self.multiversion and name != 'main' and self.has_loop(body):
+            versions: list[tuple[str, ir.Function]] = []
+            for level in [None, *self.cpu_levels]:
+                version = ir.Function(self.module, fun_type, f'{name}.{level if level else "default"}')
+                version.linkage = 'internal'
+                version.calling_convention = 'fastcc'
+                version.attributes = TargetAttributes()
+                self.add_fun_attributes(version, node)
+                if level:
+                    version.attributes.add(f'"target-cpu"="{level}"')
+                versions.append((level, version))
+            self.dispatch(func, versions)
+            for _, version in versions[1:]:
+                self.fun_body(node, name, version, version, param_types, return_type)
+            body_func = recursion_target = versions[0][1]  # recursion stays in the version picked once
+        self.fun_body(node, name, body_func, recursion_target, param_types, return_type)
+        self.env.define(name, func, return_type)
+
+    def fun_body(self, node: FunDefNode, name: str, body_func: ir.Function, func: ir.Function,
+                 param_types: list[ir.Type], return_type: ir.Type):
+        """Build the body of the function name into body_func, inside of it name refers to func"""
+        param_names: list[str] = [p.value for p in node.args]
+        body = node.body
+        block = body_func.append_basic_block(f'{name}_entry')
 
         with self.allocator.set_block(block):
 
@@ -180,48 +470,283 @@ class IrBuilder:
             self.context = Context(self.context, f'{name}({param_name})', self.context.file, self.context.file_text)
 
             params_ptr: list[ir.AllocaInstr] = []
+            prev_result = self.result
+            self.result = body_func.args[0] if self.is_sret(return_type) else None
+            args = body_func.args[1:] if self.result else body_func.args
 
             for i, typ in enumerate(param_types):
                 ptr = self.builder.alloca(typ, name=param_names[i])
                 params_ptr.append(ptr)
 
             for i, typ in enumerate(param_types):
-                self.builder.store(func.args[i], params_ptr[i])
+                self.builder.store(args[i], params_ptr[i])
 
+            prev_locals = self.enter_function()
+            assigned = self.assigned_names(body)
+            self.borrowed = self.borrowed_names(body, param_names)
             for i, x in enumerate(zip(param_types, param_names)):
                 typ = param_types[i]
                 ptr = params_ptr[i]
+                if self.is_array(typ):  # arrays are values, the function works on its own copy
+                    copy = self.allocator.alloca(typ.pointee, name=f'{x[1]}_copy')
+                    self.builder._anchor += 1
+                    self.copy_value(copy, args[i])
+                    self.builder.store(copy, ptr)
+                elif self.is_counted(typ) and x[1] in assigned:
+                    self.retain(args[i])  # parameters are borrowed, one that is reassigned needs its own
+                    self.owned_slots.append(ptr)
 
                 self.env.define(x[1], ptr, typ)
 
             self.env.define(name, func, return_type)
 
-            self.visit(body)
+            if self.steps is not None:
+                self.give_up_if_exhausted(body_func)
+            self.visit_body(body)
             if return_type == self.null_type and not self.builder.block.is_terminated:
+                self.release_locals()
+                self.free_heap_slots()
                 self.builder.ret_void()
             elif not self.builder.block.is_terminated:
                 self.err(InvalidSyntaxError, f'Missing return statement', node.identifier.pos)
 
+            self.drop_rc_pairs(body_func)
+            self.leave_function(prev_locals)
+            self.result = prev_result
             self.env = self.env.parent
-            self.env.define(name, func, return_type)
             self.builder = prev_builder
             self.context = self.context.parent
 
+    def count_steps(self):
+        """
+        Make the functions built afterwards count their steps, to run them while compiling, see Evaluator.
+        Every call and every loop iteration takes a step. Once steps becomes negative loops end and calls return 0
+        right away, so the code finishes fast and the caller knows to throw away its result.
+        That happens when the steps are used up, or by give_up
+        """
+        long_type = ir.IntType(64)
+        self.steps = ir.GlobalVariable(self.module, long_type, 'hb_steps')
+        self.steps.initializer = long_type(0)
+        self.stack_limit = ir.GlobalVariable(self.module, long_type, 'hb_stack_limit')
+        self.stack_limit.initializer = long_type(0)
+        ir.Function(self.module, ir.FunctionType(self.str_type, []), 'llvm.stacksave')  # the stack pointer
+
+    def give_up(self):
+        """
+        Stop when the stack gets lower than stack_limit or an int division would trap. The steps left so far are kept
+        below -give_up_offset, so the caller can still spend them on other calls
+        """
+        steps = self.builder.load(self.steps, name='steps')
+        kept = self.builder.sub(steps, steps.type(self.give_up_offset), name='kept_steps')
+        first = self.builder.icmp_signed('>=', steps, steps.type(0), name='first_give_up')
+        self.builder.store(self.builder.select(first, kept, steps, name='given_up'), self.steps)
+
+    def spend_step(self, go_on: ir.Value) -> ir.Value:
+        """go_on, as long as there are steps left when steps are counted"""
+        if self.steps is None:
+            return go_on
+        left = self.builder.sub(self.builder.load(self.steps, name='steps'), self.steps.type.pointee(1),
+                                name='steps_left')
+        self.builder.store(left, self.steps)
+        return self.builder.and_(go_on, self.builder.icmp_signed('>=', left, left.type(0)), name='within_budget')
+
+    def give_up_if_exhausted(self, func: ir.Function):
+        """Return 0 from func at once if the steps are used up or its frame would go below the stack limit"""
+        stack = self.builder.ptrtoint(self.builder.call(self.module.get_global('llvm.stacksave'), [], name='stack'), self.stack_limit.type.pointee,
+                                      name='stack_address')
+        low = self.builder.icmp_unsigned('<', stack, self.builder.load(self.stack_limit, name='stack_limit'),
+                                         name='stack_low')
+        with self.builder.if_then(low):
+            self.give_up()
+        go_on = self.spend_step(self.builder.not_(low, name='stack_left'))
+        body = func.append_basic_block(f'{func.name}_body')
+        exhausted = func.append_basic_block(f'{func.name}_exhausted')
+        self.builder.cbranch(go_on, body, exhausted)
+        self.builder.position_at_end(exhausted)
+        return_type = func.function_type.return_type
+        if return_type == self.null_type:
+            self.builder.ret_void()
+        else:
+            self.builder.ret(ir.Constant(return_type, None))
+        self.builder.position_at_end(body)
+
+    def memo_wrapper(self, func: ir.Function, body_func: ir.Function, size: int):
+        """
+        Fill func with a direct mapped cache in front of body_func. The arguments are hashed to one of the size slots
+        by fibonacci hashing, a new result evicts whatever was stored in its slot before.
+        Recursive calls in body_func go to func again, so every sub result is cached too
+        """
+        long_type = ir.IntType(64)
+        return_type = func.function_type.return_type
+        entry_type = ir.LiteralStructType([self.bool_type, *[arg.type for arg in func.args], return_type])
+        cache = ir.GlobalVariable(self.module, ir.ArrayType(entry_type, size), f'{func.name}.cache')
+        cache.linkage = 'internal'
+        cache.initializer = ir.Constant(cache.type.pointee, None)
+
+        builder = ir.IRBuilder(func.append_basic_block(f'{func.name}_entry'))
+
+        def as_key(value: ir.Value) -> ir.Value:
+            if value.type == self.float_type:
+                return builder.bitcast(value, long_type, name='key')  # compare bits, so -0.0 and 0.0 stay apart
+            elif value.type == self.int_type:
+                return builder.sext(value, long_type, name='key')
+            return builder.zext(value, long_type, name='key')
+
+        keys = [as_key(arg) for arg in func.args]
+        hash_value = long_type(0)
+        for key in keys:
+            hash_value = builder.mul(builder.xor(hash_value, key), long_type(0x9E3779B97F4A7C15), name='hash')
+        bits = size.bit_length() - 1
+        index = self.int_type(0)
+        if bits:
+            index = builder.trunc(builder.lshr(hash_value, long_type(64 - bits)), self.int_type, name='slot_index')
+        slot = builder.gep(cache, [self.int_type(0), index], name='slot')
+
+        def field(i: int) -> ir.Value:
+            return builder.gep(slot, [self.int_type(0), self.int_type(i)], name='slot_field')
+
+        check_block = func.append_basic_block('memo_check')
+        hit_block = func.append_basic_block('memo_hit')
+        miss_block = func.append_basic_block('memo_miss')
+        builder.cbranch(builder.load(field(0), name='slot_valid'), check_block, miss_block)
+
+        builder.position_at_end(check_block)
+        same = self.bool_type(1)
+        for i, key in enumerate(keys):
+            stored = as_key(builder.load(field(i + 1), name='stored_arg'))
+            same = builder.and_(same, builder.icmp_unsigned('==', stored, key), name='same_args')
+        builder.cbranch(same, hit_block, miss_block)
+
+        builder.position_at_end(hit_block)
+        builder.ret(builder.load(field(len(keys) + 1), name='cached'))
+
+        builder.position_at_end(miss_block)
+        result = builder.call(body_func, func.args, name='result', cconv=body_func.calling_convention)
+        builder.store(self.bool_type(1), field(0))
+        for i, arg in enumerate(func.args):
+            builder.store(arg, field(i + 1))
+        builder.store(result, field(len(keys) + 1))
+        builder.ret(result)
+
+    @staticmethod
+    def has_loop(node: Node) -> bool:
+        """Return if a function body has a while or for loop, those are the functions worth a version per cpu level"""
+        if isinstance(node, (WhileNode, ForNode, ForEachNode)):
+            return True
+        return not isinstance(node, (FunDefNode, StructDefNode)) and any(
+            IrBuilder.has_loop(child) for child in node.children())
+
+    def dispatch(self, func: ir.Function, versions: list[tuple[str | None, ir.Function]]):
+        """
+        Fill func with an indirect call to the best of its versions for the cpu running the program.
+        The pointer is set once at startup, by a constructor reading the cpu features libgcc found
+        """
+        if 'readnone' in func.attributes:
+            func.attributes.discard('readnone')
+            func.attributes.add('readonly')  # it reads the pointer
+        pointer = ir.GlobalVariable(self.module, func.type, f'{func.name}.dispatch')
+        pointer.linkage = 'internal'
+        pointer.initializer = versions[0][1]
+
+        builder = ir.IRBuilder(func.append_basic_block(f'{func.name}_entry'))
+        best = builder.load(pointer, name='version')
+        result = builder.call(best, func.args, name='result', cconv=func.calling_convention, tail=True)
+        if func.function_type.return_type == self.null_type:
+            builder.ret_void()
+        else:
+            builder.ret(result)
+
+        if self.cpu_dispatch is None:
+            init = ir.Function(self.module, ir.FunctionType(self.null_type, []), 'heiabubu.cpu_dispatch')
+            init.linkage = 'internal'
+            self.cpu_dispatch = ir.IRBuilder(init.append_basic_block('cpu_dispatch_entry'))
+
+            cpu_init = ir.Function(self.module, ir.FunctionType(self.null_type, []), '__cpu_indicator_init')
+            self.cpu_dispatch.call(cpu_init, [])
+            cpu_model_type = ir.LiteralStructType([self.int_type] * 3 + [ir.ArrayType(self.int_type, 1)])
+            cpu_model = ir.GlobalVariable(self.module, cpu_model_type, '__cpu_model')
+            features = self.cpu_dispatch.load(
+                self.cpu_dispatch.gep(cpu_model, [self.int_type(0), self.int_type(3), self.int_type(0)]),
+                name='cpu_features')
+            for level, bits in self.cpu_levels.items():
+                has_bits = self.cpu_dispatch.and_(features, self.int_type(bits))
+                self.cpu_supports[level] = self.cpu_dispatch.icmp_unsigned('==', has_bits, self.int_type(bits),
+                                                                           name=f'{level}_supported')
+            self.cpu_dispatch.position_before(self.cpu_dispatch.ret_void())
+
+        best = versions[0][1]
+        for level, version in versions[1:]:
+            best = self.cpu_dispatch.select(self.cpu_supports[level], version, best, name=f'{func.name}.best')
+        self.cpu_dispatch.store(best, pointer)
+
+    def add_fun_attributes(self, func: ir.Function, node: FunDefNode):
+        """
+        Add the attributes following from the effects the Analyser found, Heiabubu has no exceptions so nothing unwinds.
+        A list parameter gets noalias if it is the only pointer parameter and is never used for anything else than
+        being indexed, so no other pointer in the function can point to the same list
+        """
+        func.attributes.add('nounwind')
+        fun_helper = self.fun_helpers.get(node)
+        if fun_helper is None:
+            return
+
+        effects = fun_helper.all_effects()
+        if self.steps is not None:
+            effects.add('global')  # counts its steps in a global variable
+        sret = len(func.args) > len(node.args)  # writes its result to memory of the caller
+        if sret:
+            func.args[0].add_attribute('sret')
+            if not effects:
+                func.attributes.add('argmemonly')
+        elif not effects:
+            func.attributes.add('readnone')
+        elif effects == {'read'}:
+            func.attributes.add('readonly')
+        if not fun_helper.is_recursive():
+            func.attributes.add('norecurse')
+
+        args = func.args[1:] if sret else func.args
+        pointer_params = [i for i, arg in enumerate(args) if arg.type.is_pointer]
+        if len(pointer_params) == 1 and 'global' not in effects:
+            i = pointer_params[0]
+            if node.arg_types[i].value.startswith('list:') and node.args[i].value not in fun_helper.escaping:
+                args[i].add_attribute('noalias')
+
     def visitReturnNode(self, node: ReturnNode):
         value_node = node.value
 
         if not value_node:
+            self.release_temporaries(0, keep=True)
+            self.release_locals()
+            self.free_heap_slots()
             self.builder.ret_void()
             return
 
         value, Type = self.visit(value_node)
-
-        if self.is_str(Type):
+        kept_slot = None
+        if self.result is not None:
+            self.copy_value(self.result, value)  # copied out before its memory may be freed
+        elif self.is_array(Type) or isinstance(self.builder.function.function_type.return_type, ir.BaseStructType):
+            value = self.builder.load(value, name='ret_value')  # copied out before its memory may be freed
+            Type = value.type
+        elif self.is_counted(Type):  # the caller gets a reference of its own
+            slot, _ = self.env.lookup(value_node.name.value) if isinstance(value_node, VarAccessNode) else (None, None)
+            if any(slot is owned for owned in self.owned_slots):
+                kept_slot = slot  # the one of the variable is handed over
+            else:
+                value = self.own(value)
+        self.release_temporaries(0, keep=True)
+        self.release_locals(kept_slot)
+        self.free_heap_slots()  # the returned value escapes, so it never lives in one of these
+
+        if self.result is not None:
+            self.builder.ret_void()
+        elif self.is_str(Type):
             ptr_to_array = self.builder.gep(value,
                                             [self.int_type(0), self.int_type(0)] if Type.pointee.is_pointer else [
                                                 self.int_type(0)], name='ret_temp')
             self.builder.ret(ptr_to_array)
-        elif self.is_list(Type):
+        elif self.is_list(Type) and not self.is_map(Type):
             ptr_to_array = self.builder.gep(value,
                                             [self.int_type(0), self.int_type(0)] if self.is_list(Type.pointee) else [
                                                 self.int_type(0)], name='ret_temp')
@@ -235,16 +760,21 @@ class IrBuilder:
             lst = ir.Constant(ir.ArrayType(self.int_type, 0), [])
             return lst, lst.type
 
+        if self.is_constant_list(node):
+            return self.constant_list(node)
+
         _, list_type = self.visit(values[0])
         resolved_values: list[ir.Value] = []
         for v in values:
             value, Type = self.visit(v)
             if Type != list_type:
                 self.err(TypeError, f'Expected {list_type} type, got {Type}', v.pos)
-            resolved_values.append(value)
+            resolved_values.append(self.own(value) if self.is_counted(Type) else value)
 
-        list_ptr = self.allocator.alloca(ir.ArrayType(list_type, len(values)), name='list_ptr')
-        self.builder._anchor += 1
+        list_ptr = self.allocate(ir.ArrayType(list_type, len(values)), 'list_ptr', node)
+        for obj, drop in self.stack_objects:
+            if obj is list_ptr:  # made anew on every pass of a loop, the new elements are retained already
+                self.builder.call(drop, [self.builder.bitcast(list_ptr, self.str_type, name='list_raw')])
 
         begin = self.builder.gep(list_ptr, [self.int_type(0), self.int_type(0)], name='array.0')
         self.builder.store(resolved_values[0], begin)
@@ -260,20 +790,92 @@ class IrBuilder:
 
         return list_ptr, list_ptr.type
 
+    def constant_list(self, node: ListNode) -> tuple[ir.Value, ir.Type]:
+        """
+        Emit a list literal of numbers as private global constant.
+        Lists that are only read use the global directly, all others get a stack copy made with a single memcpy
+        """
+        values = [self.visitNumberNode(v)[0] for v in node.content]
+        array_type = ir.ArrayType(values[0].type, len(values))
+
+        global_list, first = self.static_global(ir.Constant(array_type, values), f'__list_{self.increment_counter()}')
+        global_list.linkage = 'private'
+        global_list.global_constant = True
+        global_list.unnamed_addr = True
+
+        if node in self.read_only_lists:
+            return first, first.type
+
+        list_ptr = self.allocate(array_type, 'list_ptr', node)
+
+        size = ir.Constant(first.type, None).gep([self.int_type(1)]).ptrtoint(self.int_type)
+        dest = self.builder.bitcast(list_ptr, self.str_type, name='list_dest')
+        src = self.builder.bitcast(first, self.str_type, name='list_src')
+        self.builder.call(self.memcpy, [dest, src, size, self.bool_type(0)])
+
+        return list_ptr, list_ptr.type
+
     def visitListAssignNode(self, node: ListAssignNode):
-        lst = self.visit(node.list)
-        value = self.visit(node.value)
-        index = self.visit(node.index)
+        lst, list_type = self.visit(node.list)
+        value, _ = self.visit(node.value)
+        index, _ = self.visit(node.index)
 
-        idx_ptr = self.builder.gep(lst, index, name='idx_ptr')
-        self.builder.store(value, idx_ptr)
+        if isinstance(list_type, ir.VectorType):
+            ptr, _ = self.env.lookup(node.list.name.value)
+            self.builder.store(self.builder.insert_element(lst, value, index, name='set_lane'), ptr)
+            return
+
+        if self.is_map(list_type):
+            old = None
+            if self.is_counted(value.type):  # the map holds a reference to its values, the replaced one is released
+                old = self.from_slot(self.map_call('get', lst, self.to_slot(index)), self.map_types(list_type)[1],
+                                     node.pos)
+                value = self.own(value)
+            self.map_call('set', lst, self.to_slot(index), self.to_slot(value))
+            if old is not None:
+                self.release(old)
+            return
+        if self.array_class(list_type):
+            self.store_array_object(lst, index, value, self.array_class(list_type))
+            return
+        if self.is_array(list_type):
+            if self.is_counted(value.type):
+                value = self.own(value)  # never released, copies of an array share its elements
+            self.builder.store(self.c_str(value) if self.is_str(value.type) else value, self.array_element(lst, index))
+            return
+
+        indices = [self.int_type(0), index] if isinstance(list_type.pointee, ir.ArrayType) else [index]
+        idx_ptr = self.builder.gep(lst, indices, name='idx_ptr')
+        self.store_reference(value, idx_ptr)
 
     def visitVarAssignNode(self, node: VarAssignNode):
         name: str = node.name.value
         value_node = node.value
         value_type = self.get_type(node.type.value, node.type.pos) if node.type else None
 
-        value, Type = self.visit(value_node)
+        if node.const and self.builder.function is self.load_fun:
+            self.const_global(node)
+            return
+
+        ptr, _ = self.env.lookup(name)
+        if ptr is not None and self.is_appended(node, ptr):
+            self.append_str(ptr, value_node)
+            return
+
+        if node.type and node.type.value.startswith('array:') and isinstance(value_node, ListNode):
+            value, Type = self.array_literal(value_node, value_type)
+        else:
+            value, Type = self.visit(value_node)
+        if self.is_array(Type):
+            fresh = isinstance(value_node, (ListNode, FunCallNode))  # a new array nobody else refers to
+            if self.env.lookup(name) != (None, None):
+                storage, _ = self.env.lookup(name)
+                self.copy_value(self.builder.load(storage, name=f'{name}_storage'), value)
+                return
+            if not fresh:
+                copy = self.allocate(Type.pointee, name, node)
+                self.copy_value(copy, value)
+                value = copy
 
         if value_type is None:
             pass
@@ -283,12 +885,23 @@ class IrBuilder:
                 (value_type != Type.pointee) if Type.is_pointer else True):
             self.err(TypeError, f'Expected {value_type}, got {Type}', node.value.pos)
 
+        _, Type2 = self.env.lookup(name)
+        if self.is_str(Type) and self.str_type in [value_type, Type2]:
+            Type = self.str_type  # a variable declared as str holds any str, not just literals of one length
+
         if self.env.lookup(name) == (None, None):
 
             ptr = self.allocator.alloca(Type, name=name)
             self.builder._anchor += 1
+            if self.is_counted(Type) and name not in self.borrowed:  # replaces a reference whenever it runs
+                init = ir.IRBuilder(ptr.parent)
+                init.position_after(ptr)
+                init.store(ir.Constant(Type, None), ptr)
+                self.builder._anchor += 1
+                self.owned_slots.append(ptr)
 
-            self.builder.store(value, ptr)
+            owned = name not in self.borrowed
+            self.store_reference(value, ptr, release_old=owned, owned=owned)
             self.env.define(name, ptr, Type)
         else:
             ptr, Type2 = self.env.lookup(name)
@@ -296,7 +909,52 @@ class IrBuilder:
                 self.err(TypeError, f'Expected {value_type}, got {Type2}', node.name.pos)
             if Type != Type2:
                 self.err(TypeError, f'Expected {Type2}, got {Type}', node.name.pos)
-            self.builder.store(value, ptr)
+            # a variable that never got its own reference, like a loop variable, can't give up the old one
+            owned = any(ptr is owned for owned in self.owned_slots)
+            self.store_reference(value, ptr, release_old=owned, owned=name not in self.borrowed)
+
+    def is_appended(self, node: VarAssignNode, ptr: ir.Value) -> bool:
+        """Return if an assignment appends to the str of its own variable, like s <- s + t"""
+        value = node.value
+        return isinstance(value, BinOpNode) and value.operator.type == TT.PLUS and isinstance(
+            value.left, VarAccessNode) and value.left.name.value == node.name.value and (
+                ptr.type.pointee == self.str_type) and any(ptr is owned for owned in self.owned_slots)
+
+    def append_str(self, ptr: ir.Value, node: BinOpNode):
+        """Append to the str of a variable, the runtime extends it in place if no one else refers to it"""
+        right_value, right_type = self.visit(node.right)
+        if not self.is_str(right_type):
+            self.err(UnknownNodeError, f'Cannot find operation {node.operator} on {self.str_type} and {right_type}',
+                     node.operator.pos)
+        old = self.builder.load(ptr, name='appended')
+        joined = self.builder.call(self.module.globals.get('hb_str_append'), [old, self.c_str(right_value)],
+                                   name='append_ptr')
+        self.builder.store(joined, ptr)
+
+    def const_global(self, node: VarAssignNode):
+        """
+        A top level const is a global computed at startup, so functions can read the ones the Evaluator could not
+        compute while compiling, even when main runs without the top level code
+        """
+        if self.const_init is None:
+            init = ir.Function(self.module, ir.FunctionType(self.null_type, []), 'heiabubu.consts')
+            init.linkage = 'internal'
+            self.const_init = ir.IRBuilder(init.append_basic_block('consts_entry'))
+        if node.value in self.allocations:
+            self.escaping.add(node.value)  # the global keeps it
+        prev_builder, self.builder = self.builder, self.const_init
+        prev_locals = self.enter_function()
+        with self.allocator.set_block(self.builder.function.entry_basic_block):
+            value, Type = self.visit(node.value)
+            const = ir.GlobalVariable(self.module, Type, f'const.{node.name.value}')
+            const.linkage = 'internal'
+            const.initializer = ir.Constant(Type, None)
+            self.store_reference(value, const, release_old=False)
+            self.release_temporaries(0)
+            self.free_heap_slots()
+        self.leave_function(prev_locals)
+        self.builder = prev_builder
+        self.env.define(node.name.value, const, Type)
 
     def visitVarAccessNode(self, node: VarAccessNode) -> tuple[ir.Value, ir.Type]:
         ptr, Type = self.env.lookup(node.name.value)
@@ -305,12 +963,30 @@ class IrBuilder:
         return self.builder.load(ptr, name=node.name.value), Type
 
     def visitBinOpNode(self, node: BinOpNode) -> tuple[ir.Value, ir.Type]:
-        operator = node.operator
         left_value, left_type = self.visit(node.left)
+        return self.bin_op(node, left_value, left_type)
+
+    def bin_op(self, node: BinOpNode, left_value: ir.Value, left_type: ir.Type) -> tuple[ir.Value, ir.Type]:
+        """The operation of node on its left side, that is already evaluated"""
+        operator = node.operator
+        if left_type == self.bool_type and operator.type in [TT.AND, TT.OR]:
+            return self.short_circuit(left_value, node)
         right_value, right_type = self.visit(node.right)
         value = None
         Type = None
-        if right_type == self.int_type and left_type == self.int_type:
+        if self.is_array(left_type) and operator.type == TT.GET:
+            value = self.builder.load(self.array_element(left_value, right_value), name='array_value')
+            Type = value.type
+
+        elif self.is_map(left_type) and operator.type == TT.GET:
+            found = self.map_call('get', left_value, self.to_slot(right_value))
+            value = self.from_slot(found, self.map_types(left_type)[1], node.pos)
+            Type = value.type
+
+        elif isinstance(left_type, ir.VectorType) or isinstance(right_type, ir.VectorType):
+            value, Type = self.vec_bin_op(left_value, right_value, operator)
+
+        elif right_type == self.int_type and left_type == self.int_type:
             value, Type = self.int_bin_op(left_value, right_value, operator)
 
         elif right_type == self.float_type or left_type == self.float_type:
@@ -333,7 +1009,7 @@ class IrBuilder:
                                                isinstance(left_type.pointee, ir.ArrayType))
 
         elif right_type == self.int_type and self.is_str(left_type):
-            value, Type = self.str_int_bin_op(left_value, right_value, operator)
+            value, Type = self.str_int_bin_op(left_value, right_value, operator, node)
 
         else:
             self.err(UnknownNodeError, f'Cannot find operation {operator} on {left_type} and {right_type}',
@@ -341,6 +1017,34 @@ class IrBuilder:
 
         return value, Type
 
+    def short_circuit(self, left_value: ir.Value, node: BinOpNode) -> tuple[ir.Value, ir.Type]:
+        """Lower & and | on bool to a branch and a phi, so the right side is only evaluated if it decides the result"""
+        is_and = node.operator.type == TT.AND
+        name = 'and' if is_and else 'or'
+        left_block = self.builder.block
+        rhs_block = self.builder.append_basic_block(f'{name}_rhs_{self.increment_counter()}')
+        merge_block = self.builder.append_basic_block(f'{name}_merge_{self.counter}')
+
+        if is_and:
+            self.builder.cbranch(left_value, rhs_block, merge_block)
+        else:
+            self.builder.cbranch(left_value, merge_block, rhs_block)
+
+        self.builder.position_at_end(rhs_block)
+        mark = len(self.temporaries)
+        right_value, right_type = self.visit(node.right)
+        if right_type != self.bool_type:
+            self.err(TypeError, f'Cannot operate bool and {right_type} with {node.operator}', node.operator.pos)
+        self.release_temporaries(mark)  # only made if the right side runs
+        rhs_end_block = self.builder.block
+        self.builder.branch(merge_block)
+
+        self.builder.position_at_end(merge_block)
+        value = self.builder.phi(self.bool_type, name=name)
+        value.add_incoming(self.bool_type(0 if is_and else 1), left_block)
+        value.add_incoming(right_value, rhs_end_block)
+        return value, self.bool_type
+
     def visitUnaryOpNode(self, node: UnaryOpNode) -> tuple[ir.Value, ir.Type]:
         operator = node.operator
         node_value, node_Type = self.visit(node.value)
@@ -349,9 +1053,17 @@ class IrBuilder:
         if operator.type == TT.PLUS:
             value = node_value
         elif operator.type == TT.MINUS:
-            value = self.builder.neg(node_value) if node_Type == self.int_type else self.builder.fneg(node_value)
-        elif operator.type == TT.NOT:
-            value = self.builder.not_(node_value)
+            if isinstance(node_Type, ir.VectorType) and node_Type.element != self.float_type:
+                value = self.builder.sub(ir.Constant(node_Type, None), node_value, name='neg')
+            elif isinstance(node_Type, ir.VectorType) or node_Type == self.float_type:
+                value = self.builder.fneg(node_value)
+            else:
+                value = self.builder.neg(node_value)
+        elif operator.type in [TT.NOT, TT.XOR]:
+            if isinstance(node_Type, ir.VectorType):
+                value = self.builder.xor(node_value, self.splat(node_Type.element(-1), node_Type), name='not')
+            else:
+                value = self.builder.not_(node_value)
         else:
             self.err(UnknownNodeError, f'Cannot find operation {operator} on {node_Type}', operator.pos)
         return value, Type
@@ -363,14 +1075,16 @@ class IrBuilder:
         fmt: str = f'{string}\0'
         c_fmt = ir.Constant(ir.ArrayType(self.byte_type, len(fmt)), bytearray(fmt.encode('utf8')))
 
-        global_fmt = ir.GlobalVariable(self.module, c_fmt.type, name=f'__str_{self.increment_counter()}')
+        global_fmt, chars = self.static_global(c_fmt, f'__str_{self.increment_counter()}')
         global_fmt.linkage = 'internal'
         global_fmt.global_constant = True
-        global_fmt.initializer = c_fmt
 
-        return global_fmt, global_fmt.type
+        return chars, chars.type
+
+    def visitIfNode(self, node: IfNode) -> tuple[ir.Value, ir.Type] | None:
+        if node.is_expr:
+            return self.if_expression(node)
 
-    def visitIfNode(self, node: IfNode):
         condition = node.bool
         consequence = node.expr
         alternative = node.else_expr
@@ -380,54 +1094,228 @@ class IrBuilder:
         if alternative is None:
             with self.builder.if_then(test):
                 self.env = Environment(parent=self.env, name='if_block_env')
-                self.visit(consequence)
+                self.visit_body(consequence)
                 self.env = self.env.parent
         else:
             with self.builder.if_else(test) as (true, otherwise):
                 with true:
                     self.env = Environment(parent=self.env, name='if_block_env')
-                    self.visit(consequence)
+                    self.visit_body(consequence)
                     self.env = self.env.parent
                 with otherwise:
                     self.env = Environment(parent=self.env, name='if_block_env')
-                    self.visit(alternative)
+                    self.visit_body(alternative)
                     self.env = self.env.parent
 
+    def visitScopeNode(self, node: ScopeNode):
+        self.env = Environment(parent=self.env, name='scope_env')
+        self.visit_body(node.body)
+        self.env = self.env.parent
+
+    def visitMatchNode(self, node: MatchNode):
+        value, Type = self.visit(node.value)
+
+        match_counter = self.increment_counter()
+        default_block = self.builder.append_basic_block(f'match_default_{match_counter}')
+        end_block = self.builder.append_basic_block(f'match_end_{match_counter}')
+        switch = self.builder.switch(value, default_block)
+
+        def case_constant(number: int) -> ir.Constant:
+            """The constant with the bits of number, like the i8 -1 for the byte 255"""
+            half = 2 ** (Type.width - 1)
+            return Type((number + half) % (2 * half) - half)
+
+        big_ranges: list[tuple[int, int, ir.Block]] = []
+        for case in node.cases:
+            case_block = self.builder.append_basic_block(f'match_case_{match_counter}')
+            for start, end in case.patterns:
+                if end is None:
+                    switch.add_case(case_constant(start.value), case_block)
+                elif end.value - start.value <= self.max_case_range:
+                    for number in range(start.value, end.value):
+                        switch.add_case(case_constant(number), case_block)
+                else:
+                    big_ranges.append((start.value, end.value, case_block))
+
+            self.builder.position_at_end(case_block)
+            self.env = Environment(parent=self.env, name='match_case_env')
+            self.visit_body(case.body)
+            self.env = self.env.parent
+            if not self.builder.block.is_terminated:
+                self.builder.branch(end_block)
+
+        self.builder.position_at_end(default_block)
+        for start, end, case_block in big_ranges:
+            if end - start >= 2 ** Type.width:  # every value, the width does not even fit into the type
+                in_range = ir.Constant(ir.IntType(1), 1)
+            else:
+                offset = self.builder.sub(value, case_constant(start), name='match_offset')
+                in_range = self.builder.icmp_unsigned('<', offset, case_constant(end - start), name='match_in_range')
+            next_block = self.builder.append_basic_block(f'match_default_{match_counter}')
+            self.builder.cbranch(in_range, case_block, next_block)
+            self.builder.position_at_end(next_block)
+        if node.default:
+            self.env = Environment(parent=self.env, name='match_case_env')
+            self.visit_body(node.default)
+            self.env = self.env.parent
+        if not self.builder.block.is_terminated:
+            self.builder.branch(end_block)
+
+        self.builder.position_at_end(end_block)
+
+    def if_expression(self, node: IfNode) -> tuple[ir.Value, ir.Type]:
+        """
+        Lower a value producing if to a select if both sides are safe to always evaluate,
+        else to a branch for every side and a phi
+        """
+        test, _ = self.visit(node.bool)
+
+        if self.is_speculatable(node.expr) and self.is_speculatable(node.else_expr):
+            then_value, Type = self.if_expression_side(node.expr, False)
+            else_value, _ = self.if_expression_side(node.else_expr, False)
+            return self.builder.select(test, then_value, else_value, name='if_value'), Type
+
+        then_block = self.builder.append_basic_block(f'if_expr_then_{self.increment_counter()}')
+        else_block = self.builder.append_basic_block(f'if_expr_else_{self.counter}')
+        end_block = self.builder.append_basic_block(f'if_expr_end_{self.counter}')
+        self.builder.cbranch(test, then_block, else_block)
+
+        self.builder.position_at_end(then_block)
+        then_value, Type = self.if_expression_side(node.expr, True)
+        then_end_block = self.builder.block
+        self.builder.branch(end_block)
+
+        self.builder.position_at_end(else_block)
+        else_value, _ = self.if_expression_side(node.else_expr, True)
+        else_end_block = self.builder.block
+        self.builder.branch(end_block)
+
+        self.builder.position_at_end(end_block)
+        value = self.builder.phi(Type, name='if_value')
+        value.add_incoming(then_value, then_end_block)
+        value.add_incoming(else_value, else_end_block)
+        if self.is_counted(Type):
+            self.temporaries.append(value)
+        return value, Type
+
+    def if_expression_side(self, node: Node, branched: bool) -> tuple[ir.Value, ir.Type]:
+        """
+        Visit one side of an if expression, strings are cast to str, because literals differ in their length.
+        A side in its own block releases the new references made in it, a str, list or object it evaluates to
+        becomes a new reference either way, so the phi joining the sides always is one
+        """
+        mark = len(self.temporaries)
+        value, Type = self.visit(node)
+        if branched:
+            if self.is_counted(Type):
+                value = self.own(value)
+            self.release_temporaries(mark)
+        if self.is_str(Type) and Type != self.str_type:
+            value = self.builder.bitcast(value, self.str_type, name='if_str')
+            Type = self.str_type
+        return value, Type
+
+    def is_speculatable(self, node: Node) -> bool:
+        """Return if a node can be evaluated even if its value is not needed, so it has no side effect and can't trap"""
+        if isinstance(node, (NumberNode, StringNode, VarAccessNode)):
+            return True
+        if isinstance(node, UnaryOpNode):
+            return self.is_speculatable(node.value)
+        if isinstance(node, IfNode) and node.is_expr:
+            return all(self.is_speculatable(n) for n in [node.bool, node.expr, node.else_expr])
+        if isinstance(node, BinOpNode):
+            if node.operator.type in [TT.DIV, TT.MOD, TT.GET]:
+                return False  # might divide by zero or read out of bounds
+            if node.operator.type == TT.PLUS and (self.is_str_node(node.left) or self.is_str_node(node.right)):
+                return False  # concatenation allocates
+            return self.is_speculatable(node.left) and self.is_speculatable(node.right)
+        return False
+
+    def is_str_node(self, node: Node) -> bool:
+        """Return if a speculatable node produces a str, only literals, variables and if expressions can"""
+        if isinstance(node, StringNode):
+            return True
+        if isinstance(node, VarAccessNode):
+            _, Type = self.env.lookup(node.name.value)
+            return Type is not None and self.is_str(Type)
+        if isinstance(node, IfNode) and node.is_expr:
+            return self.is_str_node(node.expr)
+        return False
+
     def visitWhileNode(self, node: WhileNode):
         condition = node.bool
         body = node.expr
 
         self.env = Environment(parent=self.env, name=f'while_loop_{self.increment_counter()}')
 
+        mark = len(self.temporaries)
         test, Type = self.visit(condition)
+        self.release_temporaries(mark)
 
         consequence = self.builder.append_basic_block(f'while_loop_entry_{self.counter}')
         otherwise = self.builder.append_basic_block(f'while_loop_otherwise_{self.counter}')
 
         self.breaks.append(otherwise)
         self.continues.append(consequence)
+        self.loop_temporaries.append(mark)
 
-        self.builder.cbranch(test, consequence, otherwise)
+        self.builder.cbranch(self.spend_step(test), consequence, otherwise)
 
         self.builder.position_at_start(consequence)
-        self.visit(body)
+        self.visit_body(body)
         test, Type = self.visit(condition)
-        self.builder.cbranch(test, consequence, otherwise)
+        self.release_temporaries(mark)
+        latch = self.builder.cbranch(self.spend_step(test), consequence, otherwise)
+        if node.hints:
+            latch.set_metadata('llvm.loop', self.loop_metadata(node.hints, node.pos))
         self.builder.position_at_start(otherwise)
 
         self.env = self.env.parent
 
         self.breaks.pop()
         self.continues.pop()
+        self.loop_temporaries.pop()
+
+    def loop_metadata(self, hints: list[tuple[Token, Token | None]], pos: Position) -> ir.MDValue:
+        """
+        Build the llvm.loop metadata for the loop hints, it has to reference itself to stay unique.
+        The heiabubu.loop tag survives the loop transformations, so the loop report can find the loop again
+        """
+        tag = f'heiabubu.loop.{len(self.annotated_loops)}'
+        self.annotated_loops.append((tag, pos, self.context))
+
+        def prop(name: str, *values: ir.Value) -> ir.MDValue:
+            return self.module.add_metadata([ir.MetaDataString(self.module, name), *values])
+
+        properties = [prop(tag)]
+        for hint, value in hints:
+            match hint.value:
+                case 'VECTORIZE':
+                    properties.append(prop('llvm.loop.vectorize.enable', self.bool_type(1)))
+                    if value:
+                        properties.append(prop('llvm.loop.vectorize.width', self.int_type(value.value)))
+                case 'UNROLL':
+                    if value:
+                        properties.append(prop('llvm.loop.unroll.count', self.int_type(value.value)))
+                    else:
+                        properties.append(prop('llvm.loop.unroll.enable'))
+                case 'INTERLEAVE':
+                    properties.append(prop('llvm.loop.interleave.count', self.int_type(value.value)))
+
+        loop_id = self.module.add_metadata(properties)
+        loop_id.operands = (loop_id, *loop_id.operands)
+        return loop_id
 
     def visitBreakNode(self, node: BreakNode):
         if len(self.breaks) == 0:
             self.err(InvalidSyntaxError, f'break outside of loop!', node.pos)
+        self.release_temporaries(self.loop_temporaries[-1], keep=True)
         self.builder.branch(self.breaks[-1])
 
     def visitContinueNode(self, node: ContinueNode):
         if len(self.continues) == 0:
             self.err(InvalidSyntaxError, f'continue outside of loop!', node.pos)
+        self.release_temporaries(self.loop_temporaries[-1], keep=True)
         self.builder.branch(self.continues[-1])
 
     def visitForNode(self, node: ForNode):
@@ -465,10 +1353,10 @@ class IrBuilder:
         else:
             self.err(TypeError, f'Unknown types for for loop, got {var_type}, expected int, float, or byte',
                      node.identifier.pos)
-        self.builder.cbranch(cond, loop_body_block, loop_exit_block)
+        self.builder.cbranch(self.spend_step(cond), loop_body_block, loop_exit_block)
 
         self.builder.position_at_end(loop_body_block)
-        self.visit(body)
+        self.visit_body(body)
         self.builder.branch(loop_inc_block)
 
         self.builder.position_at_end(loop_inc_block)
@@ -476,13 +1364,175 @@ class IrBuilder:
         new_value = self.builder.add(old_value, step_value) if not var_type == self.float_type else self.builder.fadd(
             old_value, step_value, name='new_loop_var')
         self.builder.store(new_value, ptr)
-        self.builder.branch(loop_cond_block)
+        latch = self.builder.branch(loop_cond_block)
+        if node.hints:
+            latch.set_metadata('llvm.loop', self.loop_metadata(node.hints, node.pos))
 
         self.builder.position_at_end(loop_exit_block)
 
         self.env = self.env.parent
 
+    def visitForEachNode(self, node: ForEachNode):
+        """Walk the used slots of a map in table order, the loop variables are copies of the key and value"""
+        map_value, map_type = self.visit(node.map)
+        key_type, value_type = self.map_types(map_type)
+
+        cond_block = self.builder.append_basic_block(f'map_loop_cond_{self.increment_counter()}')
+        body_block = self.builder.append_basic_block(f'map_loop_body_{self.counter}')
+        inc_block = self.builder.append_basic_block(f'map_loop_inc_{self.counter}')
+        exit_block = self.builder.append_basic_block(f'map_loop_exit_{self.counter}')
+
+        slot_ptr = self.allocator.alloca(self.int_type, name='map_slot')
+        self.builder._anchor += 1
+        self.builder.store(self.map_call('next', map_value, self.int_type(0)), slot_ptr)
+        self.builder.branch(cond_block)
+
+        self.builder.position_at_end(cond_block)
+        slot = self.builder.load(slot_ptr, name='slot')
+        go_on = self.spend_step(self.builder.icmp_signed('>=', slot, self.int_type(0), name='map_loop_cond'))
+        self.builder.cbranch(go_on, body_block, exit_block)
+
+        self.env = Environment(parent=self.env, name=f'map_loop_{self.counter}')
+        self.breaks.append(exit_block)
+        self.continues.append(inc_block)
+        self.loop_temporaries.append(len(self.temporaries))
+        self.builder.position_at_end(body_block)
+        loop_vars = [(node.key, key_type, 'key_at')] + ([(node.value, value_type, 'value_at')] if node.value else [])
+        for identifier, typ, getter in loop_vars:
+            ptr = self.allocator.alloca(self.get_type(typ, identifier.pos), name=identifier.value)
+            self.builder._anchor += 1
+            self.builder.store(self.from_slot(self.map_call(getter, map_value, slot), typ, identifier.pos), ptr)
+            self.env.define(identifier.value, ptr, ptr.type.pointee)
+        self.visit_body(node.expr)
+        if not self.builder.block.is_terminated:
+            self.builder.branch(inc_block)
+        self.breaks.pop()
+        self.continues.pop()
+        self.loop_temporaries.pop()
+        self.env = self.env.parent
+
+        self.builder.position_at_end(inc_block)
+        next_slot = self.builder.add(self.builder.load(slot_ptr, name='old_slot'), self.int_type(1), name='next_slot')
+        self.builder.store(self.map_call('next', map_value, next_slot), slot_ptr)
+        self.builder.branch(cond_block)
+
+        self.builder.position_at_end(exit_block)
+
+    def array_literal(self, node: ListNode, typ: ir.LiteralStructType) -> tuple[ir.Value, ir.Type]:
+        """A new array filled with the elements of a list literal, numbers only are stored as one constant"""
+        ptr = self.allocate(typ, 'array', node)
+        if self.is_constant_list(node):
+            values = [self.visitNumberNode(v)[0] for v in node.content]
+            self.builder.store(ir.Constant(typ, [ir.Constant(typ.elements[0], values)]), ptr)
+            return ptr, ptr.type
+        struct_obj = self.array_class(ptr.type)
+        for i, element in enumerate(node.content):
+            value, _ = self.visit(element)
+            if struct_obj:
+                self.store_array_object(ptr, self.int_type(i), value, struct_obj)
+                continue
+            value = self.c_str(value) if self.is_str(value.type) else value
+            self.builder.store(value, self.array_element(ptr, self.int_type(i)))
+        return ptr, ptr.type
+
+    def array_element(self, ptr: ir.Value, index: ir.Value) -> ir.Value:
+        return self.builder.gep(ptr, [self.int_type(0), self.int_type(0), index], inbounds=True, name='array_idx_ptr')
+
+    def soa_type(self, name: str, size: int) -> ir.IdentifiedStructType:
+        """An array of size objects of the soa class name, one array per field in the order of the class fields"""
+        soa_type = self.module.context.get_identified_type(f'soa:{name}:{size}')
+        if soa_type.is_opaque:
+            soa_type.set_body(*[ir.ArrayType(field, size) for field in self.get_type(name, None).elements])
+        return soa_type
+
+    def is_soa(self, typ: ir.Type) -> bool:
+        return typ.is_pointer and isinstance(typ.pointee, ir.IdentifiedStructType) and typ.pointee.name.startswith(
+            'soa:')
+
+    def array_class(self, typ: ir.Type) -> Struct | None:
+        """The class of the objects in an array, None for an array of numbers or strs or no array at all"""
+        if self.is_soa(typ):
+            return self.structs[typ.pointee.name.split(':')[1]]
+        if not self.is_array(typ) or not isinstance(typ.pointee.elements[0].element, ir.IdentifiedStructType):
+            return None
+        return self.structs[typ.pointee.elements[0].element.name]
+
+    def array_field(self, ptr: ir.Value, index: ir.Value, struct_obj: Struct, field: int) -> ir.Value:
+        """Pointer to a field of the object at index of an array, in its own array if the class is soa"""
+        name = f'{struct_obj.name}.{list(struct_obj.field_indices)[field]}_ptr'
+        if struct_obj.soa:
+            return self.builder.gep(ptr, [self.int_type(0), self.int_type(field), index], inbounds=True, name=name)
+        return self.builder.gep(self.array_element(ptr, index), [self.int_type(0), self.int_type(field)],
+                                inbounds=True, name=name)
+
+    def store_array_object(self, ptr: ir.Value, index: ir.Value, obj: ir.Value, struct_obj: Struct):
+        """Copy the fields of an object into an array, the array keeps its own references to them"""
+        for field in range(len(struct_obj.field_indices)):
+            value = self.builder.load(self.builder.gep(obj, [self.int_type(0), self.int_type(field)]), name='field')
+            if self.is_counted(value.type):
+                self.retain(value)  # never released, like all array elements
+            self.builder.store(value, self.array_field(ptr, index, struct_obj, field))
+
+    def copy_value(self, dest: ir.Value, src: ir.Value):
+        """Copy the array or object src points to into the memory dest points to"""
+        size = ir.Constant(dest.type, None).gep([self.int_type(1)]).ptrtoint(self.int_type)
+        self.builder.call(self.memcpy, [self.builder.bitcast(dest, self.str_type, name='array_dest'),
+                                        self.builder.bitcast(src, self.str_type, name='array_src'), size,
+                                        self.bool_type(0)])
+
+    def is_sret(self, typ: ir.Type) -> bool:
+        """
+        Whether a function returning typ by value gets a pointer to memory of the caller as first parameter and writes
+        its result there, instead of returning it in registers. Both ends then know where the copy goes
+        """
+        return isinstance(typ, ir.BaseStructType) and self.type_layout(typ)[0] > self.max_register_return
+
+    def is_array(self, typ: ir.Type) -> bool:
+        return typ.is_pointer and isinstance(typ.pointee, ir.LiteralStructType) and len(
+            typ.pointee.elements) == 1 and isinstance(typ.pointee.elements[0], ir.ArrayType) or self.is_soa(typ)
+
+    def is_map(self, typ: ir.Type) -> bool:
+        return typ.is_pointer and isinstance(typ.pointee, ir.IdentifiedStructType) and typ.pointee.name.startswith(
+            'map:')
+
+    @staticmethod
+    def map_types(typ: ir.PointerType) -> tuple[str, str]:
+        """The heiabubu key and value types of a map, kept in the name of its type"""
+        _, key_type, value_type = typ.pointee.name.split(':', 2)
+        return key_type, value_type
+
+    def map_call(self, name: str, map_value: ir.Value, *args: ir.Value) -> ir.CallInstr:
+        """Call the runtime function hb_map_<name> on a map"""
+        raw = self.builder.bitcast(map_value, self.map_type.as_pointer(), name='map_raw')
+        return self.builder.call(self.module.globals.get(f'hb_map_{name}'), [raw, *args], name=f'map_{name}')
+
+    def to_slot(self, value: ir.Value) -> ir.Value:
+        """A key or value as the i64 the map stores, pointers like str keys are stored as their address"""
+        slot = ir.IntType(64)
+        if value.type == self.int_type:
+            return self.builder.sext(value, slot, name='slot')
+        if value.type == self.float_type:
+            return self.builder.bitcast(value, slot, name='slot')
+        if value.type in [self.bool_type, self.byte_type]:
+            return self.builder.zext(value, slot, name='slot')
+        if isinstance(value.type.pointee, ir.ArrayType):
+            value = self.builder.gep(value, [self.int_type(0), self.int_type(0)], name='first')
+        return self.builder.ptrtoint(value, slot, name='slot')
+
+    def from_slot(self, value: ir.Value, typ: str, pos: Position) -> ir.Value:
+        """Turn the i64 of a map back into a value of the heiabubu type typ"""
+        Type = self.get_type(typ, pos)
+        if Type == self.float_type:
+            return self.builder.bitcast(value, Type, name='map_float')
+        if isinstance(Type, ir.IntType):
+            return self.builder.trunc(value, Type, name='map_int')
+        if isinstance(Type, ir.BaseStructType):
+            Type = Type.as_pointer()  # objects are stored by reference
+        return self.builder.inttoptr(value, Type, name='map_ptr')
+
     def visitStructDefNode(self, node: StructDefNode):
+        if node.type_params:
+            return  # generic, only its instances are built
         name: str = node.identifier.value
         funcs = node.functions
         idents = [ident.value for ident in node.values.keys()]
@@ -491,71 +1541,116 @@ class IrBuilder:
         if self.structs.get(name):
             self.err(DuplicateNameError, f'Class type {name} is already defined', node.identifier.pos)
 
-        self.structs[name] = Struct(name, idents)
+        field_types = [self.get_type(typ, list(node.values.values())[i].pos) for i, typ in enumerate(types)]
+        order = list(range(len(idents)))
+        if not node.ordered:
+            # biggest alignment first leaves no holes between the fields, sorted is stable for equal alignments
+            order.sort(key=lambda i: -self.type_layout(field_types[i])[1])
+
+        struct_helper = Struct(name, [idents[i] for i in order])
+        self.structs[name] = struct_helper
 
         struct_type = self.module.context.get_identified_type(name)
-        struct_type.set_body(*[self.get_type(typ, list(node.values.values())[i].pos) for i, typ in enumerate(types)])
+        struct_type.set_body(*[field_types[i] for i in order])
+
+        struct_helper.size, _ = self.type_layout(struct_type)
+        struct_helper.declared_size, _ = self.type_layout(ir.LiteralStructType(field_types))
+        struct_helper.ordered = node.ordered
+        struct_helper.soa = node.soa
+        if node.soa and not idents:
+            self.err(TypeError, f'The soa class {name} needs at least one property', node.identifier.pos)
+        offset = 0
+        for i in order:
+            size, align = self.type_layout(field_types[i])
+            offset += -offset % align
+            struct_helper.layout.append((idents[i], types[i], offset, size))
+            offset += size
+
+        counted = [i for i, typ in enumerate(struct_type.elements) if self.is_counted(typ)]
+        if counted:
+            struct_helper.drop = ir.Function(self.module, self.drop_type, f'{name}:drop')
+            struct_helper.drop.linkage = 'internal'
+            builder = ir.IRBuilder(struct_helper.drop.append_basic_block(f'{name}:drop_entry'))
+            obj = builder.bitcast(struct_helper.drop.args[0], struct_type.as_pointer(), name='obj')
+            for i in counted:
+                field = builder.load(builder.gep(obj, [self.int_type(0), self.int_type(i)]), name='field')
+                builder.call(self.module.globals.get('hb_release'), [builder.bitcast(field, self.str_type)])
+            builder.ret_void()
 
         for fun in funcs:
             self.visit(fun)
 
+    def type_layout(self, typ: ir.Type) -> tuple[int, int]:
+        """Size and alignment in bytes of a type, as on the 64 bit targets heiabubu compiles for"""
+        if isinstance(typ, ir.PointerType) or typ == self.float_type:
+            return 8, 8
+        elif isinstance(typ, ir.IntType):
+            size = max(typ.width // 8, 1)
+            return size, size
+        elif isinstance(typ, ir.ArrayType):
+            size, align = self.type_layout(typ.element)
+            return size * typ.count, align
+        elif isinstance(typ, ir.VectorType):
+            size = self.type_layout(typ.element)[0] * typ.count
+            return size, size
+        elif isinstance(typ, ir.BaseStructType):
+            offset, struct_align = 0, 1
+            for element in typ.elements:
+                size, align = self.type_layout(element)
+                offset += -offset % align + size
+                struct_align = max(struct_align, align)
+            return offset + -offset % struct_align, struct_align
+        raise AssertionError(f'No layout for {typ}')
+
+    def object_field(self, node: Node, key: Token) -> tuple[ir.Value, Struct, bool]:
+        """
+        Pointer to the field key of the object node evaluates to, an object in an array is found by its index.
+        Also returns if the object is in an array, those never release the references in their fields
+        """
+        in_array = False
+        if isinstance(node, BinOpNode) and node.operator.type == TT.GET:
+            lst, list_type = self.visit(node.left)
+            struct_obj = self.array_class(list_type)
+            if struct_obj is None:
+                struct, struct_type = self.bin_op(node, lst, list_type)
+            else:
+                index, _ = self.visit(node.right)
+                in_array = True
+        else:
+            struct, struct_type = self.visit(node)
+        if not in_array:
+            struct_obj = self.structs[struct_type.pointee.name if struct_type.is_pointer else struct_type.name]
+
+        field = struct_obj.field_indices.get(key.value)
+        if field is None:
+            self.err(IndexError, f'Object from class {struct_obj.name} has no attr called {key.value}', key.pos)
+        if in_array:
+            return self.array_field(lst, index, struct_obj, field), struct_obj, True
+        ptr = self.builder.gep(struct, [self.int_type(0), self.int_type(field)],
+                               name=f'{struct_obj.name}.{key.value}_ptr')
+        return ptr, struct_obj, False
+
     def visitStructAssignNode(self, node: StructAssignNode):
-        struct, struct_type = self.visit(node.obj)
-        key: str = node.key.value
+        ptr, _, in_array = self.object_field(node.obj, node.key)
         value, value_type = self.visit(node.value)
-        struct_obj = self.structs[struct_type.pointee.name if struct_type.is_pointer else struct_type.name]
-
-        index = struct_obj.field_indices.get(key)
-        if index is None:
-            self.err(IndexError, f'Object from class {struct_obj.name} has no attr called {key}', node.key.pos)
-
-        ptr = self.builder.gep(struct, [self.int_type(0), self.int_type(index)], name=f'{struct_obj.name}.{key}_ptr')
-        self.builder.store(value, ptr)
+        self.store_reference(value, ptr, release_old=not in_array)
 
     def visitStructReadNode(self, node: StructReadNode) -> tuple[ir.Value, ir.Type]:
-        struct, struct_type = self.visit(node.obj)
-        key: str = node.key.value
-        struct_obj = self.structs[struct_type.pointee.name if struct_type.is_pointer else struct_type.name]
-
-        index = struct_obj.field_indices.get(key)
-        if index is None:
-            self.err(IndexError, f'Object from class {struct_obj.name} has no attr called {key}', node.key.pos)
-
-        if not struct_type.is_pointer:
-            raise AssertionError('struct_type.is_pointer is true! line 498')
-            pass  # todo when is this the case?
-
-        ptr = self.builder.gep(struct, [self.int_type(0), self.int_type(index)] if struct_type.is_pointer else [
-            self.int_type(index)], name=f'{struct_obj.name}.{key}_ptr')
-        value = self.builder.load(ptr, name=f'{struct_obj.name}.{key}')
+        ptr, struct_obj, _ = self.object_field(node.obj, node.key)
+        value = self.builder.load(ptr, name=f'{struct_obj.name}.{node.key.value}')
         return value, value.type
 
     def visitImportNode(self, node: ImportNode):
         file_path = node.file_path.value
-        if self.global_imports.get(file_path) is not None:
+        if self.global_imports.get(file_path) is not None or node.ast is None:
             print(colored(f'Already imported {file_path} globally!', 'red'))
             return
 
-        with open(os.path.abspath(f'{file_path}.hb'), 'r') as f:  # todo
-            file_code = f.read()
-
-        ctx = Context(self.context, f'load_{file_path}()', file_path, file_code)
-        lexer = Lexer(ctx)
-        tokens = lexer.make_tokens()
-        if isinstance(tokens, Error):
-            raise tokens
-        parser = Parser(tokens, ctx)
-        ast = parser.parse()
-        if isinstance(ast, Error):
-            raise ast
-
-        analyser = Analyser(ctx)
-        analyser.check(ast)
-
         prev_block = self.builder.block
-        self.context = ctx
-        self.build(ast)
-        self.context = ctx.parent
+        prev_context = self.context
+        self.context = node.context
+        self.build(node.ast)
+        self.context = prev_context
         self.builder.position_at_end(prev_block)
 
         self.global_imports[file_path] = True
@@ -566,6 +1661,16 @@ class IrBuilder:
 
         if name in self.structs.keys():
             return self.init_struct(node)
+        if name.startswith('array:'):
+            array_type = self.get_type(name, node.pos)
+            ptr = self.allocate(array_type, 'array', node)
+            self.builder.store(ir.Constant(array_type, None), ptr)
+            return ptr, ptr.type
+        if name.startswith('map:'):
+            map_value = self.builder.call(self.module.globals.get('hb_map_new'),
+                                          [self.bool_type(name.split(':')[1] == 'str')], name='new_map')
+            map_type = self.get_type(name, node.pos)
+            return self.builder.bitcast(map_value, map_type, name='map'), map_type
 
         args: list[ir.Value] = []
         types: list[ir.Type] = []
@@ -580,8 +1685,8 @@ class IrBuilder:
                 p_val = ptr
                 p_type = ptr.type
             elif p_type.is_pointer and isinstance(p_type.pointee, ir.ArrayType):
-                p_val = self.builder.bitcast(p_val, self.str_type, name='str_bitcast')
-                p_type = self.str_type
+                p_type = p_type.pointee.element.as_pointer()
+                p_val = self.builder.bitcast(p_val, p_type, name='str_bitcast' if self.is_str(p_type) else 'list_bitcast')
             args.append(p_val)
             types.append(p_type)
 
@@ -598,8 +1703,35 @@ class IrBuilder:
                 ret = self.printf(params=args, return_type=types[0])
                 ret_type = self.int_type
             case 'getchar':
-                ret = self.getchar()
+                ret = self.getchar(node)
                 ret_type = ir.ArrayType(self.byte_type, 2).as_pointer()
+            case 'vec' | 'shuffle' | 'vec_load' | 'vec_store' | 'reduce_add' | 'reduce_mul' | 'reduce_min' | \
+                 'reduce_max':
+                ret, ret_type = self.vec_builtin(name, args)
+            case 'sqrt' | 'exp' | 'exp2' | 'log' | 'log2' | 'log10' | 'sin' | 'cos' | 'fabs' | 'floor' | 'ceil' | \
+                 'round' | 'trunc' | 'fma' | 'min' | 'max' | 'popcount' | 'ctlz' | 'cttz' | 'prefetch':
+                ret, ret_type = self.math_builtin(name, args)
+            case 'has':
+                ret = self.map_call(name, args[0], self.to_slot(args[1]))
+                ret_type = self.bool_type
+            case 'remove':
+                _, value_type = self.map_types(types[0])
+                old = None
+                if self.is_counted(self.get_type(value_type, node.pos)):  # 0 if missing, releasing null does nothing
+                    old = self.from_slot(self.map_call('get', args[0], self.to_slot(args[1])), value_type, node.pos)
+                ret = self.map_call(name, args[0], self.to_slot(args[1]))
+                if old is not None:
+                    self.release(old)
+                ret_type = self.bool_type
+            case 'reserve':
+                ret = self.map_call(name, args[0], args[1])
+                ret_type = self.null_type
+            case 'len' if types and self.is_map(types[0]):
+                ret = self.map_call(name, args[0])
+                ret_type = self.int_type
+            case 'len' if types and self.is_array(types[0]):
+                ret = self.int_type(types[0].pointee.elements[0].count)  # part of the type, known while compiling
+                ret_type = self.int_type
             case _:
                 for typ in types:
                     name += f'.{typ}'.replace('"', '').replace('%', '')
@@ -607,13 +1739,26 @@ class IrBuilder:
                 if not func:
                     self.err(NoSuchVarError, f'No function called {name}', node.identifier.pos)
 
-                expected_len = len(func.args)
+                result = None
+                if self.is_sret(ret_type):  # the function writes its result here
+                    result = self.allocate(ret_type, 'result', node)
+                    args.insert(0, result)
+                expected_len = len(func.args) - (result is not None)
                 real_len = len(params)
                 if real_len != expected_len:
                     self.err(InvalidSyntaxError, f'Expected {expected_len} parameters, got {real_len}',
                              node.identifier.pos)
 
-                ret = self.builder.call(func, args, name=f'{name}.ret')
+                ret = self.builder.call(func, args, name='' if result else f'{name}.ret',
+                                        cconv=func.calling_convention)
+                if result is not None:
+                    ret, ret_type = result, result.type
+                elif isinstance(ret_type, ir.BaseStructType):  # an array or small object returned by value
+                    ptr = self.allocate(ret_type, 'result', node)
+                    self.builder.store(ret, ptr)
+                    ret, ret_type = ptr, ptr.type
+                elif self.is_counted(ret_type):
+                    self.temporaries.append(ret)  # functions return a reference of their own
         return ret, ret_type
 
     def init_struct(self, node: FunCallNode) -> tuple[ir.Value, ir.Type]:
@@ -626,21 +1771,32 @@ class IrBuilder:
 
         for p in params:
             p_val, p_type = self.visit(p)
+            if p_type.is_pointer and isinstance(p_type.pointee, ir.ArrayType):  # a list or str literal
+                p_type = p_type.pointee.element.as_pointer()
+                p_val = self.builder.bitcast(p_val, p_type, name='str_bitcast' if self.is_str(p_type) else 'list_bitcast')
             args.append(p_val)
             types.append(p_type)
             create_name += f'.{p_type}'.replace('"', '').replace('%', '')
 
         struct_type = self.module.context.get_identified_type(name)
 
-        struct_ptr = self.allocator.alloca(struct_type, name=name)
-        self.builder._anchor += 1
+        struct_ptr = self.allocate(struct_type, name, node)
+        old = None
+        if any(struct_ptr is obj for obj, _ in self.stack_objects):  # made anew on every pass of a loop
+            old = self.builder.load(struct_ptr, name='old_obj')  # released after, the arguments may be its fields
+        if self.structs[name].drop:
+            self.builder.store(ir.Constant(struct_type, None), struct_ptr)  # fields hold no references yet
 
         args.insert(0, struct_ptr)
         types.insert(0, struct_ptr.type)
 
         fun, funty = self.env.lookup(create_name)
 
-        self.builder.call(fun, args, name=f'{name}:create')
+        self.builder.call(fun, args, name=f'{name}:create', cconv=fun.calling_convention)
+        if old is not None:
+            for i, typ in enumerate(struct_type.elements):
+                if self.is_counted(typ):
+                    self.release(self.builder.extract_value(old, i, name='old_field'))
 
         return struct_ptr, struct_ptr.type
 
@@ -651,6 +1807,22 @@ class IrBuilder:
         self.err(UnknownNodeError, f'Tried to resolve unknown node: {node.__class__.__name__}!\nnode json:\n{node}\n',
                  node.pos)
 
+    def checked_divisor(self, left_value: ir.Value, right_value: ir.Value) -> ir.Value:
+        """
+        When steps are counted, a division by 0 or of the smallest int by -1 would trap and take the compiler down
+        with it, so it uses up the steps and divides by 1 instead
+        """
+        if self.steps is None:
+            return right_value
+        typ = right_value.type
+        by_zero = self.builder.icmp_signed('==', right_value, typ(0), name='by_zero')
+        overflow = self.builder.and_(self.builder.icmp_signed('==', left_value, typ(-(1 << (typ.width - 1)))),
+                                     self.builder.icmp_signed('==', right_value, typ(-1)), name='div_overflow')
+        traps = self.builder.or_(by_zero, overflow, name='traps')
+        with self.builder.if_then(traps):
+            self.give_up()
+        return self.builder.select(traps, typ(1), right_value, name='divisor')
+
     def int_bin_op(self, left_value: ir.Value, right_value: ir.Value, operator: Token) -> tuple[ir.Value, ir.Type]:
         Type = self.int_type
         value = None
@@ -662,9 +1834,9 @@ class IrBuilder:
             case TT.MUL:
                 value = self.builder.mul(left_value, right_value, name='mul')
             case TT.DIV:
-                value = self.builder.sdiv(left_value, right_value, name='div')
+                value = self.builder.sdiv(left_value, self.checked_divisor(left_value, right_value), name='div')
             case TT.MOD:
-                value = self.builder.srem(left_value, right_value, name='mod')
+                value = self.builder.srem(left_value, self.checked_divisor(left_value, right_value), name='mod')
             case TT.POW:
                 pass  # todo value = self.builder.call(self.powi, [left_value, right_value], name='powi.ret')
                 self.err(RuntimeError, 'calling pow on int and int is not implemented yet!', operator.pos)
@@ -688,8 +1860,16 @@ class IrBuilder:
                 Type = self.bool_type
             case TT.AND:
                 value = self.builder.and_(left_value, right_value, name='and')
+            case TT.OR:
+                value = self.builder.or_(left_value, right_value, name='or')
             case TT.XOR:
                 value = self.builder.xor(left_value, right_value, name='xor')
+            case TT.LSHIFT:
+                value = self.builder.shl(left_value, right_value, name='shl')
+            case TT.RSHIFT:
+                value = self.builder.ashr(left_value, right_value, name='ashr')
+            case TT.URSHIFT:
+                value = self.builder.lshr(left_value, right_value, name='lshr')
             case _:
                 self.err(InvalidSyntaxError, f'unknown operation {operator} on int and int', operator.pos)
         return value, Type
@@ -756,13 +1936,149 @@ class IrBuilder:
                 self.err(InvalidSyntaxError, f'unknown operation {operator} on bool and bool', operator.pos)
         return value, Type
 
+    def vec_bin_op(self, left_value: ir.Value, right_value: ir.Value, operator: Token) -> tuple[ir.Value, ir.Type]:
+        """Element wise operations on vectors, a scalar on one side gets copied into every lane first"""
+        vec_type = left_value.type if isinstance(left_value.type, ir.VectorType) else right_value.type
+        if operator.type == TT.GET:
+            value = self.builder.extract_element(left_value, right_value, name='lane')
+            return value, value.type
+        left_value = self.splat(left_value, vec_type)
+        right_value = self.splat(right_value, vec_type)
+        if vec_type.element != self.float_type:
+            value, _ = self.int_bin_op(left_value, right_value, operator)
+            return value, vec_type
+
+        match operator.type:
+            case TT.PLUS:
+                value = self.builder.fadd(left_value, right_value, name='plus')
+            case TT.MINUS:
+                value = self.builder.fsub(left_value, right_value, name='minus')
+            case TT.MUL:
+                value = self.builder.fmul(left_value, right_value, name='mul')
+            case TT.DIV:
+                value = self.builder.fdiv(left_value, right_value, name='div')
+            case TT.MOD:
+                value = self.builder.frem(left_value, right_value, name='mod')
+            case _:
+                self.err(InvalidSyntaxError, f'unknown operation {operator} on {vec_type}', operator.pos)
+        return value, vec_type
+
+    def splat(self, value: ir.Value, vec_type: ir.VectorType) -> ir.Value:
+        """Copy a scalar into every lane of a vector, vectors are returned as they are"""
+        if value.type == vec_type:
+            return value
+        single = self.builder.insert_element(ir.Constant(vec_type, ir.Undefined), value, self.int_type(0), name='splat')
+        mask = ir.Constant(ir.VectorType(self.int_type, vec_type.count), None)
+        return self.builder.shuffle_vector(single, ir.Constant(vec_type, ir.Undefined), mask, name='splat')
+
+    def vec_builtin(self, name: str, args: list[ir.Value]) -> tuple[ir.Value, ir.Type]:
+        """Create, shuffle, reduce, load and store vectors, the Analyser already checked the constant arguments"""
+        match name:
+            case 'vec':
+                value = ir.Constant(ir.VectorType(args[0].type, len(args)), ir.Undefined)
+                for i, arg in enumerate(args):
+                    value = self.builder.insert_element(value, arg, self.int_type(i), name='vec')
+                return value, value.type
+            case 'shuffle':
+                second = args[1] if args[1].type == args[0].type else ir.Constant(args[0].type, ir.Undefined)
+                lanes = args[2:] if args[1].type == args[0].type else args[1:]
+                mask = ir.Constant(ir.VectorType(self.int_type, len(lanes)),
+                                   [self.int_type(lane.constant) for lane in lanes])
+                value = self.builder.shuffle_vector(args[0], second, mask, name='shuffle')
+                return value, value.type
+            case 'vec_load' | 'vec_store':
+                element_type = args[0].type.pointee
+                vec_type = ir.VectorType(element_type, args[2].constant) if name == 'vec_load' else args[2].type
+                element_ptr = self.builder.gep(args[0], [args[1]], name='vec_element_ptr')
+                ptr = self.builder.bitcast(element_ptr, vec_type.as_pointer(), name='vec_ptr')
+                align, _ = self.type_layout(element_type)
+                if name == 'vec_load':
+                    return self.builder.load(ptr, name='vec_load', align=align), vec_type
+                self.builder.store(args[2], ptr, align=align)
+                return None, self.null_type
+        return self.vec_reduce(args[0], name.removeprefix('reduce_'))
+
+    def math_builtin(self, name: str, args: list[ir.Value]) -> tuple[ir.Value, ir.Type]:
+        """
+        Call the llvm intrinsic behind a math or bit builtin. Being intrinsics the optimiser knows they have no side
+        effects, folds them for constants and the vectorizer turns them into their vector versions
+        """
+        typ = args[0].type
+        element_type = typ.element if isinstance(typ, ir.VectorType) else typ
+        match name:
+            case 'prefetch':
+                element_ptr = self.builder.gep(args[0], [args[1]], name='prefetch_element_ptr')
+                ptr = self.builder.bitcast(element_ptr, self.str_type, name='prefetch_ptr')
+                prefetch = self.intrinsic('llvm.prefetch', self.str_type,
+                                          ir.FunctionType(self.null_type, [self.str_type, *[self.int_type] * 3]))
+                # for reading, keep it in all cache levels, data not instructions
+                self.builder.call(prefetch, [ptr, self.int_type(0), self.int_type(3), self.int_type(1)])
+                return None, self.null_type
+            case 'min' | 'max' if element_type == self.float_type:
+                intrinsic = f'llvm.{name}num'
+            case 'min' | 'max':
+                intrinsic = f'llvm.{"u" if element_type == self.byte_type else "s"}{name}'
+            case 'ctlz' | 'cttz':  # the count is the bit width for 0
+                func = self.intrinsic(f'llvm.{name}', typ, ir.FunctionType(typ, [typ, self.bool_type]))
+                value = self.builder.call(func, [args[0], self.bool_type(0)], name=name)
+                return value, value.type
+            case 'popcount':
+                intrinsic = 'llvm.ctpop'
+            case _:
+                intrinsic = f'llvm.{name}'
+        value = self.builder.call(self.intrinsic(intrinsic, typ, ir.FunctionType(typ, [typ] * len(args))), args,
+                                  name=name)
+        return value, value.type
+
+    def intrinsic(self, name: str, typ: ir.Type, fun_type: ir.FunctionType) -> ir.Function:
+        """Declare the llvm intrinsic name overloaded for typ once, vectors get names like llvm.sqrt.v4f64"""
+        suffix = f'v{typ.count}{typ.element.intrinsic_name}' if isinstance(typ, ir.VectorType) else typ.intrinsic_name
+        func = self.module.globals.get(f'{name}.{suffix}')
+        return func if func else ir.Function(self.module, fun_type, f'{name}.{suffix}')
+
+    def vec_reduce(self, value: ir.Value, operation: str) -> tuple[ir.Value, ir.Type]:
+        """
+        Combine all lanes of a vector by halving it until one lane is left, so floats get added up pairwise.
+        Bytes are compared unsigned for min and max, ints signed
+        """
+        is_float = value.type.element == self.float_type
+        while value.type.count > 1:
+            half = value.type.count // 2
+            undefined = ir.Constant(value.type, ir.Undefined)
+
+            def lanes(start: int) -> ir.Value:
+                mask = ir.Constant(ir.VectorType(self.int_type, half),
+                                   [self.int_type(i) for i in range(start, start + half)])
+                return self.builder.shuffle_vector(value, undefined, mask, name='reduce_half')
+
+            low, high = lanes(0), lanes(half)
+            match operation:
+                case 'add':
+                    value = self.builder.fadd(low, high, name='reduce') if is_float else self.builder.add(low, high,
+                                                                                                         name='reduce')
+                case 'mul':
+                    value = self.builder.fmul(low, high, name='reduce') if is_float else self.builder.mul(low, high,
+                                                                                                         name='reduce')
+                case _:
+                    compare = '<' if operation == 'min' else '>'
+                    if is_float:
+                        smaller = self.builder.fcmp_ordered(compare, low, high, name='reduce_cmp')
+                    elif value.type.element == self.byte_type:
+                        smaller = self.builder.icmp_unsigned(compare, low, high, name='reduce_cmp')
+                    else:
+                        smaller = self.builder.icmp_signed(compare, low, high, name='reduce_cmp')
+                    value = self.builder.select(smaller, low, high, name='reduce')
+        value = self.builder.extract_element(value, self.int_type(0), name='reduced')
+        return value, value.type
+
     def list_int_bin_op(self, left_value: ir.Value, right_value: ir.Value, operator: Token, bitcast: bool) -> tuple[
             ir.Value, ir.Type]:
         value, Type = None, None
         match operator.type:
             case TT.GET:
                 if bitcast:
-                    left_value = self.builder.bitcast(left_value, self.int_type.as_pointer(), 'list_to_ptr')
+                    element_type = left_value.type.pointee.element
+                    left_value = self.builder.bitcast(left_value, element_type.as_pointer(), 'list_to_ptr')
                 ptr = self.builder.gep(left_value, [right_value], name='list_element_ptr')  # todo why is here a todo?
                 value = self.builder.load(ptr, name=f'list_element')
                 Type = value.type
@@ -786,48 +2102,20 @@ class IrBuilder:
         value, Type = None, None
         match operator.type:
             case TT.PLUS:
-                str_ptr1 = self.builder.gep(left_value, [self.int_type(0)] if left_value.type == self.str_type else [
-                    self.int_type(0), self.int_type(0)], name="str_ptr1")
-                str_ptr2 = self.builder.gep(right_value, [self.int_type(0)] if left_value.type == self.str_type else [
-                    self.int_type(0), self.int_type(0)], name="str_ptr2")
-
-                len1 = self.builder.call(self.module.globals.get("strlen"), [str_ptr1], name="len1")
-
-                len2 = self.builder.call(self.module.globals.get("strlen"), [str_ptr2], name="len2")
-
-                # Allocate Memory
-                total_length = self.builder.add(len1, len2)
-                concat_ptr = self.builder.call(self.module.globals.get("malloc"), [total_length], name="concat_ptr")
-
-                # Copy the first string (left_value) into the allocated memory
-                self.builder.call(self.module.globals.get("strcpy"), [concat_ptr, str_ptr1], name="copy_ptr1")
-
-                # Calculate the offset for appending the second string (right_value)
-                offset_ptr2 = self.builder.gep(concat_ptr, [len1], name="offset_ptr2")
-
-                # Copy the second string (right_value) into the allocated memory at the offset position
-                self.builder.call(self.module.globals.get("strcpy"), [offset_ptr2, str_ptr2], name="copy_ptr1")
-
-                value = concat_ptr
-
+                value = self.builder.call(self.module.globals.get('hb_str_concat'),
+                                          [self.c_str(left_value), self.c_str(right_value)], name='concat_ptr')
                 Type = value.type
+                self.temporaries.append(value)
 
             case TT.EQUALS:
-                str_ptr1 = self.builder.gep(left_value, [self.int_type(0)] if left_value.type == self.str_type else [
-                    self.int_type(0), self.int_type(0)], name="str_ptr1")
-                str_ptr2 = self.builder.gep(right_value, [self.int_type(0)] if left_value.type == self.str_type else [
-                    self.int_type(0), self.int_type(0)], name="str_ptr2")
-                eq = self.builder.call(self.module.globals.get("strcmp"), [str_ptr1, str_ptr2], name='int_eq')
-                value = self.builder.icmp_signed('==', eq, self.int_type(0), name='eq')
+                value = self.builder.call(self.module.globals.get('hb_str_eq'),
+                                          [self.c_str(left_value), self.c_str(right_value)], name='eq')
                 Type = value.type
 
             case TT.UNEQUALS:
-                str_ptr1 = self.builder.gep(left_value, [self.int_type(0)] if left_value.type == self.str_type else [
-                    self.int_type(0), self.int_type(0)], name="str_ptr1")
-                str_ptr2 = self.builder.gep(right_value, [self.int_type(0)] if left_value.type == self.str_type else [
-                    self.int_type(0), self.int_type(0)], name="str_ptr2")
-                eq = self.builder.call(self.module.globals.get("strcmp"), [str_ptr1, str_ptr2], name='int_eq')
-                value = self.builder.icmp_signed('!=', eq, self.int_type(0), name='eq')
+                eq = self.builder.call(self.module.globals.get('hb_str_eq'),
+                                       [self.c_str(left_value), self.c_str(right_value)], name='int_eq')
+                value = self.builder.not_(eq, name='uneq')
                 Type = value.type
 
             case _:
@@ -835,7 +2123,8 @@ class IrBuilder:
 
         return value, Type
 
-    def str_int_bin_op(self, left_value: ir.Value, right_value: ir.Value, operator: Token) -> tuple[ir.Value, ir.Type]:
+    def str_int_bin_op(self, left_value: ir.Value, right_value: ir.Value, operator: Token,
+                       node: BinOpNode) -> tuple[ir.Value, ir.Type]:
         match operator.type:
             case TT.GET:
                 char_ptr = self.builder.gep(left_value,
@@ -843,12 +2132,8 @@ class IrBuilder:
                                                                                                     right_value],
                                             name="str_idx_ptr")
                 i8_value = self.builder.load(char_ptr, name='char_i8_value')
-                arr_ptr = self.allocator.alloca(ir.ArrayType(self.byte_type, 2), name='char_str_ptr')
-                self.builder._anchor += 1
-                c_ptr = self.builder.gep(arr_ptr, [self.int_type(0), self.int_type(0)], name='real_char_ptr')
-                self.builder.store(i8_value, c_ptr)
-                none_ptr = self.builder.gep(arr_ptr, [self.int_type(0), self.int_type(1)], name='none_ptr')
-                self.builder.store(self.byte_type(0), none_ptr)
+                arr_ptr = self.allocate(ir.ArrayType(self.byte_type, 2), 'char_str_ptr', node)
+                self.builder.call(self.module.globals.get('hb_char_str'), [self.c_str(arr_ptr), i8_value])
                 value = arr_ptr
                 Type = arr_ptr.type
             case _:
@@ -871,22 +2156,260 @@ class IrBuilder:
             fmt_arg = self.builder.bitcast(string_val, self.str_type, name='c_str_to_ptr')
             return self.builder.call(func, [fmt_arg, *rest_params], name='printf.ret')
         else:
-            fmt_arg = self.builder.bitcast(self.module.get_global(f'__str_{self.counter}'), self.str_type,
-                                           name='c_str_to_ptr')
+            fmt_arg = params[0] if params[0].type == self.str_type else self.builder.bitcast(params[0], self.str_type,
+                                                                                            name='c_str_to_ptr')
             return self.builder.call(func, [fmt_arg, *rest_params], name='printf.ret')
 
-    def getchar(self) -> ir.Value:
-        """Invoke the standard c getchar function, convert the returned integer to a string afterward"""
-        int_value = self.builder.call(self.module.globals.get('getchar'), [], name='int_getchar.ret')
-        byte_value = self.builder.trunc(int_value, self.byte_type, name='getchar_trunc')
-        ptr = self.allocator.alloca(ir.ArrayType(self.byte_type, 2), name='getchar_str')
-        self.builder._anchor += 1
-        elem_ptr = self.builder.gep(ptr, [self.int_type(0), self.int_type(0)], name='getchar_str_elem')
-        self.builder.store(byte_value, elem_ptr)
-        elem_ptr = self.builder.gep(ptr, [self.int_type(0), self.int_type(1)], name='getchar_str_null')
-        self.builder.store(self.byte_type(0), elem_ptr)
+    def getchar(self, node: FunCallNode) -> ir.Value:
+        """Invoke the standard c getchar function through the runtime, which makes a string of the char"""
+        ptr = self.allocate(ir.ArrayType(self.byte_type, 2), 'getchar_str', node)
+        self.builder.call(self.module.globals.get('hb_getchar_str'), [self.c_str(ptr)], name='getchar.ret')
         return ptr
 
+    def c_str(self, value: ir.Value) -> ir.Value:
+        """Pointer to the first char of a str, whether it is an i8* already or points to a char array"""
+        if value.type == self.str_type:
+            return value
+        if isinstance(value, (ir.Constant, ir.GlobalValue)):
+            return value.gep([self.int_type(0), self.int_type(0)])
+        chars = self.builder.gep(value, [self.int_type(0), self.int_type(0)], name='c_str')
+        if value in self.static_values:
+            self.static_values.add(chars)
+        return chars
+
+    def allocate(self, typ: ir.Type, name: str, node: Node) -> ir.Value:
+        """
+        Memory for the list, str or object created by node, behind a reference count header. It stays on the stack
+        unless it escapes its function or is bigger than max_stack_size, then it goes to the heap.
+        Escaping memory is a new reference, freed by the last release. A big one that does not escape is freed again
+        when the same node allocates anew or the function returns, like stack memory its references are not counted.
+        The fields of an object on the stack are released when the function returns
+        """
+        drop = self.drop_function(typ)
+        if node not in self.escaping and self.type_layout(typ)[0] <= self.max_stack_size:
+            block = self.allocator.block
+            count = len(block.instructions)
+            memory = self.allocator.alloca(ir.LiteralStructType([self.rc_type, typ]), name=f'{name}_memory')
+            init = ir.IRBuilder(block)
+            init.position_after(memory)
+            ptr = init.gep(memory, [self.int_type(0), self.int_type(1)], name=name)
+            self.static_header(init, ptr)
+            if drop:
+                init.store(ir.Constant(typ, None), ptr)
+                self.stack_objects.append((ptr, drop))
+            self.builder._anchor += len(block.instructions) - count
+            self.static_values.add(ptr)
+            return ptr
+
+        size = ir.Constant(typ.as_pointer(), None).gep([self.int_type(1)]).ptrtoint(self.int_type)
+        if node in self.escaping:
+            raw = self.builder.call(self.module.globals.get('hb_alloc'),
+                                    [size, drop if drop else ir.Constant(self.drop_type.as_pointer(), None)],
+                                    name=f'{name}_heap')
+            ptr = self.builder.bitcast(raw, typ.as_pointer(), name=name)
+            self.temporaries.append(ptr)
+            return ptr
+
+        slot = self.allocator.alloca(self.str_type, name=f'{name}_slot')
+        init = ir.IRBuilder(slot.parent)
+        init.position_after(slot)
+        init.store(ir.Constant(self.str_type, None), slot)
+        self.builder._anchor += 2
+        self.heap_slots.append(slot)
+        self.builder.call(self.module.globals.get('free'), [self.builder.load(slot, name=f'{name}_old')])
+
+        header_size = self.type_layout(self.rc_type)[0]
+        raw = self.builder.call(self.module.globals.get('malloc'), [self.builder.add(size, self.int_type(header_size))],
+                                name=f'{name}_heap')
+        self.builder.store(raw, slot)
+        chars = self.builder.gep(raw, [self.int_type(header_size)], name=f'{name}_start')
+        ptr = self.builder.bitcast(chars, typ.as_pointer(), name=name)
+        self.static_header(self.builder, ptr)
+        self.static_values.add(ptr)
+        return ptr
+
+    def free_heap_slots(self):
+        """Free the big heap memory of the current function that did not escape, before returning"""
+        for slot in self.heap_slots:
+            self.builder.call(self.module.globals.get('free'), [self.builder.load(slot, name='heap_old')])
+
+    def rc_header(self) -> ir.Constant:
+        """A reference count header with count -1, for memory that is never freed by releasing it"""
+        return ir.Constant(self.rc_type, [self.int_type(-1), ir.Constant(self.drop_type.as_pointer(), None)])
+
+    def static_header(self, builder: ir.IRBuilder, ptr: ir.Value):
+        """Write a never freed header in front of the memory ptr points to"""
+        raw = builder.gep(builder.bitcast(ptr, self.str_type), [self.int_type(-self.type_layout(self.rc_type)[0])])
+        builder.store(self.rc_header(), builder.bitcast(raw, self.rc_type.as_pointer()))
+
+    def static_global(self, value: ir.Constant, name: str) -> tuple[ir.GlobalVariable, ir.Constant]:
+        """A global behind a never freed header, returns the global and the address of value in it"""
+        typ = ir.LiteralStructType([self.rc_type, value.type])
+        global_value = ir.GlobalVariable(self.module, typ, name=name)
+        global_value.initializer = ir.Constant(typ, [self.rc_header(), value])
+        return global_value, global_value.gep([self.int_type(0), self.int_type(1)])
+
+    def drop_function(self, typ: ir.Type) -> ir.Function | None:
+        """
+        The function releasing the fields of an object or the elements of a list of type typ, None if it has nothing
+        to release. A list knows its length only where it is made, so there is one function for every list type
+        """
+        if isinstance(typ, ir.IdentifiedStructType) and typ.name in self.structs:
+            return self.structs[typ.name].drop
+        if not isinstance(typ, ir.ArrayType) or not self.is_counted(typ.element):
+            return None
+        name = f'list:drop.{typ}'.replace('"', '').replace('%', '')
+        if name in self.module.globals:
+            return self.module.globals[name]
+        drop = ir.Function(self.module, self.drop_type, name)
+        drop.linkage = 'internal'
+        builder = ir.IRBuilder(drop.append_basic_block(f'{name}_entry'))
+        lst = builder.bitcast(drop.args[0], typ.as_pointer(), name='lst')
+        for i in range(typ.count):
+            element = builder.load(builder.gep(lst, [self.int_type(0), self.int_type(i)]), name='element')
+            builder.call(self.module.globals.get('hb_release'), [builder.bitcast(element, self.str_type)])
+        builder.ret_void()
+        return drop
+
+    def is_counted(self, typ: ir.Type) -> bool:
+        """Return if the references to values of a type are counted, strs, lists, arrays and objects are"""
+        return typ.is_pointer and not self.is_map(typ)
+
+    def is_static(self, value: ir.Value) -> bool:
+        """Return if value is never freed, like literals and stack memory, then counting its references is pointless"""
+        return isinstance(value, (ir.Constant, ir.GlobalValue)) or value in self.static_values
+
+    def retain(self, value: ir.Value):
+        if not self.is_static(value):
+            self.builder.call(self.module.globals.get('hb_retain'), [self.builder.bitcast(value, self.str_type)])
+
+    def release(self, value: ir.Value):
+        if not self.is_static(value):
+            self.builder.call(self.module.globals.get('hb_release'), [self.builder.bitcast(value, self.str_type)])
+
+    def own(self, value: ir.Value) -> ir.Value:
+        """Make value a reference for whatever stores it, a new reference is taken over, any other one retained"""
+        for i, temporary in enumerate(self.temporaries):
+            if temporary is value:
+                del self.temporaries[i]
+                return value
+        self.retain(value)
+        return value
+
+    def store_reference(self, value: ir.Value, ptr: ir.Value, release_old: bool = True, owned: bool = True):
+        """
+        Store value into ptr, a str, list or object stored keeps a reference and the one it replaces is released.
+        Not owned stores value without taking a reference, for borrowed variables
+        """
+        typ = ptr.type.pointee
+        if not self.is_counted(typ):
+            self.builder.store(value, ptr)
+            return
+        if owned:
+            value = self.own(value)
+        if typ == self.str_type:
+            value = self.c_str(value)
+        old = self.builder.load(ptr, name='replaced') if release_old else None
+        self.builder.store(value, ptr)
+        if old is not None:
+            self.release(old)
+
+    def release_temporaries(self, mark: int, keep: bool = False):
+        """
+        Release the new references made since there were mark of them, nothing holds on to them.
+        keep leaves them in the list, for a return leaving the function early
+        """
+        if not self.builder.block.is_terminated:
+            for temporary in self.temporaries[mark:]:
+                self.release(temporary)
+        if not keep:
+            del self.temporaries[mark:]
+
+    def release_locals(self, kept_slot: ir.AllocaInstr | None = None):
+        """Release the references of the variables and stack objects of the current function, before it returns"""
+        for slot in self.owned_slots:
+            if slot is not kept_slot:
+                self.release(self.builder.load(slot, name='local_old'))
+        for obj, drop in self.stack_objects:
+            self.builder.call(drop, [self.builder.bitcast(obj, self.str_type, name='obj_raw')])
+
+    def enter_function(self) -> tuple:
+        """Start with no variables, temporaries and memory for a new function, returns those of the one around it"""
+        prev = self.heap_slots, self.owned_slots, self.stack_objects, self.temporaries, self.borrowed
+        self.heap_slots, self.owned_slots, self.stack_objects, self.temporaries, self.borrowed = [], [], [], [], set()
+        return prev
+
+    def leave_function(self, prev: tuple):
+        self.heap_slots, self.owned_slots, self.stack_objects, self.temporaries, self.borrowed = prev
+
+    @staticmethod
+    def assigned_names(node: Node) -> set[str]:
+        """The names of the variables a function body assigns to, without those of the functions inside of it"""
+        if isinstance(node, (FunDefNode, StructDefNode)):
+            return set()
+        names = {node.name.value} if isinstance(node, VarAssignNode) else set()
+        return names.union(*(IrBuilder.assigned_names(child) for child in node.children()))
+
+    @staticmethod
+    def borrowed_names(body: Node, params: list[str]) -> set[str]:
+        """
+        The variables of a function body only ever assigned other variables, that keep their value until the function
+        returns: parameters that are never reassigned and variables assigned once, outside of loops and branches.
+        Those hold on to the value for them, so copying it around a loop needs no counting
+        """
+        values: dict[str, list[Node]] = {}
+
+        def collect(node: Node):
+            if isinstance(node, (FunDefNode, StructDefNode)):
+                return
+            if isinstance(node, VarAssignNode):
+                values.setdefault(node.name.value, []).append(node.value)
+            for child in node.children():
+                collect(child)
+
+        collect(body)
+        statements = body.expressions if isinstance(body, StatementsNode) else [body]
+        once = {node.name.value for node in statements if isinstance(node, VarAssignNode)}
+        stable = {name for name in params if name not in values}
+        stable |= {name for name in once if len(values[name]) == 1}
+        return {name for name, assigned in values.items() if all(
+            isinstance(value, VarAccessNode) and value.name.value in stable and value.name.value != name
+            for value in assigned)}
+
+    def drop_rc_pairs(self, func: ir.Function):
+        """
+        Remove every retain followed by a release of the same pointer with no other call in between, nothing can free
+        it there, so the count ends up the same. A load of a variable is followed back to the value last stored into it
+        """
+        retain, release = self.module.globals.get('hb_retain'), self.module.globals.get('hb_release')
+        for block in func.blocks:
+            sources: dict[ir.Value, ir.Value] = {}  # instruction to the value it passes on
+            stored: dict[ir.Value, ir.Value] = {}  # variable to the value last stored into it
+            pending: dict[ir.Value, ir.Instruction] = {}  # pointer to its retain
+            removed: list[ir.Instruction] = []
+
+            def source(value: ir.Value) -> ir.Value:
+                return sources.get(value, value)
+
+            for instr in block.instructions:
+                if isinstance(instr, ir.CastInstr) and instr.opname == 'bitcast':
+                    sources[instr] = source(instr.operands[0])
+                elif isinstance(instr, ir.LoadInstr) and instr.operands[0] in stored:
+                    sources[instr] = stored[instr.operands[0]]
+                elif isinstance(instr, ir.StoreInstr):
+                    stored[instr.operands[1]] = source(instr.operands[0])
+                elif isinstance(instr, ir.CallInstr) and instr.callee is retain:
+                    pending[source(instr.args[0])] = instr
+                elif isinstance(instr, ir.CallInstr):
+                    pointer = source(instr.args[0]) if instr.callee is release else None
+                    if pointer in pending:
+                        removed.extend([pending.pop(pointer), instr])
+                    else:
+                        pending.clear()
+                        stored.clear()
+            for instr in removed:
+                block.instructions.remove(instr)
+
     def is_str(self, typ: ir.Type) -> bool:
         """Return if a type is a Heiabubu string"""
         if typ == self.str_type:
@@ -921,10 +2444,25 @@ class IrBuilder:
 
 
 class Struct:
-    """Simply a helper for mapping field names to their index"""
+    """Simply a helper for mapping field names to their index, also keeps the memory layout for the layout report"""
     def __init__(self, name: str, fields: list[str]):
         self.name = name
         self.field_indices = dict((field, idx) for idx, field in enumerate(fields))
+        self.layout: list[tuple[str, str, int, int]] = []  # name, type, offset and size of each field in memory order
+        self.size = 0
+        self.declared_size = 0  # the size with the fields in declaration order
+        self.ordered = False
+        self.soa = False  # arrays of it keep every field in an array of its own
+        self.drop: ir.Function | None = None  # releases the strs, lists and objects in the fields
+
+
+class TargetAttributes(ir.FunctionAttributes):
+    """Function attributes that also take the target cpu, so one function can be compiled for a different cpu"""
+    def add(self, name: str):
+        if name.startswith('"target-cpu"='):
+            set.add(self, name)
+        else:
+            super().add(name)
 
 
 class Allocator:
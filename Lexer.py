@@ -19,7 +19,8 @@ class Lexer:
         self.escape_chars = dict(n='\n', t='\t')
         self.types = dict(INT='int', FLOAT='float', NULL='null', BOOL='bool', STR='str', BYTE='byte', LIST='list')
         self.keywords = ['IF', 'ELSE', 'FOR', 'STEP', 'WHILE', 'FUN', 'RETURN', 'BREAK', 'CONTINUE', 'CLASS', 'PASS',
-                         'IMPORT']
+                         'IMPORT', 'MATCH', 'VECTORIZE', 'UNROLL', 'INTERLEAVE', 'MEMO',
+                         'ORDERED', 'SOA', 'EXPORT', 'CONST']
         self._advance()
 
     def _advance(self) -> None:
@@ -227,6 +228,10 @@ class Lexer:
                 self._advance()
                 start_pos.len = self.pos.index - start_pos.index
                 return Token(TT.ASSIGN, None, start_pos)
+            case '<':
+                self._advance()
+                start_pos.len = self.pos.index - start_pos.index
+                return Token(TT.LSHIFT, None, start_pos)
             case _:
                 return Token(TT.LESS, None, start_pos)
 
@@ -237,6 +242,14 @@ class Lexer:
             self._advance()
             start_pos.len = self.pos.index - start_pos.index
             return Token(TT.GREATEREQUAL, None, start_pos)
+        elif self.current_char == '>':
+            self._advance()
+            token_type = TT.RSHIFT
+            if self.current_char == '>':
+                self._advance()
+                token_type = TT.URSHIFT
+            start_pos.len = self.pos.index - start_pos.index
+            return Token(token_type, None, start_pos)
         else:
             return Token(TT.GREATER, None, start_pos)
 
@@ -1,6 +1,7 @@
 import json
 from typing import List
 
+from Context import Context
 from Token import Token, TT, Position
 
 class Node:
@@ -18,6 +19,21 @@ class Node:
     def json(self) -> dict:
         pass
 
+    def children(self) -> List['Node']:
+        """All direct child nodes, found by looking through the attributes, lists and tuples of this node"""
+        nodes: List[Node] = []
+
+        def collect(value):
+            if isinstance(value, Node):
+                nodes.append(value)
+            elif isinstance(value, (list, tuple)):
+                for v in value:
+                    collect(v)
+
+        for attr in vars(self).values():
+            collect(attr)
+        return nodes
+
 
 class NumberNode(Node):
     def __init__(self, number: Token):
@@ -76,6 +92,7 @@ class VarAssignNode(Node):
         self.name = name
         self.type = type_token
         self.value = value
+        self.const: Token | None = None  # const keyword, the value is computed while compiling and never changes
 
     @property
     def pos(self) -> Position:
@@ -83,44 +100,93 @@ class VarAssignNode(Node):
 
     def json(self) -> dict:
         return {'type': 'var_assign', 'identifier': self.name.__str__(),
-                'type_annotation': self.type.__str__() if self.type else 'none', 'value': self.value.json()}
+                'type_annotation': self.type.__str__() if self.type else 'none', 'value': self.value.json(),
+                'const': self.const is not None}
 
 
 class IfNode(Node):
-    def __init__(self, bool_node: Node, expr: Node, else_expr: Node | None):
+    def __init__(self, bool_node: Node, expr: Node, else_expr: Node | None, is_expr: bool = False):
         self.bool = bool_node
         self.expr = expr
         self.else_expr = else_expr
+        self.is_expr = is_expr
 
     @property
     def pos(self) -> Position:
         return self.bool.pos
 
     def json(self) -> dict:
-        return {'type': 'if', 'if': self.bool.json(), 'then': self.expr.json(),
+        return {'type': 'if_expr' if self.is_expr else 'if', 'if': self.bool.json(), 'then': self.expr.json(),
                 'else': self.else_expr.json() if self.else_expr else 'none'}
 
 
+class CaseNode(Node):
+    def __init__(self, patterns: List[tuple[Token, Token | None]], body: Node):
+        self.patterns = patterns
+        self.body = body
+
+    @property
+    def pos(self) -> Position:
+        return self.patterns[0][0].pos
+
+    def json(self) -> dict:
+        patterns = [f'{start.value}..{end.value}' if end else f'{start.value}' for start, end in self.patterns]
+        return {'type': 'case', 'patterns': patterns, 'then': self.body.json()}
+
+
+class MatchNode(Node):
+    def __init__(self, value: Node, cases: List[CaseNode], default: Node | None):
+        self.value = value
+        self.cases = cases
+        self.default = default
+
+    @property
+    def pos(self) -> Position:
+        return self.value.pos
+
+    def json(self) -> dict:
+        cases = [c.json() for c in self.cases]
+        return {'type': 'match', 'match': self.value.json(), 'cases': cases,
+                'else': self.default.json() if self.default else 'none'}
+
+
+class ScopeNode(Node):
+    """A body with its own variable scope, what the Folder leaves of an if or match with a constant condition"""
+    def __init__(self, body: Node):
+        self.body = body
+
+    @property
+    def pos(self) -> Position:
+        return self.body.pos
+
+    def json(self) -> dict:
+        return {'type': 'scope', 'body': self.body.json()}
+
+
 class WhileNode(Node):
-    def __init__(self, bool_node: Node, expr: Node):
+    def __init__(self, bool_node: Node, expr: Node, hints: List[tuple[Token, Token | None]] | None = None):
         self.bool = bool_node
         self.expr = expr
+        self.hints = hints if hints else []
 
     @property
     def pos(self) -> Position:
         return self.bool.pos
 
     def json(self) -> dict:
-        return {'type': 'while', 'while': self.bool.json(), 'then': self.expr.json()}
+        return {'type': 'while', 'while': self.bool.json(), 'hints': loop_hints_json(self.hints),
+                'then': self.expr.json()}
 
 
 class ForNode(Node):
-    def __init__(self, identifier: Token, from_node: Node, to: Node, step: Node | None, expr: Node):
+    def __init__(self, identifier: Token, from_node: Node, to: Node, step: Node | None, expr: Node,
+                 hints: List[tuple[Token, Token | None]] | None = None):
         self.identifier = identifier
         self.from_node = from_node
         self.to = to
         self.step = step if step else NumberNode(Token(TT.INT, 1, identifier.pos))
         self.expr = expr
+        self.hints = hints if hints else []
 
     @property
     def pos(self) -> Position:
@@ -129,9 +195,31 @@ class ForNode(Node):
     def json(self) -> dict:
         return {'type': 'for', 'var_name': self.identifier.__str__(), 'from': self.from_node.json(),
                 'to': self.to.json(), 'step': self.step.json() if self.step.__str__() else 'none',
+                'hints': loop_hints_json(self.hints), 'then': self.expr.json()}
+
+
+class ForEachNode(Node):
+    """A for loop over the entries of a map, value is None if only the keys are used"""
+    def __init__(self, key: Token, value: Token | None, map_node: Node, expr: Node):
+        self.key = key
+        self.value = value
+        self.map = map_node
+        self.expr = expr
+
+    @property
+    def pos(self) -> Position:
+        return self.key.pos
+
+    def json(self) -> dict:
+        return {'type': 'for_each', 'key': self.key.__str__(),
+                'value': self.value.__str__() if self.value else 'none', 'map': self.map.json(),
                 'then': self.expr.json()}
 
 
+def loop_hints_json(hints: List[tuple[Token, Token | None]]) -> list[str]:
+    return [f'{hint.value.lower()} {value.value}' if value else hint.value.lower() for hint, value in hints]
+
+
 class FunCallNode(Node):
     def __init__(self, identifier: Token, args: List[Node]):
         self.identifier = identifier
@@ -147,12 +235,17 @@ class FunCallNode(Node):
 
 
 class FunDefNode(Node):
-    def __init__(self, identifier: Token, args: List[Token], arg_types: List[Token], body: Node, return_type: Token):
+    def __init__(self, identifier: Token, args: List[Token], arg_types: List[Token], body: Node, return_type: Token,
+                 memo: tuple[Token, Token | None] | None = None):
         self.identifier = identifier
         self.args = args
         self.arg_types = arg_types
         self.body = body
         self.return_type = return_type
+        self.memo = memo  # memo keyword and optional cache size
+        self.export: Token | None = None  # export keyword, the function keeps its name and the C calling convention
+        self.const: Token | None = None  # const keyword, calls with constant arguments run while compiling
+        self.type_params: List[Token] = []  # names of the types of a generic function, see Analyser.instantiate
 
     @property
     def pos(self) -> Position:
@@ -162,8 +255,11 @@ class FunDefNode(Node):
         args = [a.__str__() for a in self.args]
         arg_types = [at.__str__() for at in self.arg_types]
         params = dict(zip(args, arg_types))
+        memo = 'none' if not self.memo else self.memo[1].__str__() if self.memo[1] else 'default'
         return {'type': 'fun_def', 'identifier': self.identifier.__str__(), 'params': params,
-                'fun_body': self.body.json(), 'ret_type': self.return_type.__str__()}
+                'fun_body': self.body.json(), 'ret_type': self.return_type.__str__(), 'memo': memo,
+                'export': self.export is not None, 'const': self.const is not None,
+                'type_params': [param.value for param in self.type_params]}
 
 
 class StringNode(Node):
@@ -220,10 +316,14 @@ class ListAssignNode(Node):
 
 
 class StructDefNode(Node):
-    def __init__(self, identifier: Token, values: dict[Token, Token], functions: list[Node]):
+    def __init__(self, identifier: Token, values: dict[Token, Token], functions: list[Node], ordered: bool = False,
+                 soa: bool = False):
         self.values = values
         self.identifier = identifier
         self.functions = functions
+        self.ordered = ordered  # keep the declared field order instead of sorting the fields by alignment
+        self.soa = soa  # arrays of this class keep one array per field instead of one object after another
+        self.type_params: List[Token] = []  # names of the types of a generic class, see Analyser.instantiate
 
     @property
     def pos(self) -> Position:
@@ -231,7 +331,8 @@ class StructDefNode(Node):
 
     def json(self) -> dict:
         funcs = [f.json() for f in self.functions]
-        return {'type': 'class_def', 'fields': self.values.__str__(), 'functions': funcs}
+        return {'type': 'class_def', 'fields': self.values.__str__(), 'ordered': self.ordered, 'soa': self.soa,
+                'type_params': [param.value for param in self.type_params], 'functions': funcs}
 
 
 class StructAssignNode(Node):
@@ -265,6 +366,8 @@ class StructReadNode(Node):
 class ImportNode(Node):
     def __init__(self, file_path: Token):
         self.file_path = file_path
+        self.ast: Node | None = None  # the imported file, parsed and checked by the Analyser
+        self.context: Context | None = None
 
     @property
     def pos(self) -> Position:
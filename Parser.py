@@ -1,7 +1,9 @@
+import os.path
 from typing import Callable
 
 from Context import Context
 from Error import Error, InvalidSyntaxError
+from Lexer import Lexer
 from Node import *
 from Token import Token, TT
 
@@ -13,6 +15,7 @@ class Parser:
         self.tokens = tokens
         self.index = -1
         self.current_token: Token | None = None
+        self.type_names = declared_types(tokens, context, set())  # classes and generics, see type_arguments_ahead
         self.advance()
 
     def advance(self):
@@ -46,6 +49,19 @@ class Parser:
             case TT.IDENTIFIER:
                 token = self.current_token
                 self.advance()
+                if token.value in ['map', 'array'] and self.current_token.type == TT.LESS:
+                    token = self.type_arguments(token)  # a new map or array like map<str, int>(), called map:str:int
+                    if isinstance(token, Error):
+                        return token
+                    if self.current_token.type != TT.LPAREN or self.peek().type != TT.RPAREN:
+                        return self.err(f"Expected '()' to create a {token.value}, got {self.current_token}")
+                    self.advance()
+                    self.advance()
+                    return FunCallNode(token, [])
+                if self.current_token.type == TT.LESS and self.type_arguments_ahead():
+                    token = self.type_arguments(token)  # a call like first<int>(l) or Box<int>(1), called first<int>
+                    if isinstance(token, Error):
+                        return token
                 if self.current_token.type == TT.LPAREN:
                     self.advance()
                     arg_node_list: List[Node] = []
@@ -115,6 +131,29 @@ class Parser:
                 token = self.current_token
                 self.advance()
                 return StringNode(token)
+            case TT.KEYWORD if self.current_token.value == 'IF':
+                self.advance()
+                bool_expr = self.expression()
+                if isinstance(bool_expr, Error):
+                    return bool_expr
+                if self.current_token.type != TT.COLON:
+                    return self.err(f"Expected ':' in if expression, got {self.current_token}")
+                self.advance()
+                if_expr = self.expression()
+                if isinstance(if_expr, Error):
+                    return if_expr
+                if self.current_token.type == TT.NEWLINE and self.peek().value == 'ELSE':
+                    self.advance()
+                if self.current_token.value != 'ELSE':
+                    return self.err(f'Expected else in if expression, got {self.current_token}')
+                self.advance()
+                if self.current_token.type != TT.COLON:
+                    return self.err(f"Expected ':' in if expression, got {self.current_token}")
+                self.advance()
+                else_expr = self.expression()
+                if isinstance(else_expr, Error):
+                    return else_expr
+                return IfNode(bool_expr, if_expr, else_expr, is_expr=True)
             case TT.LSQUARE:
                 lst: List[Node] = []
                 self.advance()
@@ -152,6 +191,19 @@ class Parser:
                 return self.err(f"Expected '] after [ with list index, got {self.current_token}")
             self.advance()
             left = BinOpNode(left, operator, right)
+            if self.current_token.type == TT.DOT:  # a property of an array element, like a[i].x
+                self.advance()
+                if self.current_token.type != TT.IDENTIFIER:
+                    return self.err(f"Expected identifier after '.', got {self.current_token}")
+                key = self.current_token
+                self.advance()
+                if self.current_token.type != TT.ASSIGN:
+                    return StructReadNode(left, key)
+                self.advance()
+                value = self.expression()
+                if isinstance(value, Error):
+                    return value
+                return StructAssignNode(left, key, value)
             if self.current_token.type == TT.ASSIGN:
                 self.advance()
                 right = self.expression()
@@ -170,7 +222,7 @@ class Parser:
         return left
 
     def factor(self) -> Node | Error:
-        if self.current_token.type == TT.PLUS or self.current_token.type == TT.MINUS:
+        if self.current_token.type in [TT.PLUS, TT.MINUS, TT.XOR]:
             unary = self.current_token
             self.advance()
             right = self.factor()
@@ -187,6 +239,10 @@ class Parser:
         left = self.bin_op_node([TT.PLUS, TT.MINUS], self.term)
         return left
 
+    def shift_expr(self) -> Node | Error:
+        left = self.bin_op_node([TT.LSHIFT, TT.RSHIFT, TT.URSHIFT], self.arithm_expr)
+        return left
+
     def comp_expr(self) -> Node | Error:
         if self.current_token.type == TT.NOT:
             operator = self.current_token
@@ -197,7 +253,7 @@ class Parser:
             return UnaryOpNode(operator, val)
 
         left = self.bin_op_node([TT.EQUALS, TT.UNEQUALS, TT.LESS, TT.GREATER, TT.LESSEQUAL, TT.GREATEREQUAL],
-                                self.arithm_expr)
+                                self.shift_expr)
         return left
 
     def expression(self) -> Node | Error:
@@ -231,22 +287,75 @@ class Parser:
                     bool_expr = self.expression()
                     if isinstance(bool_expr, Error):
                         return bool_expr
+                    hints = self.loop_hints()
                     expr = self.body_expr()
                     if isinstance(expr, Error):
                         return expr
-                    return WhileNode(bool_expr, expr)
+                    return WhileNode(bool_expr, expr, hints)
+                case 'MATCH':
+                    self.advance()
+                    value = self.expression()
+                    if isinstance(value, Error):
+                        return value
+                    if self.current_token.type != TT.LCURLY:
+                        return self.err("Expected '{', got " + str(self.current_token))
+                    self.advance()
+                    cases: List[CaseNode] = []
+                    default: Node | Error | None = None
+                    self.ignore_newlines()
+                    while self.current_token.type != TT.RCURLY:
+                        if self.current_token.type == TT.EOF:
+                            return self.err("Expected '}', got EOF")
+                        if self.current_token.value == 'ELSE':
+                            if default:
+                                return self.err('Match can only have one else case')
+                            self.advance()
+                            default = self.body_expr()
+                            if isinstance(default, Error):
+                                return default
+                        else:
+                            patterns: List[tuple[Token, Token | None]] = []
+                            pattern = self.case_pattern()
+                            if isinstance(pattern, Error):
+                                return pattern
+                            patterns.append(pattern)
+                            while self.current_token.type == TT.COMMA:
+                                self.advance()
+                                pattern = self.case_pattern()
+                                if isinstance(pattern, Error):
+                                    return pattern
+                                patterns.append(pattern)
+                            body = self.body_expr()
+                            if isinstance(body, Error):
+                                return body
+                            cases.append(CaseNode(patterns, body))
+                        self.ignore_newlines()
+                    self.advance()
+                    return MatchNode(value, cases, default)
                 case 'FOR':
                     self.advance()
                     if self.current_token.type != TT.IDENTIFIER:
                         return self.err(f'Expected identifier in for, got {self.current_token}')
                     identifier = self.current_token
                     self.advance()
+                    value_identifier: Token | None = None
+                    if self.current_token.type == TT.COMMA:
+                        self.advance()
+                        if self.current_token.type != TT.IDENTIFIER:
+                            return self.err(f'Expected identifier for the map value, got {self.current_token}')
+                        value_identifier = self.current_token
+                        self.advance()
                     if self.current_token.type != TT.ASSIGN:
                         return self.err(f'Expected <-, got {self.current_token}')
                     self.advance()
                     from_expr = self.factor()
                     if isinstance(from_expr, Error):
                         return from_expr
+                    if value_identifier or self.current_token.type in [TT.LCURLY, TT.COLON]:
+                        expr = self.body_expr()
+                        if isinstance(expr, Error):
+                            return expr
+                        return ForEachNode(identifier, value_identifier, from_expr, expr)
                     if self.current_token.type != TT.TO:
                         return self.err(f'Expected .. in for, got {self.current_token}')
                     self.advance()
@@ -259,10 +368,51 @@ class Parser:
                         step = self.factor()
                         if isinstance(step, Error):
                             return step
+                    hints = self.loop_hints()
                     expr = self.body_expr()
                     if isinstance(expr, Error):
                         return expr
-                    return ForNode(identifier, from_expr, to, step, expr)
+                    return ForNode(identifier, from_expr, to, step, expr, hints)
+                case 'MEMO':
+                    memo = self.current_token
+                    self.advance()
+                    size: Token | None = None
+                    if self.current_token.type == TT.INT:
+                        size = self.current_token
+                        self.advance()
+                    if self.current_token.type != TT.KEYWORD or self.current_token.value != 'FUN':
+                        return self.err(f'Expected fun after memo, got {self.current_token}')
+                    fun = self.statement()
+                    if isinstance(fun, Error):
+                        return fun
+                    fun.memo = (memo, size)
+                    return fun
+                case 'EXPORT':
+                    export = self.current_token
+                    self.advance()
+                    if self.current_token.type != TT.KEYWORD or self.current_token.value not in ['FUN', 'MEMO']:
+                        return self.err(f'Expected fun after export, got {self.current_token}')
+                    fun = self.statement()
+                    if isinstance(fun, Error):
+                        return fun
+                    fun.export = export
+                    return fun
+                case 'CONST':
+                    const = self.current_token
+                    self.advance()
+                    if self.current_token.type == TT.KEYWORD and self.current_token.value in ['FUN', 'MEMO', 'EXPORT']:
+                        fun = self.statement()
+                        if isinstance(fun, Error):
+                            return fun
+                        fun.const = const
+                        return fun
+                    if self.current_token.type != TT.IDENTIFIER or self.peek().type not in [TT.COLON, TT.ASSIGN]:
+                        return self.err(f'Expected fun or variable assignment after const, got {self.current_token}')
+                    assign = self.statement()
+                    if isinstance(assign, Error):
+                        return assign
+                    assign.const = const
+                    return assign
                 case 'FUN':
                     self.advance()
                     if self.current_token.type != TT.IDENTIFIER:
@@ -271,6 +421,11 @@ class Parser:
                     self.context = Context(self.context, identifier.value, self.context.file,
                                            self.context.file_text)
                     self.advance()
+                    type_params: List[Token] = []
+                    if self.current_token.type == TT.LESS:
+                        type_params = self.type_parameters()
+                        if isinstance(type_params, Error):
+                            return type_params
                     if self.current_token.type != TT.LPAREN:
                         return self.err(f"Expected '(', got {self.current_token}")
                     self.context.name += '('
@@ -287,18 +442,9 @@ class Parser:
                             return self.err(f'Expected type, got {self.current_token}')
                         typ = self.current_token
                         self.advance()
-                        if typ.value == 'list':
-                            if self.current_token.type != TT.LESS:
-                                return self.err(f"Expected '<type>', got {self.current_token}")
-                            self.advance()
-                            if self.current_token.type != TT.TYPE and self.current_token.type != TT.IDENTIFIER:
-                                return self.err(f"Expected '<type>', got {self.current_token}")
-                            type_name = self.current_token.value
-                            self.advance()
-                            if self.current_token.type != TT.GREATER:
-                                return self.err(f"Expected '<type>', got {self.current_token}")
-                            self.advance()
-                            typ.value += f':{type_name}'
+                        typ = self.type_arguments(typ)
+                        if isinstance(typ, Error):
+                            return typ
                         arg_types.append(typ)
                         self.context.name += typ.value.lower()
                         while self.current_token.type == TT.COMMA:
@@ -314,18 +460,9 @@ class Parser:
                             if self.current_token.type != TT.TYPE and self.current_token.type != TT.IDENTIFIER:
                                 return self.err(f'Expected type, got {self.current_token}')
                             self.advance()
-                            if typ.value == 'list':
-                                if self.current_token.type != TT.LESS:
-                                    return self.err(f"Expected '<type>', got {self.current_token}")
-                                self.advance()
-                                if self.current_token.type != TT.TYPE and self.current_token.type != TT.IDENTIFIER:
-                                    return self.err(f"Expected '<type>', got {self.current_token}")
-                                type_name = self.current_token.value
-                                self.advance()
-                                if self.current_token.type != TT.GREATER:
-                                    return self.err(f"Expected '<type>', got {self.current_token}")
-                                self.advance()
-                                typ.value += f':{type_name}'
+                            typ = self.type_arguments(typ)
+                            if isinstance(typ, Error):
+                                return typ
                             arg_types.append(typ)
                             self.context.name += f',{typ.value.lower()}'
                     if self.current_token.type != TT.RPAREN:
@@ -339,29 +476,45 @@ class Parser:
                             return self.err(f'Expected type, got {self.current_token}')
                         return_type = self.current_token
                         self.advance()
-                        if return_type.value == 'list':
-                            if self.current_token.type != TT.LESS:
-                                return self.err(f"Expected '<type>', got {self.current_token}")
-                            self.advance()
-                            if self.current_token.type != TT.TYPE and self.current_token.type != TT.IDENTIFIER:
-                                return self.err(f"Expected '<type>', got {self.current_token}")
-                            type_name = self.current_token.value
-                            self.advance()
-                            if self.current_token.type != TT.GREATER:
-                                return self.err(f"Expected '<type>', got {self.current_token}")
-                            self.advance()
-                            return_type.value += f':{type_name}'
+                        return_type = self.type_arguments(return_type)
+                        if isinstance(return_type, Error):
+                            return return_type
                     body_node = self.body_expr()
                     if isinstance(body_node, Error):
                         return body_node
                     self.context = self.context.parent
-                    return FunDefNode(identifier, arg_list, arg_types, body_node, return_type)
+                    fun = FunDefNode(identifier, arg_list, arg_types, body_node, return_type)
+                    fun.type_params = type_params
+                    return fun
+                case 'ORDERED':
+                    self.advance()
+                    if self.current_token.type != TT.KEYWORD or self.current_token.value != 'CLASS':
+                        return self.err(f'Expected class after ordered, got {self.current_token}')
+                    struct = self.statement()
+                    if isinstance(struct, Error):
+                        return struct
+                    struct.ordered = True
+                    return struct
+                case 'SOA':
+                    self.advance()
+                    if self.current_token.type != TT.KEYWORD or self.current_token.value != 'CLASS':
+                        return self.err(f'Expected class after soa, got {self.current_token}')
+                    struct = self.statement()
+                    if isinstance(struct, Error):
+                        return struct
+                    struct.soa = True
+                    return struct
                 case 'CLASS':
                     self.advance()
                     if self.current_token.type != TT.IDENTIFIER:
                         return self.err(f'Expected identifier, got {self.current_token}')
                     name = self.current_token
                     self.advance()
+                    type_params: List[Token] = []
+                    if self.current_token.type == TT.LESS:
+                        type_params = self.type_parameters()
+                        if isinstance(type_params, Error):
+                            return type_params
                     if self.current_token.type != TT.LCURLY:
                         return self.err("Expected '{', got " + str(self.current_token))
                     self.advance()
@@ -386,6 +539,9 @@ class Parser:
                                 return self.err(f'Expected type, got {self.current_token}')
                             typ = self.current_token
                             self.advance()
+                            typ = self.type_arguments(typ)
+                            if isinstance(typ, Error):
+                                return typ
                             values[ident] = typ
                             if self.current_token.type != TT.NEWLINE:
                                 return self.err(f"Expected ';' or newline, got {self.current_token}")
@@ -409,7 +565,9 @@ class Parser:
                         body = PassNode(name.pos)
                         return_type = Token(TT.TYPE, 'null', name.pos)
                         funcs.append(FunDefNode(identifier, args, arg_types, body, return_type))
-                    return StructDefNode(name, values, funcs)
+                    struct = StructDefNode(name, values, funcs)
+                    struct.type_params = type_params
+                    return struct
                 case 'PASS':
                     pos = self.current_token.pos
                     self.advance()
@@ -447,18 +605,9 @@ class Parser:
                     self.advance()  # past the :
                     type_token = self.current_token
                     self.advance()
-                    if type_token.value == 'list':
-                        if self.current_token.type != TT.LESS:
-                            return self.err(f"Expected 'list<type>', got {self.current_token}")
-                        self.advance()
-                        if self.current_token.type != TT.TYPE and self.current_token.type != TT.IDENTIFIER:
-                            return self.err(f"Expected 'list<type>', got {self.current_token}")
-                        type_name = self.current_token.value
-                        self.advance()
-                        if self.current_token.type != TT.GREATER:
-                            return self.err(f"Expected 'list<type>', got {self.current_token}")
-                        self.advance()
-                        type_token.value += f':{type_name}'
+                    type_token = self.type_arguments(type_token)
+                    if isinstance(type_token, Error):
+                        return type_token
                     if self.current_token.type != TT.ASSIGN:
                         return self.err(f"Expected '<-', got {self.current_token}")
                 self.advance()  # past the <-
@@ -469,6 +618,169 @@ class Parser:
                 return VarAssignNode(var_name, type_token, expr)
         return self.expression()
 
+    def loop_hints(self) -> List[tuple[Token, Token | None]]:
+        """Optimisation hints in front of a loop body like 'vectorize 4' or 'unroll', each with an optional int"""
+        hints: List[tuple[Token, Token | None]] = []
+        while self.current_token.type == TT.KEYWORD and self.current_token.value in ['VECTORIZE', 'UNROLL',
+                                                                                      'INTERLEAVE']:
+            hint = self.current_token
+            value: Token | None = None
+            self.advance()
+            if self.current_token.type == TT.INT:
+                value = self.current_token
+                self.advance()
+            hints.append((hint, value))
+        return hints
+
+    def type_arguments(self, typ: Token) -> Token | Error:
+        """
+        Parse the '<type>' after list, the '<type, size>' after vec and array and the '<key type, value type>' after map
+        into the type, like list:int, vec:float:4, array:int:16 or map:str:int.
+        The '<type, ...>' after a generic class or function becomes part of its name, like Pair<int, list<int>>
+        """
+        if typ.value not in ['list', 'vec', 'array', 'map']:
+            return self.generic_arguments(typ) if self.current_token.type == TT.LESS else typ
+        generic = typ.value
+        if self.current_token.type != TT.LESS:
+            return self.err(f"Expected '{generic}<type>', got {self.current_token}")
+        self.advance()
+        if self.current_token.type != TT.TYPE and self.current_token.type != TT.IDENTIFIER:
+            return self.err(f"Expected '{generic}<type>', got {self.current_token}")
+        element_type = self.current_token
+        self.advance()
+        if generic != 'map':  # map keys are plain types
+            element_type = self.type_arguments(element_type)
+            if isinstance(element_type, Error):
+                return element_type
+        typ.value += f':{element_type.value}'
+        if generic in ['vec', 'array']:
+            kind = 'vector' if generic == 'vec' else 'array'
+            if self.current_token.type != TT.COMMA:
+                return self.err(f"Expected ',' and the {kind} size, got {self.current_token}")
+            self.advance()
+            if self.current_token.type != TT.INT:
+                return self.err(f'Expected the {kind} size, got {self.current_token}')
+            typ.value += f':{self.current_token.value}'
+            self.advance()
+        if generic == 'map':
+            if self.current_token.type != TT.COMMA:
+                return self.err(f"Expected ',' and the value type, got {self.current_token}")
+            self.advance()
+            if self.current_token.type != TT.TYPE and self.current_token.type != TT.IDENTIFIER:
+                return self.err(f'Expected the value type, got {self.current_token}')
+            value_type = self.current_token
+            self.advance()
+            value_type = self.type_arguments(value_type)
+            if isinstance(value_type, Error):
+                return value_type
+            typ.value += f':{value_type.value}'
+        closed = self.close_type_arguments(f"'{generic}<type>'")
+        return closed if isinstance(closed, Error) else typ
+
+    def generic_arguments(self, typ: Token) -> Token | Error:
+        """Parse the '<type, ...>' after a generic class or function into the name of its instance"""
+        arguments: List[str] = []
+        self.advance()
+        while True:
+            if self.current_token.type != TT.TYPE and self.current_token.type != TT.IDENTIFIER:
+                return self.err(f'Expected type argument, got {self.current_token}')
+            argument = self.current_token
+            self.advance()
+            argument = self.type_arguments(argument)
+            if isinstance(argument, Error):
+                return argument
+            arguments.append(display_type(argument.value))
+            if self.current_token.type != TT.COMMA:
+                break
+            self.advance()
+        closed = self.close_type_arguments(f"'>' after the type arguments of {typ.value}")
+        if isinstance(closed, Error):
+            return closed
+        typ.value = f'{typ.value}<{", ".join(arguments)}>'
+        return typ
+
+    def close_type_arguments(self, expected: str) -> Error | None:
+        """Step past the '>' closing type arguments, only half of a '>>' closing nested types like map<int, list<int>>"""
+        if self.current_token.type in [TT.RSHIFT, TT.URSHIFT]:
+            self.current_token.type = TT.GREATER if self.current_token.type == TT.RSHIFT else TT.RSHIFT
+            return None
+        if self.current_token.type != TT.GREATER:
+            return self.err(f'Expected {expected}, got {self.current_token}')
+        self.advance()
+        return None
+
+    def type_arguments_ahead(self) -> bool:
+        """
+        If the '<' here opens type arguments followed by a call, like in first<int>(l), and is not a comparison like in
+        f(a < b, c > (d)). The name before it has to be a class or generic function, and every argument a type, a class
+        or generic or one of those with type arguments of its own
+        """
+        opened: List[str] = []  # the name in front of every '<' not closed yet
+        for index in range(self.index, len(self.tokens) - 1):
+            token, previous = self.tokens[index], self.tokens[index - 1]
+            match token.type:
+                case TT.LESS if previous.type in [TT.TYPE, TT.IDENTIFIER] and previous.value in [
+                        *self.type_names, 'list', 'vec', 'array', 'map']:
+                    opened.append(previous.value)
+                case TT.GREATER | TT.RSHIFT | TT.URSHIFT:
+                    closed = {TT.GREATER: 1, TT.RSHIFT: 2, TT.URSHIFT: 3}[token.type]
+                    if closed > len(opened):
+                        return False
+                    del opened[len(opened) - closed:]
+                    if not opened:
+                        return self.tokens[index + 1].type == TT.LPAREN
+                case TT.TYPE | TT.COMMA:
+                    pass
+                case TT.IDENTIFIER if token.value in [*self.type_names, 'vec', 'array', 'map']:
+                    pass
+                case TT.INT if opened and opened[-1] in ['vec', 'array'] and previous.type == TT.COMMA:
+                    pass  # the size of a vector or array
+                case _:
+                    return False
+        return False
+
+    def type_parameters(self) -> List[Token] | Error:
+        """The '<T, U>' after the name of a generic function or class"""
+        params: List[Token] = []
+        self.advance()
+        while True:
+            if self.current_token.type != TT.IDENTIFIER:
+                return self.err(f'Expected type parameter, got {self.current_token}')
+            params.append(self.current_token)
+            self.advance()
+            if self.current_token.type != TT.COMMA:
+                break
+            self.advance()
+        if self.current_token.type != TT.GREATER:
+            return self.err(f"Expected '>' after the type parameters, got {self.current_token}")
+        self.advance()
+        return params
+
+    def case_pattern(self) -> tuple[Token, Token | None] | Error:
+        """A single int constant or a range of them like in for loops, the end is excluded"""
+        start = self.int_constant()
+        if isinstance(start, Error):
+            return start
+        if self.current_token.type != TT.TO:
+            return start, None
+        self.advance()
+        end = self.int_constant()
+        if isinstance(end, Error):
+            return end
+        return start, end
+
+    def int_constant(self) -> Token | Error:
+        negative = self.current_token.type == TT.MINUS
+        if negative:
+            self.advance()
+        if self.current_token.type != TT.INT:
+            return self.err(f'Expected int constant, got {self.current_token}')
+        token = self.current_token
+        self.advance()
+        if negative:
+            token = Token(TT.INT, -token.value, token.pos)
+        return token
+
     def statements(self) -> Node | Error:
         self.ignore_newlines()
         statements: List[Node] = []
@@ -519,3 +831,77 @@ class Parser:
 
     def err(self, details: str) -> Error:
         return InvalidSyntaxError(details, self.current_token.pos, self.context, 'parsing')
+
+
+def declared_types(tokens: List[Token], context: Context, imported: set[str]) -> set[str]:
+    """
+    The names of the classes, generic functions and type parameters the tokens declare, and those of the files they
+    import. Imports are found like the Analyser does, a file that can't be read is left for it to report
+    """
+    names: set[str] = set()
+    for index, (token, following, after) in enumerate(zip(tokens, tokens[1:], tokens[2:])):
+        if token.type != TT.KEYWORD or following.type != TT.IDENTIFIER:
+            continue
+        if token.value == 'CLASS' or token.value == 'FUN' and after.type == TT.LESS:
+            names.add(following.value)
+            if after.type == TT.LESS:
+                for param in tokens[index + 3:]:  # the type parameters like T in fun first<T>
+                    if param.type == TT.IDENTIFIER:
+                        names.add(param.value)
+                    elif param.type != TT.COMMA:
+                        break
+        elif token.value == 'IMPORT' and following.value not in imported:
+            imported.add(following.value)
+            try:
+                with open(os.path.abspath(f'{following.value}.hb'), 'r') as f:
+                    text = f.read()
+            except OSError:
+                continue
+            imported_tokens = Lexer(Context(context, f'load_{following.value}()', following.value, text)).make_tokens()
+            if not isinstance(imported_tokens, Error):
+                names |= declared_types(imported_tokens, context, imported)
+    return names
+
+
+def display_type(typ: str) -> str:
+    """A type the way it is written, like map<str, list<int>> for map:str:list:int"""
+    if typ.startswith('list:'):
+        return f'list<{display_type(typ.removeprefix("list:"))}>'
+    if typ.startswith(('vec:', 'array:')):
+        generic, rest = typ.split(':', 1)
+        element_type, size = rest.rsplit(':', 1)
+        return f'{generic}<{display_type(element_type)}, {size}>'
+    if typ.startswith('map:'):
+        _, key_type, value_type = typ.split(':', 2)
+        return f'map<{key_type}, {display_type(value_type)}>'
+    return typ
+
+
+def generic_parts(typ: str) -> tuple[str, List[str]]:
+    """The generic and the type arguments of an instance name like Pair<int, list<int>>, as types like list:int"""
+    name, _, rest = typ.partition('<')
+    arguments: List[str] = []
+    depth, start = 0, 0
+    rest = rest[:-1]
+    for i, char in enumerate(rest + ','):
+        if char == '<':
+            depth += 1
+        elif char == '>':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            arguments.append(written_type(rest[start:i].strip()))
+            start = i + 1
+    return name, arguments
+
+
+def written_type(text: str) -> str:
+    """The type for the way it is written, the opposite of display_type"""
+    if '<' not in text:
+        return text
+    name, arguments = generic_parts(text)
+    match name:
+        case 'list':
+            return f'list:{arguments[0]}'
+        case 'vec' | 'array' | 'map':
+            return f'{name}:{arguments[0]}:{arguments[1]}'
+    return f'{name}<{", ".join(display_type(argument) for argument in arguments)}>'
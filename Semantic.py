@@ -1,24 +1,57 @@
 from __future__ import annotations
 
+import os.path
+from copy import deepcopy
 from typing import NoReturn
 
 from Error import *
+from Lexer import Lexer
 from Node import *
+from Parser import Parser, display_type, generic_parts, written_type
 
 
 class Analyser:
     """Class for Sematic Analysis, only checks for types"""
-    def __init__(self, ctx: Context):
+    def __init__(self, ctx: Context, auto_memo: bool = False):
         self.context = ctx
         self.env = Env()
         self.funcs: dict[str, Fun] = {}
         self.structs: dict[str, Struct] = {}
         self.current_fun: Fun = Fun(f'load_{ctx.file}', 0, [], 'int')
+        self.funcs[self.current_fun.name] = self.current_fun
+        self.load_fun = self.current_fun
+        self.imported: set[str] = set()
+        self.fun_env: Env | None = None  # scope holding the parameters of the current function
+        self.fun_helpers: dict[FunDefNode, Fun] = {}  # the IrBuilder reads the effects of every function from here
+        self.allocations: set[Node] = set()  # lists, strs and objects put into memory, see IrBuilder.allocate
+        self.const_reads: dict[VarAccessNode, VarAssignNode] = {}  # uses of const variables and their definition
+        self.const_calls: dict[FunCallNode, Fun] = {}  # calls of const functions, see Evaluator
+        self.auto_memo = auto_memo  # memo every recursive function that could be declared memo
+        self.default_memo_size = 4096
+        self.generics: dict[str, Generic] = {}  # generic functions and classes with their instances, see instantiate
+        self.instances: list[Node] | None = None  # instances the current top level statement made, built before it
+        self.instantiating: list[str] = []  # instances being checked, each one made by the one before
+        self.max_instances = 64  # per generic, bounds the compile time and code size of heavy instantiation
+        self.max_instance_depth = 32  # stops instances making new instances forever, like f<T> calling f<list<T>>
         self.builtins = {
             'print': 'int',
             'len': 'int',
             'getchar': 'str'
         }
+        self.vec_builtins = ['vec', 'shuffle', 'vec_load', 'vec_store', 'reduce_add', 'reduce_mul', 'reduce_min',
+                             'reduce_max']
+        self.map_builtins = ['has', 'remove', 'reserve']
+        self.math_builtins = {  # argument count and the types they work on, see check_math_builtin
+            **{name: (1, ['float']) for name in ['sqrt', 'exp', 'exp2', 'log', 'log2', 'log10', 'sin', 'cos', 'fabs',
+                                                 'floor', 'ceil', 'round', 'trunc']},
+            'fma': (3, ['float']),
+            'min': (2, ['int', 'float', 'byte']),
+            'max': (2, ['int', 'float', 'byte']),
+            **{name: (1, ['int', 'byte']) for name in ['popcount', 'ctlz', 'cttz']},
+            'prefetch': (2, ['list']),
+        }
+        self.map_key_types = ['int', 'str', 'byte']
+        self.array_element_types = ['int', 'float', 'bool', 'byte', 'str']
 
     def check(self, node: Node) -> str | None:
         """Dynamic visit method, returns the type of value for expressions and None for statements"""
@@ -30,11 +63,15 @@ class Analyser:
             UnknownNodeError, f'Number node has to have either int or float Token, got {node.token.type}', node.pos)
 
     def checkBinOpNode(self, node: BinOpNode) -> str:
-        left_type = self.check(node.left)
+        left_type = self.check_indexed(node.left) if node.operator.type == TT.GET else self.check(node.left)
         right_type = self.check(node.right)
         if left_type is None or right_type is None:
             self.err(TypeError, 'Expected expression, got statement',
                      node.left.pos if left_type is None else node.right.pos)
+        if left_type == 'str' and node.operator.type in [TT.PLUS, TT.EQUALS, TT.UNEQUALS]:
+            self.current_fun.effects.add('alloc' if node.operator.type == TT.PLUS else 'read')
+        if left_type.startswith('vec:') or right_type.startswith('vec:'):
+            return self.check_vec_bin_op(node, left_type, right_type)
         match node.operator.type:
             case TT.PLUS:
                 if (left_type, right_type) in [('int', 'int'), ('float', 'float'), ('str', 'str')]:
@@ -104,52 +141,249 @@ class Analyser:
                 if left_type != right_type:
                     self.err(TypeError, f'Cannot operate two different types with ~', node.operator.pos)
                 return left_type
+            case TT.LSHIFT | TT.RSHIFT | TT.URSHIFT:
+                if (left_type, right_type) == ('int', 'int'):
+                    return left_type
+            case TT.GET if left_type.startswith('array:'):
+                _, element_type, size = left_type.split(':')
+                if element_type in self.structs:
+                    self.err(TypeError, f'The objects in an array are only used through their properties, like a[i].x',
+                             node.pos)
+                if right_type != 'int':
+                    self.err(TypeError, 'Cannot index with non int value', node.right.pos)
+                self.check_array_index(node.right, int(size))
+                return element_type
+            case TT.GET if left_type.startswith('map:'):
+                _, key_type, value_type = left_type.split(':', 2)
+                if right_type != key_type:
+                    self.err(TypeError, f'Expected {key_type} as key, got {right_type}', node.right.pos)
+                self.current_fun.effects.add('read')
+                return value_type
             case TT.GET:
                 if not left_type.startswith('list:') and not left_type == 'str':
                     self.err(TypeError, 'Cannot index non list or str', node.left.pos)
                 if not right_type == 'int':
                     self.err(TypeError, 'Cannot index with non int value', node.right.pos)
+                self.current_fun.effects.add('read')
+                if left_type == 'str':
+                    self.allocations.add(node)  # the char becomes a str of its own
+                return left_type.removeprefix('list:')
 
         self.err(TypeError, f'cannot find operator {node.operator} on {left_type} and {right_type}', node.operator.pos)
 
+    def check_vec_bin_op(self, node: BinOpNode, left_type: str, right_type: str) -> str:
+        """Vectors work element wise, a scalar of the element type on one side is used for every lane"""
+        vec_type = left_type if left_type.startswith('vec:') else right_type
+        element_type = vec_type.split(':')[1]
+        if node.operator.type == TT.GET:
+            if right_type != 'int':
+                self.err(TypeError, 'Cannot index with non int value', node.right.pos)
+            return element_type
+        operators = [TT.PLUS, TT.MINUS, TT.MUL, TT.DIV, TT.MOD]
+        if element_type != 'float':
+            operators += [TT.AND, TT.OR, TT.XOR, TT.LSHIFT, TT.RSHIFT, TT.URSHIFT]
+        if node.operator.type not in operators or left_type not in [vec_type, element_type] or right_type not in [
+                vec_type, element_type]:
+            self.err(TypeError, f'cannot find operator {node.operator} on {left_type} and {right_type}',
+                     node.operator.pos)
+        return vec_type
+
     def checkUnaryOpNode(self, node: UnaryOpNode) -> str:
         typ = self.check(node.value)
-        if typ == 'int':
+        if typ in ['int', 'byte']:
             return typ
+        elif typ.startswith('vec:'):
+            if typ.startswith('vec:float') and node.operator.type in [TT.NOT, TT.XOR]:
+                self.err(TypeError, f'Can only use {node.operator} on int or bool value', node.operator.pos)
         elif typ == 'float':
-            if node.operator.type == TT.NOT:
-                self.err(TypeError, 'Can only use not on int or bool value', node.operator.pos)
+            if node.operator.type in [TT.NOT, TT.XOR]:
+                self.err(TypeError, f'Can only use {node.operator} on int or bool value', node.operator.pos)
         elif typ == 'bool':
-            if node.operator.type != TT.NOT:
+            if node.operator.type not in [TT.NOT, TT.XOR]:
                 self.err(TypeError, f'Cannot operate with {node.operator} on bool', node.operator.pos)
+        else:
+            self.err(TypeError, f'Cannot operate with {node.operator} on {display_type(typ)}', node.operator.pos)
+        return typ
 
     def checkVarAccessNode(self, node: VarAccessNode) -> str:
         res = self.env.get(node.name.value)
         if res:
+            self.track_access(node.name.value, escapes=True)
+            if self.env.const(node.name.value):
+                self.const_reads[node] = self.env.const(node.name.value)
             return res
         self.err(NoSuchVarError, f'Variable {node.name.value} is not defined in the current scope', node.pos)
 
+    def check_indexed(self, node: Node) -> str | None:
+        """
+        Check a list, str or object that is only indexed, read by a builtin or has a field accessed,
+        none of that lets a parameter escape
+        """
+        if isinstance(node, VarAccessNode) and self.env.get(node.name.value):
+            self.track_access(node.name.value, escapes=False)
+            if self.env.const(node.name.value):
+                self.const_reads[node] = self.env.const(node.name.value)
+            return self.env.get(node.name.value)
+        return self.check(node)
+
+    def track_access(self, name: str, escapes: bool):
+        """Record a variable use for the effects of the current function, see Fun"""
+        owner = self.env.owner(name)
+        if not self.is_local(owner) and name not in ['true', 'false']:
+            self.current_fun.effects.add('global')
+        elif escapes and owner is self.fun_env:
+            self.current_fun.escaping.add(name)
+
+    def is_local(self, env: Env) -> bool:
+        """Return if env is a scope of the current function, the top level code counts as one function too"""
+        if self.fun_env is None:
+            return True
+        scope = self.env
+        while scope is not self.fun_env.parent:
+            if scope is env:
+                return True
+            scope = scope.parent
+        return False
+
+    def check_array_index(self, index: Node, size: int):
+        """An array knows its size, so a constant index is checked right away"""
+        value = None
+        if isinstance(index, NumberNode) and index.token.type == TT.INT:
+            value = index.token.value
+        elif isinstance(index, UnaryOpNode) and index.operator.type == TT.MINUS and isinstance(
+                index.value, NumberNode) and index.value.token.type == TT.INT:
+            value = -index.value.token.value
+        if value is not None and not 0 <= value < size:
+            self.err(IndexError, f'Index {value} is out of bounds for an array of size {size}', index.pos)
+
+    def check_array_type(self, typ: str, pos: Position):
+        _, element_type, size = typ.split(':')
+        if element_type not in self.array_element_types and element_type not in self.structs:
+            self.err(TypeError, f'Arrays can only hold int, float, bool, byte, str or objects, got {element_type}', pos)
+        if int(size) < 1:
+            self.err(TypeError, f'Array size has to be positive, got {size}', pos)
+
     def checkVarAssignNode(self, node: VarAssignNode) -> None:
+        if self.env.const(node.name.value):
+            self.err(TypeError, f'{node.name.value} is const, it can not be assigned again', node.name.pos)
+        if node.const and self.env.get(node.name.value):
+            self.err(TypeError, f'{node.name.value} is already defined, a const needs a name of its own', node.name.pos)
+        if node.type is not None:
+            self.check_type(node.type.value, node.type.pos)
+        if node.type is not None and node.type.value.startswith('array:') and isinstance(node.value, ListNode):
+            self.check_array_literal(node)
+            return
         value_type = self.check(node.value)
         if node.type is not None and node.type.value != value_type:
             self.err(TypeError, f'Expected {node.type}, got {value_type}', node.value.pos)
+        if self.env.get(node.name.value) and not self.is_local(self.env.owner(node.name.value)):
+            self.current_fun.effects.add('global')
         self.env.define(node.name.value, value_type)
+        if node.const:
+            self.check_const(node, value_type)
+
+    def check_const(self, node: VarAssignNode, value_type: str):
+        """
+        The value of a const is computed while compiling, see Evaluator, so it may only use literals, operators, other
+        consts and calls of const functions
+        """
+        numbers = ['int', 'float', 'bool']
+        if value_type not in numbers and value_type.removeprefix('list:') not in numbers:
+            self.err(TypeError, f'A const has to be an int, float, bool or a list of them, got {value_type}',
+                     node.value.pos)
 
-    def checkIfNode(self, node: IfNode) -> None:
+        def runtime_part(value: Node) -> Node | None:
+            """The first part of value that is only known at runtime"""
+            if isinstance(value, VarAccessNode):
+                known = value.name.value in ['true', 'false'] or self.env.const(value.name.value)
+                return None if known else value
+            if isinstance(value, FunCallNode) and value not in self.const_calls:
+                return value
+            if not isinstance(value, (NumberNode, BinOpNode, UnaryOpNode, IfNode, ListNode, FunCallNode)):
+                return value
+            return next((part for part in map(runtime_part, value.children()) if part), None)
+
+        part = runtime_part(node.value)
+        if part:
+            self.err(TypeError, f'The value of const {node.name.value} has to be known while compiling, only '
+                                f'literals, consts and calls of const functions can be used', part.pos)
+        self.env.consts[node.name.value] = node
+
+    def check_array_literal(self, node: VarAssignNode):
+        """An array is filled from a list literal with exactly one element per slot, like a: array<int, 2> <- [1, 2]"""
+        self.check_array_type(node.type.value, node.type.pos)
+        _, element_type, size = node.type.value.split(':')
+        if len(node.value.content) != int(size):
+            self.err(TypeError, f'Expected {size} elements for {node.type.value}, got {len(node.value.content)}',
+                     node.type.pos)
+        for element in node.value.content:
+            value_type = self.check(element)
+            if value_type != element_type:
+                self.err(TypeError, f'Expected {element_type}, got {value_type}', element.pos)
+        if self.env.get(node.name.value) and not self.is_local(self.env.owner(node.name.value)):
+            self.current_fun.effects.add('global')
+        self.env.define(node.name.value, node.type.value)
+
+    def checkIfNode(self, node: IfNode) -> str | None:
         bool_value = self.check(node.bool)
         if bool_value != 'bool':
             self.err(TypeError, f'Expected bool, got {bool_value}', node.bool.pos)
 
+        if node.is_expr:
+            then_type = self.check(node.expr)
+            else_type = self.check(node.else_expr)
+            if then_type is None or else_type is None:
+                self.err(TypeError, 'Expected expression, got statement',
+                         node.expr.pos if then_type is None else node.else_expr.pos)
+            if then_type != else_type:
+                self.err(TypeError, f'Both sides of an if expression need the same type, got {then_type} and {else_type}',
+                         node.else_expr.pos)
+            return then_type
+
         self.env = Env(self.env)
         self.check(node.expr)
-        self.check(node.else_expr)
+        if node.else_expr:
+            self.check(node.else_expr)
         self.env = self.env.parent
 
+    def checkMatchNode(self, node: MatchNode) -> None:
+        value_type = self.check(node.value)
+        if value_type not in ['int', 'byte']:
+            self.err(TypeError, f'Can only match int or byte, got {value_type}', node.value.pos)
+        # bytes go from 0 to 255, allowing -128 .. -1 too would match the same i8 as 128 .. 255
+        lowest, highest = (0, 256) if value_type == 'byte' else (-2 ** 31, 2 ** 31)
+
+        covered: list[tuple[int, int]] = []
+        for case in node.cases:
+            for start, end in case.patterns:
+                stop = end.value if end else start.value + 1
+                if start.value >= stop:
+                    self.err(TypeError, f'Empty case range {start.value}..{stop}', start.pos)
+                if start.value < lowest or stop > highest:
+                    shown = f'{start.value}..{stop}' if end else start.value
+                    self.err(TypeError, f'Case {shown} does not fit into {value_type}, which goes from {lowest} to '
+                                        f'{highest - 1}', start.pos)
+                for low, high in covered:
+                    if start.value < high and low < stop:
+                        self.err(DuplicateNameError, f'Case {start.value} overlaps with an earlier case', start.pos)
+                covered.append((start.value, stop))
+
+            self.env = Env(self.env)
+            self.check(case.body)
+            self.env = self.env.parent
+
+        if node.default:
+            self.env = Env(self.env)
+            self.check(node.default)
+            self.env = self.env.parent
+
     def checkWhileNode(self, node: WhileNode) -> None:
         bool_value = self.check(node.bool)
         if bool_value != 'bool':
             self.err(TypeError, f'Expected bool, got {bool_value}', node.bool.pos)
 
+        self.check_loop_hints(node.hints)
+
         self.env = Env(self.env)
         self.check(node.expr)
         self.env = self.env.parent
@@ -161,22 +395,82 @@ class Analyser:
         if from_type != to_type != step_type != 'int':
             self.err(TypeError, f'Expected int, got {from_type}, {to_type} and {step_type}', node.from_node.pos)
 
+        self.check_loop_hints(node.hints)
+
         self.env = Env(self.env)
         self.env.define(node.identifier.value, 'int')
         self.check(node.expr)
         self.env = self.env.parent
 
+    def check_loop_hints(self, hints: list[tuple[Token, Token | None]]):
+        seen: list[str] = []
+        for hint, value in hints:
+            if hint.value in seen:
+                self.err(DuplicateNameError, f'Loop hint {hint.value.lower()} is given twice', hint.pos)
+            seen.append(hint.value)
+            if hint.value == 'INTERLEAVE' and value is None:
+                self.err(TypeError, 'Expected the interleave count after interleave', hint.pos)
+            if value is not None and value.value < 1:
+                self.err(TypeError, f'Loop hint {hint.value.lower()} needs a positive count, got {value.value}',
+                         value.pos)
+            if hint.value == 'VECTORIZE' and value is not None and value.value & (value.value - 1):
+                self.err(TypeError, f'Vectorization width has to be a power of two, got {value.value}', value.pos)
+
+    def checkForEachNode(self, node: ForEachNode) -> None:
+        map_type = self.check_indexed(node.map)
+        if not map_type.startswith('map:'):
+            self.err(TypeError, f'Can only loop over the entries of a map, got {map_type}', node.map.pos)
+        _, key_type, value_type = map_type.split(':', 2)
+        self.current_fun.effects.add('read')
+
+        self.env = Env(self.env)
+        self.env.define(node.key.value, key_type)
+        if node.value:
+            self.env.define(node.value.value, value_type)
+        self.check(node.expr)
+        self.env = self.env.parent
+
     def checkFunCallNode(self, node: FunCallNode) -> str:
+        if node.identifier.value in self.vec_builtins:
+            return self.check_vec_builtin(node)
+        if node.identifier.value in self.map_builtins:
+            return self.check_map_builtin(node)
+        if node.identifier.value in self.math_builtins:
+            return self.check_math_builtin(node)
+        if node.identifier.value.startswith(('map:', 'array:')):
+            self.check_type(node.identifier.value, node.pos)
+        if node.identifier.value.startswith('map:'):
+            _, key_type, value_type = node.identifier.value.split(':', 2)
+            if key_type not in self.map_key_types:
+                self.err(TypeError, f'Map keys can only be int, str or byte, got {key_type}', node.pos)
+            if value_type == 'null' or 'vec:' in value_type or 'array:' in value_type:
+                self.err(TypeError, f'Maps cannot hold {value_type}', node.pos)
+            self.current_fun.effects.add('alloc')
+            return node.identifier.value
+        if node.identifier.value.startswith('array:'):
+            self.check_array_type(node.identifier.value, node.pos)
+            return node.identifier.value
         if node.identifier.value in self.builtins:
+            for arg in node.args:
+                self.check_indexed(arg)
+            self.current_fun.effects.add('read' if node.identifier.value == 'len' else 'io')
+            if node.identifier.value == 'getchar':
+                self.allocations.add(node)
             return self.builtins[node.identifier.value]
+        arg_types: list[str] | None = None
+        if node.identifier.value.partition('<')[0] in self.generics:
+            arg_types = [self.check(arg) for arg in node.args]
+            node.identifier.value = self.instantiate_call(node, arg_types)
         if node.identifier.value in self.structs:
             fun_helper = self.funcs[f'{node.identifier.value}:create']
+            self.current_fun.calls.add(fun_helper)
+            self.allocations.add(node)
             if fun_helper.argc != len(node.args) + 1:
                 self.err(TypeError,
                          f'Function {fun_helper.name} expected {fun_helper.argc} arguments, got {len(node.args)}',
                          node.pos)
             for i, arg in enumerate(node.args):
-                arg_type = self.check(arg)
+                arg_type = arg_types[i] if arg_types else self.check(arg)
                 if arg_type != fun_helper.arg_types[i + 1]:
                     self.err(TypeError,
                              f'Function {fun_helper.name} expected {fun_helper.arg_types[i]} for the {i}th element, found {arg_type}',
@@ -185,36 +479,268 @@ class Analyser:
         if node.identifier.value not in self.funcs:
             self.err(NoSuchVarError, f'Function {node.identifier.value} is not defined in the current scope', node.pos)
         fun_helper = self.funcs[node.identifier.value]
+        self.current_fun.calls.add(fun_helper)
+        if fun_helper.const:
+            self.const_calls[node] = fun_helper
+        if fun_helper.by_value:
+            self.allocations.add(node)  # the copy of the object needs memory
         if fun_helper.argc != len(node.args):
             self.err(TypeError,
                      f'Function {fun_helper.name} expected {fun_helper.argc} arguments, got {len(node.args)}', node.pos)
         for i, arg in enumerate(node.args):
-            arg_type = self.check(arg)
+            arg_type = arg_types[i] if arg_types else self.check(arg)
             if arg_type != fun_helper.arg_types[i]:
                 self.err(TypeError,
                          f'Function {fun_helper.name} expected {fun_helper.arg_types[i]} for the {i}th element, found {arg_type}',
                          arg.pos)
         return fun_helper.ret_type
 
+    def check_vec_builtin(self, node: FunCallNode) -> str:
+        """Check the builtins creating, shuffling, reducing, loading and storing vectors"""
+        name = node.identifier.value
+        expected = {'vec': 2, 'shuffle': 3, 'vec_load': 3, 'vec_store': 3}.get(name, 1)
+        if len(node.args) < expected or (len(node.args) != expected and name not in ['vec', 'shuffle']):
+            self.err(TypeError, f'Function {name} expected {expected} arguments, got {len(node.args)}', node.pos)
+        types = [self.check_indexed(arg) if i == 0 and name in ['vec_load', 'vec_store'] else self.check(arg)
+                 for i, arg in enumerate(node.args)]
+
+        def vec_of(element_type: str, size: int, pos: Position) -> str:
+            if element_type not in ['int', 'float', 'byte']:
+                self.err(TypeError, f'Vectors can only hold int, float or byte, got {element_type}', pos)
+            if size < 2 or size & (size - 1):
+                self.err(TypeError, f'Vector size has to be a power of two, got {size}', pos)
+            return f'vec:{element_type}:{size}'
+
+        def constant(arg: Node) -> int:
+            if not isinstance(arg, NumberNode) or arg.token.type != TT.INT:
+                self.err(TypeError, f'{name} expects an int constant here', arg.pos)
+            return arg.token.value
+
+        match name:
+            case 'vec':
+                for arg, typ in zip(node.args, types):
+                    if typ != types[0]:
+                        self.err(TypeError, f'Expected {types[0]}, got {typ}', arg.pos)
+                return vec_of(types[0], len(types), node.pos)
+            case 'shuffle':
+                if not types[0].startswith('vec:'):
+                    self.err(TypeError, f'Can only shuffle vectors, got {types[0]}', node.args[0].pos)
+                _, element_type, size = types[0].split(':')
+                inputs = 2 if types[1] == types[0] else 1
+                for arg in node.args[inputs:]:
+                    if not 0 <= constant(arg) < int(size) * inputs:
+                        self.err(IndexError, f'Lane {constant(arg)} is not in the shuffled vectors', arg.pos)
+                return vec_of(element_type, len(node.args) - inputs, node.pos)
+            case 'vec_load' | 'vec_store':
+                if not types[0].startswith('list:'):
+                    self.err(TypeError, f'Expected a list to {name.removeprefix("vec_")}, got {types[0]}',
+                             node.args[0].pos)
+                if types[1] != 'int':
+                    self.err(TypeError, f'Expected int as offset, got {types[1]}', node.args[1].pos)
+                element_type = types[0].removeprefix('list:')
+                if name == 'vec_load':
+                    self.current_fun.effects.add('read')
+                    return vec_of(element_type, constant(node.args[2]), node.args[2].pos)
+                if not types[2].startswith(f'vec:{element_type}:'):
+                    self.err(TypeError, f'Expected a vector of {element_type}, got {types[2]}', node.args[2].pos)
+                self.current_fun.effects.add('write')
+                return 'null'
+            case _:
+                if not types[0].startswith('vec:'):
+                    self.err(TypeError, f'Can only reduce vectors, got {types[0]}', node.args[0].pos)
+                return types[0].split(':')[1]
+
+    def check_map_builtin(self, node: FunCallNode) -> str:
+        """Check has(map, key), remove(map, key) and reserve(map, count)"""
+        name = node.identifier.value
+        if len(node.args) != 2:
+            self.err(TypeError, f'Function {name} expected 2 arguments, got {len(node.args)}', node.pos)
+        map_type = self.check_indexed(node.args[0])
+        if not map_type.startswith('map:'):
+            self.err(TypeError, f'Expected a map to {name}, got {map_type}', node.args[0].pos)
+        expected = 'int' if name == 'reserve' else map_type.split(':')[1]
+        arg_type = self.check(node.args[1])
+        if arg_type != expected:
+            self.err(TypeError, f'Expected {expected}, got {arg_type}', node.args[1].pos)
+        if name == 'has':
+            self.current_fun.effects.add('read')
+            return 'bool'
+        self.current_fun.effects.add('write')
+        return 'bool' if name == 'remove' else 'null'
+
+    def check_math_builtin(self, node: FunCallNode) -> str:
+        """
+        Check the math and bit builtins. All arguments and the result share one number type, or a vector of it.
+        prefetch(list, index) only hints the cpu to load that element, the others have no effects at all
+        """
+        name = node.identifier.value
+        expected, allowed = self.math_builtins[name]
+        if len(node.args) != expected:
+            self.err(TypeError, f'Function {name} expected {expected} arguments, got {len(node.args)}', node.pos)
+        if name == 'prefetch':
+            list_type = self.check_indexed(node.args[0])
+            if not list_type.startswith('list:'):
+                self.err(TypeError, f'Expected a list to prefetch, got {list_type}', node.args[0].pos)
+            index_type = self.check(node.args[1])
+            if index_type != 'int':
+                self.err(TypeError, f'Expected int as index, got {index_type}', node.args[1].pos)
+            self.current_fun.effects.add('read')
+            return 'null'
+        types = [self.check(arg) for arg in node.args]
+        element_type = types[0].split(':')[1] if types[0].startswith('vec:') else types[0]
+        if element_type not in allowed:
+            self.err(TypeError, f'Function {name} expects {" or ".join(allowed)} or vectors of them, got {types[0]}',
+                     node.args[0].pos)
+        for arg, typ in zip(node.args, types):
+            if typ != types[0]:
+                self.err(TypeError, f'Expected {types[0]}, got {typ}', arg.pos)
+        return types[0]
+
     def checkFunDefNode(self, node: FunDefNode) -> None:
+        if node.type_params:
+            self.define_generic(node)
+            return
+        for typ in [*node.arg_types, node.return_type]:
+            self.check_type(typ.value, typ.pos)
         self.env = Env(self.env)
         self.context = Context(self.context, node.identifier.value, self.context.file, self.context.file_text)
         prev_fun = self.current_fun
+        prev_fun_env = self.fun_env
+        self.fun_env = self.env
 
         for i, arg in enumerate(node.args):
             self.env.define(arg.value, node.arg_types[i].value)
         fun_helper = Fun(node.identifier.value, len(node.arg_types), [arg_type.value for arg_type in node.arg_types],
                          node.return_type.value)
+        if any(typ.startswith('array:') for typ in fun_helper.arg_types):
+            fun_helper.effects.add('read')  # the caller's array is copied in
+        struct = self.structs.get(fun_helper.ret_type)
+        fun_helper.by_value = struct is not None and struct.by_value and not node.export and self.returns_fresh(node)
+        fun_helper.const = node.const is not None
 
         self.current_fun = fun_helper
         self.funcs[node.identifier.value] = fun_helper
+        self.fun_helpers[node] = fun_helper
 
         self.check(node.body)
 
+        if node.export:
+            self.check_export(node, fun_helper, nested=prev_fun_env is not None)
+        if node.const:
+            self.check_const_fun(node, fun_helper)
+        if node.memo:
+            self.check_memo(node, fun_helper)
+        elif self.auto_memo and fun_helper.is_recursive() and self.memo_problem(fun_helper) is None:
+            fun_helper.memo_size = self.default_memo_size
+            fun_helper.effects.add('cache')
+
         self.current_fun = prev_fun
+        self.fun_env = prev_fun_env
         self.context = self.context.parent
         self.env = self.env.parent
 
+    def returns_fresh(self, node: FunDefNode) -> bool:
+        """
+        Return if every object the function returns is made by it and nothing else refers to it, only then returning a
+        copy behaves like returning the reference. Fresh is a new object, the result of a function returning by value,
+        or a local variable only assigned fresh objects and else only used for its fields
+        """
+        params = {arg.value for arg in node.args}
+        returned: list[Node] = []
+        assigned: dict[str, list[Node]] = {}
+        uses: dict[str, int] = {}  # uses of a variable as a whole, not for a field
+
+        def collect(child: Node):
+            if isinstance(child, (FunDefNode, StructDefNode)):
+                return
+            if isinstance(child, ReturnNode) and child.value:
+                returned.append(child.value)
+            elif isinstance(child, VarAssignNode):
+                assigned.setdefault(child.name.value, []).append(child.value)
+            elif isinstance(child, VarAccessNode):
+                uses[child.name.value] = uses.get(child.name.value, 0) + 1
+            if isinstance(child, (StructReadNode, StructAssignNode)) and isinstance(child.obj, VarAccessNode):
+                for grandchild in child.children():
+                    if grandchild is not child.obj:
+                        collect(grandchild)
+                return
+            for grandchild in child.children():
+                collect(grandchild)
+
+        def made_here(value: Node) -> bool:
+            if isinstance(value, IfNode) and value.is_expr:
+                return made_here(value.expr) and made_here(value.else_expr)
+            if not isinstance(value, FunCallNode):
+                return False
+            name = value.identifier.value
+            return name in self.structs or name in self.funcs and self.funcs[name].by_value
+
+        def fresh(value: Node) -> bool:
+            if isinstance(value, VarAccessNode):
+                name = value.name.value
+                returns = sum(isinstance(other, VarAccessNode) and other.name.value == name for other in returned)
+                return name not in params and name in assigned and uses.get(name, 0) == returns and all(
+                    made_here(other) for other in assigned[name])
+            return made_here(value)
+
+        collect(node.body)
+        return all(fresh(value) for value in returned)
+
+    def check_export(self, node: FunDefNode, fun_helper: Fun, nested: bool):
+        """Exported functions are called from C, so they have to be top level functions with C compatible types"""
+        if ':' in fun_helper.name or nested:
+            self.err(TypeError, f'Cannot export {fun_helper.name}, only top level functions can be exported',
+                     node.export.pos)
+        for typ, token in zip([*fun_helper.arg_types, fun_helper.ret_type], [*node.arg_types, node.return_type]):
+            if 'vec:' in typ or 'array:' in typ:
+                self.err(TypeError, f'Cannot export {fun_helper.name}, C has no type for {typ}', token.pos)
+        fun_helper.exported = True
+
+    def check_memo(self, node: FunDefNode, fun_helper: Fun):
+        memo, size = node.memo
+        problem = self.memo_problem(fun_helper)
+        if problem:
+            self.err(TypeError, f'Cannot memo {fun_helper.name}, it {problem}', memo.pos)
+        if size is not None and (size.value < 1 or size.value & (size.value - 1)):
+            self.err(TypeError, f'Memo cache size has to be a power of two, got {size.value}', size.pos)
+        fun_helper.memo_size = size.value if size else self.default_memo_size
+        fun_helper.effects.add('cache')
+
+    def check_const_fun(self, node: FunDefNode, fun_helper: Fun):
+        """A const function runs while compiling, so it takes and returns plain values and does nothing else"""
+        for typ, token in zip(fun_helper.arg_types, node.arg_types):
+            if typ not in ['int', 'float', 'bool', 'byte']:
+                self.err(TypeError, f'Cannot make {fun_helper.name} const, it needs int, float, bool or byte '
+                                    f'parameters, got {typ}', token.pos)
+        if fun_helper.ret_type not in ['int', 'float', 'bool']:
+            self.err(TypeError, f'Cannot make {fun_helper.name} const, it has to return int, float or bool, '
+                                f'got {fun_helper.ret_type}', node.return_type.pos)
+        problem = self.effects_problem(fun_helper)
+        if problem:
+            self.err(TypeError, f'Cannot make {fun_helper.name} const, it {problem}', node.const.pos)
+
+    @staticmethod
+    def memo_problem(fun_helper: Fun) -> str | None:
+        """Tell why the result of a function can not be cached, or None if it can"""
+        scalars = ['int', 'float', 'bool', 'byte']
+        if fun_helper.argc == 0:
+            return 'has no parameters'
+        if any(typ not in scalars for typ in fun_helper.arg_types) or fun_helper.ret_type not in scalars:
+            return 'needs int, float, bool or byte as parameter and return types'
+        return Analyser.effects_problem(fun_helper)
+
+    @staticmethod
+    def effects_problem(fun_helper: Fun) -> str | None:
+        """Tell what a function does besides computing its result from its arguments, None if nothing"""
+        effects = fun_helper.all_effects()
+        if 'io' in effects:
+            return 'prints or reads input'
+        if 'alloc' in effects:
+            return 'allocates memory'
+        if 'global' in effects:
+            return 'uses variables from outside the function'
+        return None
+
     def checkStringNode(self, node: StringNode) -> str:
         return 'str'
 
@@ -222,18 +748,59 @@ class Analyser:
         if len(node.content) == 0:
             return 'list:int'
         list_type = self.check(node.content[0])
+        if list_type.startswith('array:'):
+            self.err(TypeError, 'Lists cannot hold arrays', node.content[0].pos)
         for n in node.content:
             node_type = self.check(n)
             if node_type != list_type:
                 self.err(TypeError, f'Expected {list_type}, got {node_type}', n.pos)
+        self.allocations.add(node)
         return f'list:{list_type}'
 
     def checkStatementsNode(self, node: StatementsNode) -> None:
-        for statement in node.expressions:
-            self.check(statement)
+        top_level = self.instances is None
+        i = 0
+        while i < len(node.expressions):
+            if top_level:
+                self.instances = []
+            self.check(node.expressions[i])
+            if top_level:
+                node.expressions[i:i] = self.instances  # built before the statement using them
+                i += len(self.instances)
+            i += 1
+        if top_level:
+            self.instances = None
 
     def checkListAssignNode(self, node: ListAssignNode) -> None:
-        list_type = self.check(node.list)
+        if isinstance(node.list, VarAccessNode) and self.env.const(node.list.name.value):
+            self.err(TypeError, f'{node.list.name.value} is const, its elements can not be assigned', node.list.pos)
+        list_type = self.check_indexed(node.list)
+        if list_type.startswith('map:'):
+            _, key_type, value_type = list_type.split(':', 2)
+            self.current_fun.effects.add('write')
+            index_type = self.check(node.index)
+            if index_type != key_type:
+                self.err(TypeError, f'Expected {key_type} as key, got {index_type}', node.index.pos)
+            assigned_type = self.check(node.value)
+            if assigned_type != value_type:
+                self.err(TypeError, f'Expected {value_type}, got {assigned_type}', node.value.pos)
+            return
+        if list_type.startswith('array:'):
+            _, element_type, size = list_type.split(':')
+            index_type = self.check(node.index)
+            if index_type != 'int':
+                self.err(TypeError, f'Cannot index array with non integer, got {index_type}', node.index.pos)
+            self.check_array_index(node.index, int(size))
+            value_type = self.check(node.value)
+            if value_type != element_type:
+                self.err(TypeError, f'Expected {element_type}, got {value_type}', node.value.pos)
+            return
+        if list_type.startswith('vec:'):
+            if not isinstance(node.list, VarAccessNode):
+                self.err(TypeError, 'Can only set lanes of vector variables', node.list.pos)
+            list_type = 'list:' + list_type.split(':')[1]
+        else:
+            self.current_fun.effects.add('write')
         if not list_type.startswith('list:'):
             self.err(TypeError, 'Cannot index non list!', node.list.pos)
         list_type = list_type.removeprefix('list:')
@@ -245,16 +812,38 @@ class Analyser:
             self.err(TypeError, f'Cannot index list with non integer, got {index_type}', node.index.pos)
 
     def checkStructDefNode(self, node: StructDefNode) -> None:
+        for fun in node.functions:
+            if fun.type_params:
+                self.err(TypeError, f'Methods cannot have type parameters, make the class {node.identifier.value} '
+                                    f'generic instead', fun.type_params[0].pos)
+        if node.type_params:
+            self.define_generic(node)
+            return
         fields: dict[str, str] = {}
         for name in node.values:
+            self.check_type(node.values[name].value, node.values[name].pos)
             fields[name.value] = node.values[name].value
         struct_helper = Struct(node.identifier.value, fields)
         self.structs[struct_helper.name] = struct_helper
         for fun in node.functions:
             self.check(fun)
 
+    def check_object(self, node: Node) -> str:
+        """The class of an object whose property is read or set, an object in an array is only used that way"""
+        if isinstance(node, BinOpNode) and node.operator.type == TT.GET:
+            array_type = self.check_indexed(node.left)
+            if array_type.startswith('array:') and array_type.split(':')[1] in self.structs:
+                _, element_type, size = array_type.split(':')
+                index_type = self.check(node.right)
+                if index_type != 'int':
+                    self.err(TypeError, f'Cannot index array with non integer, got {index_type}', node.right.pos)
+                self.check_array_index(node.right, int(size))
+                return element_type
+        return self.check_indexed(node)
+
     def checkStructAssignNode(self, node: StructAssignNode) -> None:
-        obj_type = self.check(node.obj)
+        obj_type = self.check_object(node.obj)
+        self.current_fun.effects.add('write')
         struct_helper = self.structs[obj_type]
         if node.key.value not in struct_helper.fields:
             self.err(NoSuchVarError, f'Class {obj_type} does not have an attribute called {node.key.value}', node.key.pos)
@@ -264,7 +853,8 @@ class Analyser:
             self.err(TypeError, f'Expected {field_type} for attribute {node.key.value}, got {value_type}', node.key.pos)
 
     def checkStructReadNode(self, node: StructReadNode) -> str:
-        obj_type = self.check(node.obj)
+        obj_type = self.check_object(node.obj)
+        self.current_fun.effects.add('read')
         struct_helper = self.structs[obj_type]
         if node.key.value not in struct_helper.fields:
             self.err(NoSuchVarError, f'Class {obj_type} does not have an attribute called {node.key.value}',
@@ -272,7 +862,151 @@ class Analyser:
         return struct_helper.fields[node.key.value]
 
     def checkImportNode(self, node: ImportNode) -> None:
-        self.check(node.file_path.value)
+        """Parse and check the imported file with this Analyser, so its functions and classes can be used"""
+        file_path = node.file_path.value
+        if file_path in self.imported:
+            return
+        self.imported.add(file_path)
+        try:
+            with open(os.path.abspath(f'{file_path}.hb'), 'r') as f:
+                file_code = f.read()
+        except FileNotFoundError:
+            self.err(NoSuchVarError, f'Cannot find {file_path}.hb to import', node.pos)
+
+        ctx = Context(self.context, f'load_{file_path}()', file_path, file_code)
+        tokens = Lexer(ctx).make_tokens()
+        if isinstance(tokens, Error):
+            raise tokens
+        ast = Parser(tokens, ctx).parse()
+        if isinstance(ast, Error):
+            raise ast
+
+        prev_env, prev_context, prev_fun, prev_fun_env = self.env, self.context, self.current_fun, self.fun_env
+        prev_instances = self.instances
+        self.env, self.context, self.fun_env, self.instances = Env(), ctx, None, None
+        self.current_fun = Fun(f'load_{file_path}', 0, [], 'int')
+        self.funcs[self.current_fun.name] = self.current_fun
+        self.check(ast)
+        self.env, self.context, self.current_fun, self.fun_env = prev_env, prev_context, prev_fun, prev_fun_env
+        self.instances = prev_instances
+
+        node.ast = ast
+        node.context = ctx
+
+    def define_generic(self, node: FunDefNode | StructDefNode):
+        """Remember a generic function or class, its body is only checked in the instances made from it"""
+        name = node.identifier.value
+        if self.fun_env is not None or ':' in name:
+            self.err(TypeError, f'Only top level functions and classes can be generic, {name} is not',
+                     node.type_params[0].pos)
+        if name in self.generics or name in self.funcs or name in self.structs:
+            self.err(DuplicateNameError, f'{name} is already defined', node.identifier.pos)
+        if isinstance(node, FunDefNode) and node.export:
+            self.err(TypeError, f'Cannot export {name}, C cannot call a generic function, export a function calling '
+                                f'one of its instances instead', node.export.pos)
+        params = [param.value for param in node.type_params]
+        for param in node.type_params:
+            if params.count(param.value) > 1:
+                self.err(DuplicateNameError, f'Type parameter {param.value} is given twice', param.pos)
+            if param.value in self.structs or param.value in self.generics:
+                self.err(DuplicateNameError, f'Type parameter {param.value} has the name of a class', param.pos)
+        if isinstance(node, FunDefNode):
+            param_types = [typ.value for typ in node.arg_types]
+        else:
+            create = next(fun for fun in node.functions if fun.identifier.value == f'{name}:create')
+            param_types = [typ.value for typ in create.arg_types[1:]]
+        self.generics[name] = Generic(node, params, param_types, self.env, self.context, self.current_fun)
+
+    def instantiate_call(self, node: FunCallNode, arg_types: list[str]) -> str:
+        """
+        The instance a call of a generic function or class uses, the type arguments not written like in first<int>(l)
+        are taken from the types of the arguments
+        """
+        if '<' in node.identifier.value:
+            name, type_args = generic_parts(node.identifier.value)
+            return self.instantiate(name, type_args, node.pos)
+        name = node.identifier.value
+        generic = self.generics[name]
+        if len(arg_types) != len(generic.param_types):
+            self.err(TypeError, f'Function {name} expected {len(generic.param_types)} arguments, got {len(arg_types)}',
+                     node.pos)
+        bindings: dict[str, str] = {}
+        for param_type, arg_type in zip(generic.param_types, arg_types):
+            infer(param_type, arg_type, generic.params, bindings)
+        missing = [param for param in generic.params if param not in bindings]
+        if missing:
+            self.err(TypeError, f'Cannot tell {missing[0]} of {name} from the arguments, write it like '
+                                f'{name}<{", ".join(generic.params)}>(...)', node.pos)
+        return self.instantiate(name, [bindings[param] for param in generic.params], node.pos)
+
+    def instantiate(self, name: str, type_args: list[str], pos: Position) -> str:
+        """
+        The name of the instance of a generic for the type arguments, like Box<int>. The first use copies the generic
+        with the types filled in, checks the copy where the generic is defined and puts it before the top level
+        statement using it, so the IrBuilder builds one function or class per instance. Later uses, also from other
+        files, share that instance
+        """
+        generic = self.generics[name]
+        if len(type_args) != len(generic.params):
+            self.err(TypeError, f'{name} expected {len(generic.params)} type arguments, got {len(type_args)}', pos)
+        for typ in type_args:
+            self.check_type(typ, pos)
+        key = tuple(type_args)
+        if key in generic.instances:
+            return generic.instances[key]
+        instance_name = f'{name}<{", ".join(display_type(typ) for typ in type_args)}>'
+        if len(generic.instances) >= self.max_instances:
+            self.err(TypeError, f'{name} already has {self.max_instances} instances, {instance_name} would be one '
+                                f'more', pos)
+        if len(self.instantiating) >= self.max_instance_depth:
+            self.err(TypeError, f'{instance_name} is made by {self.max_instance_depth} instances in a row, the '
+                                f'first one is {self.instantiating[0]}', pos)
+        generic.instances[key] = instance_name
+
+        instance = deepcopy(generic.node)
+        instance.type_params = []
+        bindings = dict(zip(generic.params, type_args))
+        if isinstance(instance, StructDefNode):
+            bindings[name] = instance_name  # the class in its own methods, like the type of self
+            for fun in instance.functions:
+                fun.identifier.value = instance_name + fun.identifier.value.removeprefix(name)
+        substitute_types(instance, bindings)
+        instance.identifier.value = instance_name
+
+        prev = self.env, self.context, self.current_fun, self.fun_env
+        self.env, self.context, self.current_fun, self.fun_env = generic.env, generic.context, generic.load_fun, None
+        self.instantiating.append(instance_name)
+        self.check(instance)
+        self.instantiating.pop()
+        self.env, self.context, self.current_fun, self.fun_env = prev
+        self.instances.append(instance)
+        return instance_name
+
+    def check_type(self, typ: str, pos: Position):
+        """Make the instances of the generic classes a type uses, like Box<int> for list<Box<int>>"""
+        if typ in self.generics:
+            self.err(TypeError, f'{typ} is generic, write its type arguments like {typ}<int>', pos)
+        name, parts = type_parts(typ)
+        if name in ['list', 'vec', 'array', 'map']:
+            for part in parts:
+                self.check_type(part, pos)
+        elif parts:
+            if name not in self.generics or not isinstance(self.generics[name].node, StructDefNode):
+                self.err(NoSuchVarError, f'There is no generic class called {name}', pos)
+            self.instantiate(name, parts, pos)
+
+    def mark_used(self):
+        """
+        Tree shaking, mark every function main, the top level code or an exported function can end up calling, the rest
+        is not built. The top level code of every imported file is built too
+        """
+        roots = [self.load_fun] + ([self.funcs['main']] if 'main' in self.funcs else [])
+        roots += [self.funcs[f'load_{file_path}'] for file_path in self.imported]
+        roots += [fun for fun in self.funcs.values() if fun.exported]
+        for root in roots:
+            root.used = True
+            for fun in root.reachable():
+                fun.used = True
 
     def checkPassNode(self, node: PassNode) -> None:
         pass
@@ -298,11 +1032,60 @@ class Analyser:
         raise err
 
 
+def type_parts(typ: str) -> tuple[str, list[str]]:
+    """The outer type and the types in it, like ('map', ['str', 'list:int']), no types in it for plain types"""
+    written = display_type(typ)
+    return generic_parts(written) if '<' in written else (typ, [])
+
+
+def substitute_type(typ: str, bindings: dict[str, str]) -> str:
+    """The type with the type parameters replaced by the types bound to them, like list:int for list:T"""
+    if typ in bindings:
+        return bindings[typ]
+    name, parts = type_parts(typ)
+    if not parts:
+        return typ
+    return written_type(f'{name}<{", ".join(display_type(substitute_type(part, bindings)) for part in parts)}>')
+
+
+def substitute_types(node: Node, bindings: dict[str, str]):
+    """Replace the type parameters in the copy of a generic, in types and in calls like T(), Box<T>(x) or array<T, 4>()"""
+    tokens: list[Token] = []
+    if isinstance(node, FunDefNode):
+        tokens = [*node.arg_types, node.return_type]
+    elif isinstance(node, StructDefNode):
+        tokens = list(node.values.values())
+    elif isinstance(node, VarAssignNode) and node.type is not None:
+        tokens = [node.type]
+    elif isinstance(node, FunCallNode):
+        tokens = [node.identifier]
+    for token in tokens:
+        token.value = substitute_type(token.value, bindings)
+    for child in node.children():
+        substitute_types(child, bindings)
+
+
+def infer(param_type: str, arg_type: str, params: list[str], bindings: dict[str, str]):
+    """
+    Bind the type parameters in the type of a parameter to the parts of the argument's type at the same place, like
+    T to int for list:T and list:int. Only the first binding counts, a different one shows as a wrong argument type
+    """
+    if param_type in params:
+        bindings.setdefault(param_type, arg_type)
+        return
+    param_name, param_parts = type_parts(param_type)
+    arg_name, arg_parts = type_parts(arg_type)
+    if param_name == arg_name and len(param_parts) == len(arg_parts):
+        for param_part, arg_part in zip(param_parts, arg_parts):
+            infer(param_part, arg_part, params, bindings)
+
+
 class Env:
     """variable table used by the Analyser. name: str -> type: str, implementation wise the same as IrBuilder's Environment"""
     def __init__(self, parent: Env | None = None):
         self.parent = parent
         self.records: dict[str, str] = {'true': 'bool', 'false': 'bool'} if not self.parent else {}
+        self.consts: dict[str, VarAssignNode] = {}  # the variables of this scope declared const
 
     def define(self, key: str, value: str):
         self.records[key] = value
@@ -315,14 +1098,66 @@ class Env:
         else:
             return None
 
+    def const(self, key: str) -> VarAssignNode | None:
+        """The definition of a variable if it is const"""
+        owner = self.owner(key)
+        return owner.consts.get(key) if owner else None
+
+    def owner(self, key: str) -> Env | None:
+        """The scope a variable is defined in"""
+        if key in self.records:
+            return self
+        elif self.parent:
+            return self.parent.owner(key)
+        else:
+            return None
+
 
 class Fun:
-    """Helper class for function argument type and length checking"""
+    """
+    Helper class for function argument type and length checking.
+    Also collects what the function does besides computing its result, the IrBuilder turns that into attributes:
+        io:     prints or reads input
+        alloc:  allocates memory, like concatenating strings
+        read:   reads memory it got passed, like indexing a list
+        write:  writes memory it got passed, like assigning a class attribute
+        global: uses a variable from outside the function
+        cache:  fills the cache of a memo function
+    """
     def __init__(self, name: str, argc: int, arg_types: list[str], ret_type: str):
         self.name = name
         self.argc = argc
         self.arg_types = arg_types
         self.ret_type = ret_type
+        self.effects: set[str] = set()
+        self.calls: set[Fun] = set()
+        self.escaping: set[str] = set()  # parameters used for more than indexing, fields or builtins, they may outlive the call
+        self.memo_size: int | None = None  # number of cache slots if the function is memoized
+        self.used = False  # reachable from main, the top level code or an exported function, see Analyser.mark_used
+        self.exported = False  # callable from C under its own name
+        self.by_value = False  # returns a copy of a small object instead of a reference, see Struct.by_value
+        self.const = False  # runs while compiling when called with constant arguments, see Evaluator
+
+    def reachable(self) -> set[Fun]:
+        """All functions this function can end up calling"""
+        seen: set[Fun] = set()
+        todo = list(self.calls)
+        while todo:
+            fun = todo.pop()
+            if fun not in seen:
+                seen.add(fun)
+                todo.extend(fun.calls)
+        return seen
+
+    def all_effects(self) -> set[str]:
+        """The effects of this function and of every function it calls"""
+        effects = set(self.effects)
+        for fun in self.reachable():
+            effects |= fun.effects
+        return effects
+
+    def is_recursive(self) -> bool:
+        return self in self.reachable()
 
 
 class Struct:
@@ -330,3 +1165,24 @@ class Struct:
     def __init__(self, name: str, fields: dict[str, str]):
         self.name = name
         self.fields = fields
+
+    @property
+    def by_value(self) -> bool:
+        """
+        Objects of at most four numbers are returned by value, in registers or memory of the caller, no reference to
+        them has to be counted and the caller decides where the copy lives
+        """
+        return 0 < len(self.fields) <= 4 and all(typ in ['int', 'float', 'bool', 'byte'] for typ in self.fields.values())
+
+
+class Generic:
+    """A generic function or class, its instances are named by the types they are made for, see Analyser.instantiate"""
+    def __init__(self, node: FunDefNode | StructDefNode, params: list[str], param_types: list[str], env: Env,
+                 ctx: Context, load_fun: Fun):
+        self.node = node
+        self.params = params  # names of the type parameters
+        self.param_types = param_types  # types of the parameters, the types of arguments are inferred from
+        self.env = env  # where it is defined, every instance is checked there
+        self.context = ctx
+        self.load_fun = load_fun
+        self.instances: dict[tuple[str, ...], str] = {}  # type arguments -> name of the instance
@@ -63,6 +63,9 @@ class TT(Enum):
     AND = '&'
     OR = '|'
     XOR = '~'
+    LSHIFT = '<<'
+    RSHIFT = '>>'
+    URSHIFT = '>>>'
     COMMA = ','
     STRING = 'string'
     LSQUARE = '['
@@ -0,0 +1,37 @@
+#include <cstdint>
+#include <cstdio>
+#include <unordered_map>
+
+int main() {
+    std::unordered_map<int32_t, int32_t> values;
+    uint32_t x = 1;
+    for (int32_t i = 0; i < 2000000; i++) {
+        x = x * 1103515245u + 12345u;
+        values[(int32_t) x >> 8] = i;
+    }
+    int32_t sum = 0;
+    x = 1;
+    for (int32_t i = 0; i < 2000000; i++) {
+        x = x * 1103515245u + 12345u;
+        auto found = values.find((int32_t) x >> 8);
+        sum = (int32_t) ((uint32_t) sum + (uint32_t) (found == values.end() ? 0 : found->second));
+    }
+    int32_t misses = 0;
+    x = 2;
+    for (int32_t i = 0; i < 2000000; i++) {
+        x = x * 1103515245u + 12345u;
+        if (values.find((int32_t) x >> 8) == values.end())
+            misses++;
+    }
+    x = 1;
+    for (int32_t i = 0; i < 1000000; i++) {
+        x = x * 1103515245u + 12345u;
+        values.erase((int32_t) x >> 8);
+    }
+    printf("%d %d %d\n", sum, misses, (int32_t) values.size());
+    return 0;
+}
+
+// 2M int keys inserted, looked up, 2M mostly missing lookups, 1M removed, std::unordered_map:
+// compilation 0.356s
+// runtime 1.325s
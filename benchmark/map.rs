@@ -0,0 +1,34 @@
+use std::collections::HashMap;
+
+fn main() {
+    let mut values: HashMap<i32, i32> = HashMap::new();
+    let mut x: u32 = 1;
+    for i in 0..2000000 {
+        x = x.wrapping_mul(1103515245).wrapping_add(12345);
+        values.insert(x as i32 >> 8, i);
+    }
+    let mut sum: i32 = 0;
+    x = 1;
+    for _ in 0..2000000 {
+        x = x.wrapping_mul(1103515245).wrapping_add(12345);
+        sum = sum.wrapping_add(*values.get(&(x as i32 >> 8)).unwrap_or(&0));
+    }
+    let mut misses = 0;
+    x = 2;
+    for _ in 0..2000000 {
+        x = x.wrapping_mul(1103515245).wrapping_add(12345);
+        if !values.contains_key(&(x as i32 >> 8)) {
+            misses += 1;
+        }
+    }
+    x = 1;
+    for _ in 0..1000000 {
+        x = x.wrapping_mul(1103515245).wrapping_add(12345);
+        values.remove(&(x as i32 >> 8));
+    }
+    println!("{} {} {}", sum, misses, values.len());
+}
+
+// 2M int keys inserted, looked up, 2M mostly missing lookups, 1M removed, std HashMap (SwissTable, SipHash):
+// compilation 0.697s
+// runtime 0.510s
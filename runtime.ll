@@ -0,0 +1,661 @@
+; The Heiabubu runtime library, reference counting, string, map and io helpers the IrBuilder calls.
+; The Driver links it into every module before optimising, then makes these functions internal,
+; so they get inlined and specialised at the call site and unused ones are removed.
+
+declare i32 @strlen(i8*)
+declare i8* @malloc(i32)
+declare i32 @strcmp(i8*, i8*)
+declare i32 @getchar()
+declare void @llvm.memcpy.p0i8.p0i8.i32(i8*, i8*, i32, i1)
+declare i8* @calloc(i64, i64)
+declare void @free(i8*)
+declare i8* @realloc(i8*, i64)
+
+; Reference counting. Every str, list and object made by Heiabubu has a header in the 16 bytes right before its first
+; byte, with its count and the function releasing what an object holds, or null.
+; Literals and stack memory have count -1 and are never freed.
+; Only a module with exported functions can be handed memory of C or python, which has no header in front of it.
+; For those the IrBuilder sets hb_foreign and every header hb_alloc makes is kept in hb_owned, so retain and release
+; read no header of memory that is not in there. Without exports hb_foreign is false and the check is optimised away
+%hb_rc = type { i32, void (i8*)* }  ; count, drop
+
+@hb_foreign = external constant i1
+@hb_owned = internal global %hb_map* null  ; the values with a header made by hb_alloc, if hb_foreign
+
+; the count of p, or null if p is null, never freed or not made by Heiabubu
+define linkonce_odr i32* @hb_rc_count(i8* %p) nounwind readonly {
+entry:
+  %null = icmp eq i8* %p, null
+  br i1 %null, label %none, label %check
+check:
+  %foreign = load i1, i1* @hb_foreign
+  br i1 %foreign, label %check_owned, label %header
+check_owned:
+  %owned = load %hb_map*, %hb_map** @hb_owned
+  %no_owned = icmp eq %hb_map* %owned, null
+  br i1 %no_owned, label %none, label %lookup
+lookup:
+  %key = ptrtoint i8* %p to i64
+  %ours = call i1 @hb_map_has(%hb_map* %owned, i64 %key)
+  br i1 %ours, label %header, label %none
+header:
+  %raw = getelementptr i8, i8* %p, i64 -16
+  %h = bitcast i8* %raw to %hb_rc*
+  %count_ptr = getelementptr %hb_rc, %hb_rc* %h, i32 0, i32 0
+  %count = load i32, i32* %count_ptr
+  %counted = icmp sgt i32 %count, 0
+  br i1 %counted, label %found, label %none
+found:
+  ret i32* %count_ptr
+none:
+  ret i32* null
+}
+
+; keep p in hb_owned if the module can be handed foreign memory
+define linkonce_odr void @hb_track(i8* %p) nounwind {
+entry:
+  %foreign = load i1, i1* @hb_foreign
+  br i1 %foreign, label %track, label %done
+track:
+  %owned = load %hb_map*, %hb_map** @hb_owned
+  %no_owned = icmp eq %hb_map* %owned, null
+  br i1 %no_owned, label %create, label %add
+create:
+  %created = call %hb_map* @hb_map_new(i1 false)
+  store %hb_map* %created, %hb_map** @hb_owned
+  br label %add
+add:
+  %map = phi %hb_map* [ %owned, %track ], [ %created, %create ]
+  %key = ptrtoint i8* %p to i64
+  call void @hb_map_set(%hb_map* %map, i64 %key, i64 1)
+  br label %done
+done:
+  ret void
+}
+
+; remove p from hb_owned before its memory is freed or moved
+define linkonce_odr void @hb_untrack(i8* %p) nounwind {
+entry:
+  %foreign = load i1, i1* @hb_foreign
+  br i1 %foreign, label %untrack, label %done
+untrack:
+  %owned = load %hb_map*, %hb_map** @hb_owned
+  %key = ptrtoint i8* %p to i64
+  %removed = call i1 @hb_map_remove(%hb_map* %owned, i64 %key)
+  br label %done
+done:
+  ret void
+}
+
+; size bytes of new heap memory with count 1, drop is called with it before it is freed
+define linkonce_odr i8* @hb_alloc(i32 %size, void (i8*)* %drop) nounwind {
+entry:
+  %total = add i32 %size, 16
+  %raw = call i8* @malloc(i32 %total)
+  %h = bitcast i8* %raw to %hb_rc*
+  %count_ptr = getelementptr %hb_rc, %hb_rc* %h, i32 0, i32 0
+  store i32 1, i32* %count_ptr
+  %drop_ptr = getelementptr %hb_rc, %hb_rc* %h, i32 0, i32 1
+  store void (i8*)* %drop, void (i8*)** %drop_ptr
+  %p = getelementptr i8, i8* %raw, i64 16
+  call void @hb_track(i8* %p)
+  ret i8* %p
+}
+
+define linkonce_odr void @hb_retain(i8* %p) nounwind {
+entry:
+  %count_ptr = call i32* @hb_rc_count(i8* %p)
+  %none = icmp eq i32* %count_ptr, null
+  br i1 %none, label %done, label %inc
+inc:
+  %count = load i32, i32* %count_ptr
+  %count1 = add i32 %count, 1
+  store i32 %count1, i32* %count_ptr
+  br label %done
+done:
+  ret void
+}
+
+; drop one reference to p, the last one frees it
+define linkonce_odr void @hb_release(i8* %p) nounwind {
+entry:
+  %count_ptr = call i32* @hb_rc_count(i8* %p)
+  %none = icmp eq i32* %count_ptr, null
+  br i1 %none, label %done, label %dec
+dec:
+  %count = load i32, i32* %count_ptr
+  %count1 = sub i32 %count, 1
+  store i32 %count1, i32* %count_ptr
+  %last = icmp eq i32 %count1, 0
+  br i1 %last, label %free, label %done
+free:
+  %raw = getelementptr i8, i8* %p, i64 -16
+  %h = bitcast i8* %raw to %hb_rc*
+  %drop_ptr = getelementptr %hb_rc, %hb_rc* %h, i32 0, i32 1
+  %drop = load void (i8*)*, void (i8*)** %drop_ptr
+  %has_drop = icmp ne void (i8*)* %drop, null
+  br i1 %has_drop, label %drop_fields, label %dealloc
+drop_fields:
+  call void %drop(i8* %p)
+  br label %dealloc
+dealloc:
+  call void @hb_untrack(i8* %p)
+  call void @free(i8* %raw)
+  br label %done
+done:
+  ret void
+}
+
+; a new heap string holding a followed by b
+define linkonce_odr i8* @hb_str_concat(i8* %a, i8* %b) nounwind {
+entry:
+  %len_a = call i32 @strlen(i8* %a)
+  %len_b = call i32 @strlen(i8* %b)
+  %len = add i32 %len_a, %len_b
+  %size = add i32 %len, 1
+  %str = call i8* @hb_alloc(i32 %size, void (i8*)* null)
+  call void @llvm.memcpy.p0i8.p0i8.i32(i8* %str, i8* %a, i32 %len_a, i1 false)
+  %end = getelementptr i8, i8* %str, i32 %len_a
+  %size_b = add i32 %len_b, 1
+  call void @llvm.memcpy.p0i8.p0i8.i32(i8* %end, i8* %b, i32 %size_b, i1 false)
+  ret i8* %str
+}
+
+; a followed by b, takes over the reference to a. If nothing else refers to a, b is appended to it in place
+define linkonce_odr i8* @hb_str_append(i8* %a, i8* %b) nounwind {
+entry:
+  %count_ptr = call i32* @hb_rc_count(i8* %a)
+  %counted = icmp ne i32* %count_ptr, null
+  br i1 %counted, label %check_unique, label %copy
+check_unique:
+  %count = load i32, i32* %count_ptr
+  %unique = icmp eq i32 %count, 1
+  br i1 %unique, label %check_overlap, label %copy
+check_overlap:
+  %len_a = call i32 @strlen(i8* %a)
+  %end_a = getelementptr i8, i8* %a, i32 %len_a
+  %after_start = icmp uge i8* %b, %a
+  %before_end = icmp ule i8* %b, %end_a
+  %inside = and i1 %after_start, %before_end
+  br i1 %inside, label %copy, label %grow
+grow:
+  %len_b = call i32 @strlen(i8* %b)
+  %len = add i32 %len_a, %len_b
+  %size = add i32 %len, 17
+  %size64 = zext i32 %size to i64
+  %raw = getelementptr i8, i8* %a, i64 -16
+  call void @hb_untrack(i8* %a)
+  %new_raw = call i8* @realloc(i8* %raw, i64 %size64)
+  %str = getelementptr i8, i8* %new_raw, i64 16
+  call void @hb_track(i8* %str)
+  %end = getelementptr i8, i8* %str, i32 %len_a
+  %size_b = add i32 %len_b, 1
+  call void @llvm.memcpy.p0i8.p0i8.i32(i8* %end, i8* %b, i32 %size_b, i1 false)
+  ret i8* %str
+copy:
+  %joined = call i8* @hb_str_concat(i8* %a, i8* %b)
+  call void @hb_release(i8* %a)
+  ret i8* %joined
+}
+
+define linkonce_odr i1 @hb_str_eq(i8* %a, i8* %b) nounwind readonly {
+entry:
+  %cmp = call i32 @strcmp(i8* %a, i8* %b)
+  %eq = icmp eq i32 %cmp, 0
+  ret i1 %eq
+}
+
+; write c as one char string into buf, buf has room for two bytes
+define linkonce_odr i8* @hb_char_str(i8* %buf, i8 %c) nounwind {
+entry:
+  store i8 %c, i8* %buf
+  %end = getelementptr i8, i8* %buf, i32 1
+  store i8 0, i8* %end
+  ret i8* %buf
+}
+
+; read one char from stdin as one char string into buf
+define linkonce_odr i8* @hb_getchar_str(i8* %buf) nounwind {
+entry:
+  %c = call i32 @getchar()
+  %byte = trunc i32 %c to i8
+  %str = call i8* @hb_char_str(i8* %buf, i8 %byte)
+  ret i8* %str
+}
+
+; map<K, V>, a Robin Hood hash table with linear probing. Keys and values are stored as i64, str keys as their pointer.
+; dists holds the probe distance + 1 of every slot, 0 marks an empty slot. The capacity is a power of two and the
+; table grows at 7/8 load, so every probe ends at an empty slot or at one closer to its home than the key would be.
+; The map holds a reference to each of its str keys, the IrBuilder counts the references of the values
+%hb_map = type { i64*, i64*, i32*, i32, i32, i1 }  ; keys, values, dists, capacity, count, str keys
+
+; fmix64 of murmur3, every bit of the key affects the low bits used as slot index
+define linkonce_odr i64 @hb_hash_int(i64 %x) nounwind readnone {
+entry:
+  %s1 = lshr i64 %x, 33
+  %x1 = xor i64 %x, %s1
+  %x2 = mul i64 %x1, -49064778989728563
+  %s2 = lshr i64 %x2, 33
+  %x3 = xor i64 %x2, %s2
+  %x4 = mul i64 %x3, -4265267296055464877
+  %s3 = lshr i64 %x4, 33
+  %x5 = xor i64 %x4, %s3
+  ret i64 %x5
+}
+
+; FNV-1a over the chars, finished like an int key
+define linkonce_odr i64 @hb_hash_str(i8* %s) nounwind readonly {
+entry:
+  br label %loop
+loop:
+  %i = phi i64 [ 0, %entry ], [ %next, %body ]
+  %h = phi i64 [ -3750763034362895579, %entry ], [ %h2, %body ]
+  %p = getelementptr i8, i8* %s, i64 %i
+  %c = load i8, i8* %p
+  %end = icmp eq i8 %c, 0
+  br i1 %end, label %done, label %body
+body:
+  %c64 = zext i8 %c to i64
+  %h1 = xor i64 %h, %c64
+  %h2 = mul i64 %h1, 1099511628211
+  %next = add i64 %i, 1
+  br label %loop
+done:
+  %r = call i64 @hb_hash_int(i64 %h)
+  ret i64 %r
+}
+
+define linkonce_odr i64 @hb_map_hash(%hb_map* %m, i64 %key) nounwind readonly {
+entry:
+  %str_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 5
+  %str = load i1, i1* %str_ptr
+  br i1 %str, label %str_key, label %int_key
+str_key:
+  %p = inttoptr i64 %key to i8*
+  %hs = call i64 @hb_hash_str(i8* %p)
+  ret i64 %hs
+int_key:
+  %hi = call i64 @hb_hash_int(i64 %key)
+  ret i64 %hi
+}
+
+define linkonce_odr i1 @hb_map_same(%hb_map* %m, i64 %a, i64 %b) nounwind readonly {
+entry:
+  %eq = icmp eq i64 %a, %b
+  br i1 %eq, label %yes, label %check
+check:
+  %str_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 5
+  %str = load i1, i1* %str_ptr
+  br i1 %str, label %compare, label %no
+compare:
+  %pa = inttoptr i64 %a to i8*
+  %pb = inttoptr i64 %b to i8*
+  %same = call i1 @hb_str_eq(i8* %pa, i8* %pb)
+  ret i1 %same
+yes:
+  ret i1 true
+no:
+  ret i1 false
+}
+
+; slot of key or -1, a key can only sit where its probe distance equals the one of the search
+define linkonce_odr i32 @hb_map_find(%hb_map* %m, i64 %key) nounwind readonly {
+entry:
+  %keys_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 0
+  %keys = load i64*, i64** %keys_ptr
+  %dists_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 2
+  %dists = load i32*, i32** %dists_ptr
+  %cap_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 3
+  %cap = load i32, i32* %cap_ptr
+  %mask = sub i32 %cap, 1
+  %h = call i64 @hb_map_hash(%hb_map* %m, i64 %key)
+  %h32 = trunc i64 %h to i32
+  %start = and i32 %h32, %mask
+  br label %loop
+loop:
+  %i = phi i32 [ %start, %entry ], [ %i2, %next ]
+  %d = phi i32 [ 1, %entry ], [ %d2, %next ]
+  %dp = getelementptr i32, i32* %dists, i32 %i
+  %sd = load i32, i32* %dp
+  %gone = icmp ult i32 %sd, %d
+  br i1 %gone, label %missing, label %check
+check:
+  %same_d = icmp eq i32 %sd, %d
+  br i1 %same_d, label %compare, label %next
+compare:
+  %kp = getelementptr i64, i64* %keys, i32 %i
+  %k = load i64, i64* %kp
+  %same = call i1 @hb_map_same(%hb_map* %m, i64 %k, i64 %key)
+  br i1 %same, label %found, label %next
+next:
+  %i1 = add i32 %i, 1
+  %i2 = and i32 %i1, %mask
+  %d2 = add i32 %d, 1
+  br label %loop
+found:
+  ret i32 %i
+missing:
+  ret i32 -1
+}
+
+; put key into a table with room for it, a key further from its home takes the slot of one closer to its home,
+; which is then carried on. Returns if the key is new
+define linkonce_odr i1 @hb_map_insert(%hb_map* %m, i64 %key, i64 %value) nounwind {
+entry:
+  %keys_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 0
+  %keys = load i64*, i64** %keys_ptr
+  %values_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 1
+  %values = load i64*, i64** %values_ptr
+  %dists_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 2
+  %dists = load i32*, i32** %dists_ptr
+  %cap_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 3
+  %cap = load i32, i32* %cap_ptr
+  %mask = sub i32 %cap, 1
+  %h = call i64 @hb_map_hash(%hb_map* %m, i64 %key)
+  %h32 = trunc i64 %h to i32
+  %start = and i32 %h32, %mask
+  br label %loop
+loop:
+  %i = phi i32 [ %start, %entry ], [ %i2, %advance ]
+  %d = phi i32 [ 1, %entry ], [ %d3, %advance ]
+  %k = phi i64 [ %key, %entry ], [ %k2, %advance ]
+  %v = phi i64 [ %value, %entry ], [ %v2, %advance ]
+  %kp = getelementptr i64, i64* %keys, i32 %i
+  %vp = getelementptr i64, i64* %values, i32 %i
+  %dp = getelementptr i32, i32* %dists, i32 %i
+  %sd = load i32, i32* %dp
+  %empty = icmp eq i32 %sd, 0
+  br i1 %empty, label %place, label %occupied
+place:
+  store i64 %k, i64* %kp
+  store i64 %v, i64* %vp
+  store i32 %d, i32* %dp
+  %count_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 4
+  %count = load i32, i32* %count_ptr
+  %count1 = add i32 %count, 1
+  store i32 %count1, i32* %count_ptr
+  ret i1 true
+occupied:
+  %same_d = icmp eq i32 %sd, %d
+  br i1 %same_d, label %compare, label %robin
+compare:
+  %sk = load i64, i64* %kp
+  %same = call i1 @hb_map_same(%hb_map* %m, i64 %sk, i64 %k)
+  br i1 %same, label %update, label %robin
+update:
+  store i64 %v, i64* %vp
+  ret i1 false
+robin:
+  %richer = icmp ult i32 %sd, %d
+  br i1 %richer, label %swap, label %advance
+swap:
+  %old_k = load i64, i64* %kp
+  %old_v = load i64, i64* %vp
+  store i64 %k, i64* %kp
+  store i64 %v, i64* %vp
+  store i32 %d, i32* %dp
+  br label %advance
+advance:
+  %k2 = phi i64 [ %old_k, %swap ], [ %k, %robin ]
+  %v2 = phi i64 [ %old_v, %swap ], [ %v, %robin ]
+  %d2 = phi i32 [ %sd, %swap ], [ %d, %robin ]
+  %i1 = add i32 %i, 1
+  %i2 = and i32 %i1, %mask
+  %d3 = add i32 %d2, 1
+  br label %loop
+}
+
+; move every entry into new arrays of cap slots
+define linkonce_odr void @hb_map_rehash(%hb_map* %m, i32 %cap) nounwind {
+entry:
+  %keys_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 0
+  %old_keys = load i64*, i64** %keys_ptr
+  %values_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 1
+  %old_values = load i64*, i64** %values_ptr
+  %dists_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 2
+  %old_dists = load i32*, i32** %dists_ptr
+  %cap_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 3
+  %old_cap = load i32, i32* %cap_ptr
+  %count_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 4
+  %cap64 = zext i32 %cap to i64
+  %raw_keys = call i8* @calloc(i64 %cap64, i64 8)
+  %keys = bitcast i8* %raw_keys to i64*
+  %raw_values = call i8* @calloc(i64 %cap64, i64 8)
+  %values = bitcast i8* %raw_values to i64*
+  %raw_dists = call i8* @calloc(i64 %cap64, i64 4)
+  %dists = bitcast i8* %raw_dists to i32*
+  store i64* %keys, i64** %keys_ptr
+  store i64* %values, i64** %values_ptr
+  store i32* %dists, i32** %dists_ptr
+  store i32 %cap, i32* %cap_ptr
+  store i32 0, i32* %count_ptr
+  br label %loop
+loop:
+  %j = phi i32 [ 0, %entry ], [ %j2, %next ]
+  %more = icmp ult i32 %j, %old_cap
+  br i1 %more, label %body, label %done
+body:
+  %odp = getelementptr i32, i32* %old_dists, i32 %j
+  %od = load i32, i32* %odp
+  %used = icmp ne i32 %od, 0
+  br i1 %used, label %move, label %next
+move:
+  %okp = getelementptr i64, i64* %old_keys, i32 %j
+  %ok = load i64, i64* %okp
+  %ovp = getelementptr i64, i64* %old_values, i32 %j
+  %ov = load i64, i64* %ovp
+  %new = call i1 @hb_map_insert(%hb_map* %m, i64 %ok, i64 %ov)
+  br label %next
+next:
+  %j2 = add i32 %j, 1
+  br label %loop
+done:
+  %free_keys = bitcast i64* %old_keys to i8*
+  call void @free(i8* %free_keys)
+  %free_values = bitcast i64* %old_values to i8*
+  call void @free(i8* %free_values)
+  %free_dists = bitcast i32* %old_dists to i8*
+  call void @free(i8* %free_dists)
+  ret void
+}
+
+define linkonce_odr %hb_map* @hb_map_new(i1 %str_keys) nounwind {
+entry:
+  %size = ptrtoint %hb_map* getelementptr (%hb_map, %hb_map* null, i32 1) to i32
+  %raw = call i8* @malloc(i32 %size)
+  %m = bitcast i8* %raw to %hb_map*
+  store %hb_map zeroinitializer, %hb_map* %m
+  %str_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 5
+  store i1 %str_keys, i1* %str_ptr
+  call void @hb_map_rehash(%hb_map* %m, i32 8)
+  ret %hb_map* %m
+}
+
+; grow the table so n entries fit without rehashing
+define linkonce_odr void @hb_map_reserve(%hb_map* %m, i32 %n) nounwind {
+entry:
+  %cap_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 3
+  %cap = load i32, i32* %cap_ptr
+  %n8 = mul i32 %n, 8
+  br label %loop
+loop:
+  %c = phi i32 [ 8, %entry ], [ %c2, %double ]
+  %c7 = mul i32 %c, 7
+  %fits = icmp uge i32 %c7, %n8
+  br i1 %fits, label %check, label %double
+double:
+  %c2 = shl i32 %c, 1
+  br label %loop
+check:
+  %bigger = icmp ugt i32 %c, %cap
+  br i1 %bigger, label %grow, label %done
+grow:
+  call void @hb_map_rehash(%hb_map* %m, i32 %c)
+  br label %done
+done:
+  ret void
+}
+
+; set the value of key, a new str key gets retained
+define linkonce_odr void @hb_map_set(%hb_map* %m, i64 %key, i64 %value) nounwind {
+entry:
+  %cap_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 3
+  %cap = load i32, i32* %cap_ptr
+  %count_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 4
+  %count = load i32, i32* %count_ptr
+  %needed = add i32 %count, 1
+  %n8 = mul i32 %needed, 8
+  %c7 = mul i32 %cap, 7
+  %full = icmp ugt i32 %n8, %c7
+  br i1 %full, label %grow, label %insert
+grow:
+  %cap2 = shl i32 %cap, 1
+  call void @hb_map_rehash(%hb_map* %m, i32 %cap2)
+  br label %insert
+insert:
+  %new = call i1 @hb_map_insert(%hb_map* %m, i64 %key, i64 %value)
+  %str_keys_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 5
+  %str_keys = load i1, i1* %str_keys_ptr
+  %keep = and i1 %new, %str_keys
+  br i1 %keep, label %retain, label %done
+retain:
+  %key_str = inttoptr i64 %key to i8*
+  call void @hb_retain(i8* %key_str)
+  br label %done
+done:
+  ret void
+}
+
+; the value of key, 0 if it is missing
+define linkonce_odr i64 @hb_map_get(%hb_map* %m, i64 %key) nounwind readonly {
+entry:
+  %i = call i32 @hb_map_find(%hb_map* %m, i64 %key)
+  %missing = icmp slt i32 %i, 0
+  br i1 %missing, label %zero, label %found
+found:
+  %values_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 1
+  %values = load i64*, i64** %values_ptr
+  %vp = getelementptr i64, i64* %values, i32 %i
+  %v = load i64, i64* %vp
+  ret i64 %v
+zero:
+  ret i64 0
+}
+
+define linkonce_odr i1 @hb_map_has(%hb_map* %m, i64 %key) nounwind readonly {
+entry:
+  %i = call i32 @hb_map_find(%hb_map* %m, i64 %key)
+  %found = icmp sge i32 %i, 0
+  ret i1 %found
+}
+
+; remove key by shifting the following entries of the probe back one slot, returns if it was there
+define linkonce_odr i1 @hb_map_remove(%hb_map* %m, i64 %key) nounwind {
+entry:
+  %start = call i32 @hb_map_find(%hb_map* %m, i64 %key)
+  %missing = icmp slt i32 %start, 0
+  br i1 %missing, label %none, label %found
+found:
+  %keys_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 0
+  %keys = load i64*, i64** %keys_ptr
+  %values_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 1
+  %values = load i64*, i64** %values_ptr
+  %dists_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 2
+  %dists = load i32*, i32** %dists_ptr
+  %cap_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 3
+  %cap = load i32, i32* %cap_ptr
+  %mask = sub i32 %cap, 1
+  %removed_ptr = getelementptr i64, i64* %keys, i32 %start
+  %removed = load i64, i64* %removed_ptr
+  br label %shift
+shift:
+  %i = phi i32 [ %start, %found ], [ %n, %move ]
+  %n1 = add i32 %i, 1
+  %n = and i32 %n1, %mask
+  %ndp = getelementptr i32, i32* %dists, i32 %n
+  %nd = load i32, i32* %ndp
+  %home = icmp ule i32 %nd, 1
+  br i1 %home, label %clear, label %move
+move:
+  %nkp = getelementptr i64, i64* %keys, i32 %n
+  %nk = load i64, i64* %nkp
+  %kp = getelementptr i64, i64* %keys, i32 %i
+  store i64 %nk, i64* %kp
+  %nvp = getelementptr i64, i64* %values, i32 %n
+  %nv = load i64, i64* %nvp
+  %vp = getelementptr i64, i64* %values, i32 %i
+  store i64 %nv, i64* %vp
+  %d = sub i32 %nd, 1
+  %dp = getelementptr i32, i32* %dists, i32 %i
+  store i32 %d, i32* %dp
+  br label %shift
+clear:
+  %cp = getelementptr i32, i32* %dists, i32 %i
+  store i32 0, i32* %cp
+  %count_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 4
+  %count = load i32, i32* %count_ptr
+  %count1 = sub i32 %count, 1
+  store i32 %count1, i32* %count_ptr
+  %str_keys_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 5
+  %str_keys = load i1, i1* %str_keys_ptr
+  br i1 %str_keys, label %release, label %removed_done
+release:
+  %removed_str = inttoptr i64 %removed to i8*
+  call void @hb_release(i8* %removed_str)
+  br label %removed_done
+removed_done:
+  ret i1 true
+none:
+  ret i1 false
+}
+
+define linkonce_odr i32 @hb_map_len(%hb_map* %m) nounwind readonly {
+entry:
+  %count_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 4
+  %count = load i32, i32* %count_ptr
+  ret i32 %count
+}
+
+; the first used slot from slot on, or -1 if there is none, for iterating over a map
+define linkonce_odr i32 @hb_map_next(%hb_map* %m, i32 %slot) nounwind readonly {
+entry:
+  %dists_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 2
+  %dists = load i32*, i32** %dists_ptr
+  %cap_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 3
+  %cap = load i32, i32* %cap_ptr
+  br label %loop
+loop:
+  %i = phi i32 [ %slot, %entry ], [ %i2, %empty ]
+  %more = icmp ult i32 %i, %cap
+  br i1 %more, label %check, label %end
+check:
+  %dp = getelementptr i32, i32* %dists, i32 %i
+  %d = load i32, i32* %dp
+  %used = icmp ne i32 %d, 0
+  br i1 %used, label %found, label %empty
+empty:
+  %i2 = add i32 %i, 1
+  br label %loop
+found:
+  ret i32 %i
+end:
+  ret i32 -1
+}
+
+define linkonce_odr i64 @hb_map_key_at(%hb_map* %m, i32 %slot) nounwind readonly {
+entry:
+  %keys_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 0
+  %keys = load i64*, i64** %keys_ptr
+  %kp = getelementptr i64, i64* %keys, i32 %slot
+  %k = load i64, i64* %kp
+  ret i64 %k
+}
+
+define linkonce_odr i64 @hb_map_value_at(%hb_map* %m, i32 %slot) nounwind readonly {
+entry:
+  %values_ptr = getelementptr %hb_map, %hb_map* %m, i32 0, i32 1
+  %values = load i64*, i64** %values_ptr
+  %vp = getelementptr i64, i64* %values, i32 %slot
+  %v = load i64, i64* %vp
+  ret i64 %v
+}
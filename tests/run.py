@@ -0,0 +1,40 @@
+import glob
+import os
+import subprocess
+import sys
+
+"""
+Regression tests, every test_*.hb in this folder is run with the JIT and has to return 0 from main.
+A test returns the number of the first check that failed.
+Every error_*.hb has to be rejected with the Heiabubu error its first line expects, like
+    # expect: Cannot operate with - on str
+The other files here are imported by the tests. Run from anywhere with: python tests/run.py
+"""
+
+
+def main() -> int:
+    directory = os.path.dirname(os.path.abspath(__file__))
+    compiler = os.path.join(directory, '..', 'main.py')
+    failed = 0
+    paths = glob.glob(os.path.join(directory, 'test_*.hb')) + glob.glob(os.path.join(directory, 'error_*.hb'))
+    for path in sorted(paths):
+        name = os.path.basename(path)
+        result = subprocess.run([sys.executable, compiler, name, '-run'], cwd=directory, capture_output=True, text=True)
+        lines = result.stdout.strip().splitlines()
+        if name.startswith('error_'):
+            with open(path) as f:
+                expected = f.readline().removeprefix('# expect:').strip()
+            passed = result.returncode != 0 and expected in result.stdout
+        else:
+            passed = result.returncode == 0 and lines and lines[-1] == 'Returned 0'
+        if not passed:
+            failed += 1
+            print(f'FAIL {name}\n{result.stdout}{result.stderr}')
+        else:
+            print(f'ok   {name}')
+    print(f'{failed} failed' if failed else 'all passed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())